@@ -2,8 +2,10 @@ from flask import Flask
 from config import Config
 from app.extensions import db, bcrypt, mail, oauth, login_manager
 from app.models import User
-from app.services.ai_service import train_model
+from app.services.ai_service import ensure_model
 import os
+import multiprocessing
+import threading
 from email_validator import validate_email, EmailNotValidError
 
 def create_app(config_class=Config):
@@ -49,9 +51,19 @@ def create_app(config_class=Config):
     app.register_blueprint(therapist_bp)
     app.register_blueprint(admin_bp)
 
+    from app.cli import register_commands
+    register_commands(app)
+
+    from app.services import user_cache
+    user_cache.register(app)
+    from app.services.appointment_service import upcoming_sessions_cache
+    upcoming_sessions_cache.ttl = app.config.get('UPCOMING_SESSIONS_CACHE_TTL_SECONDS', 60)
+    from app.services import game_service
+    game_service.register(app)
+
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return user_cache.load_cached_user(user_id)
 
     # Initialize database and admin user
     with app.app_context():
@@ -77,11 +89,64 @@ def create_app(config_class=Config):
                 conn.execute(text("ALTER TABLE session_metrics ADD COLUMN session_id INTEGER REFERENCES appointment(id)"))
             if not has_column('session_metrics', 'game_id'):
                 conn.execute(text("ALTER TABLE session_metrics ADD COLUMN game_id INTEGER REFERENCES game(id)"))
+            if not has_column('session_metrics', 'model_version'):
+                conn.execute(text("ALTER TABLE session_metrics ADD COLUMN model_version VARCHAR(40)"))
+            if not has_column('session_metrics', 'confidence'):
+                conn.execute(text("ALTER TABLE session_metrics ADD COLUMN confidence FLOAT"))
+            if not has_column('patient_model_state', 'ewma_fatigue'):
+                conn.execute(text("ALTER TABLE patient_model_state ADD COLUMN ewma_fatigue FLOAT"))
+            if not has_column('appointment', 'games_total'):
+                conn.execute(text("ALTER TABLE appointment ADD COLUMN games_total INTEGER NOT NULL DEFAULT 0"))
+                conn.execute(text("ALTER TABLE appointment ADD COLUMN games_played INTEGER NOT NULL DEFAULT 0"))
+                conn.execute(text(
+                    "UPDATE appointment SET "
+                    "games_total = (SELECT count(*) FROM appointment_game ag WHERE ag.appointment_id = appointment.id), "
+                    "games_played = (SELECT count(*) FROM appointment_game ag WHERE ag.appointment_id = appointment.id AND ag.status = 'completed')"
+                ))
+                conn.commit()
+            if not has_column('appointment', 'series_id'):
+                conn.execute(text("ALTER TABLE appointment ADD COLUMN series_id INTEGER REFERENCES appointment_series(id)"))
+            if not has_column('appointment', 'occurrence_start'):
+                conn.execute(text("ALTER TABLE appointment ADD COLUMN occurrence_start DATETIME"))
+            conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_appointment_series_occurrence ON appointment (series_id, occurrence_start)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_appointment_therapist_start ON appointment (therapist_id, start_time)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_appointment_game_appointment_id ON appointment_game (appointment_id)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_notification_user_read_ts ON notification (user_id, is_read, timestamp)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_session_metrics_user_date ON session_metrics (user_id, date)"))
             conn.close()
         except Exception as e:
             app.logger.warning(f"Schema migration warning: {e}")
+
+        # One-time move of Appointment.games JSON into AppointmentGame rows
+        try:
+            from app.services.game_assignment_service import GameAssignmentService
+            migrated = GameAssignmentService().backfill()
+            if migrated:
+                app.logger.info(f"Backfilled game assignments for {migrated} sessions")
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f"Game assignment backfill warning: {e}")
+
+        # One-time move of User.game_profile JSON into bounded GameProfile rows
+        try:
+            from app.services.game_profile_service import GameProfileService
+            migrated = GameProfileService().backfill()
+            if migrated:
+                app.logger.info(f"Compacted game profiles for {migrated} users")
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f"Game profile backfill warning: {e}")
         
-        train_model()
+        # Hashed, precompressed copies of new or edited games
+        try:
+            from app.services.game_asset_service import game_assets
+            published = game_assets.sync()
+            if published:
+                app.logger.info(f"Published {published} game assets")
+        except Exception as e:
+            app.logger.warning(f"Game asset publish warning: {e}")
+
+        ensure_model()
         
         # Create admin user
         admin_email_env = (os.getenv('ADMIN_EMAIL') or '').strip()
@@ -120,4 +185,30 @@ def create_app(config_class=Config):
                 db.session.commit()
                 print(f"Admin user ensured/updated: {admin_email}")
 
+    # Processes spawned by multiprocessing (the password hashing pool) re-import the entry module,
+    # which may build the app too; they never serve
+    if app.config.get('START_BACKGROUND_WORKERS', True) and multiprocessing.parent_process() is None:
+        if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+            # Every `flask` command loads the app, but only `flask run` serves requests: start the
+            # workers with its first request so one-shot commands (send-emails, run-generation-jobs)
+            # drain the queues alone
+            start_lock = threading.Lock()
+
+            @app.before_request
+            def _start_workers_when_serving():
+                if not start_lock.locked() and start_lock.acquire(blocking=False):
+                    start_background_workers(app)
+        else:
+            start_background_workers(app)
+
     return app
+
+def start_background_workers(app):
+    """Email outbox senders and AI game generators of this serving process."""
+    if app.config.get('EMAIL_OUTBOX_WORKERS', 0) > 0:
+        from app.services.email_outbox_service import email_outbox
+        email_outbox.start(app)
+
+    if app.config.get('GAME_GENERATION_WORKERS', 0) > 0:
+        from app.services.game_generation_service import game_generation
+        game_generation.start(app)
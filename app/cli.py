@@ -0,0 +1,209 @@
+import click
+from flask import current_app
+from app.services.notification_service import NotificationService
+from app.services.email_outbox_service import email_outbox
+
+def register_commands(app):
+    """Attach maintenance commands to `flask`. Meant to be run from cron."""
+
+    @app.cli.command('purge-notifications')
+    @click.option('--days', type=int, default=None, help='Edad mínima (días) de notificaciones leídas a eliminar.')
+    def purge_notifications(days):
+        """Delete read notifications older than the retention window."""
+        if days is None:
+            days = current_app.config.get('NOTIFICATION_RETENTION_DAYS', 30)
+        deleted = NotificationService().purge_expired(days)
+        click.echo(f"Notificaciones eliminadas: {deleted} (leídas, más de {days} días)")
+
+    @app.cli.command('send-emails')
+    def send_emails():
+        """Deliver every due message in the email outbox, then exit."""
+        handled = email_outbox.drain()
+        click.echo(f"Correos procesados: {handled}")
+
+    @app.cli.command('purge-emails')
+    @click.option('--days', type=int, default=None, help='Edad mínima (días) de correos enviados o fallidos a eliminar.')
+    def purge_emails(days):
+        """Delete sent and failed outbox messages older than the retention window."""
+        if days is None:
+            days = current_app.config.get('EMAIL_OUTBOX_RETENTION_DAYS', 30)
+        deleted = email_outbox.purge(days)
+        click.echo(f"Correos eliminados: {deleted} (enviados o fallidos, más de {days} días)")
+
+    @app.cli.command('run-generation-jobs')
+    def run_generation_jobs():
+        """Run every queued AI game generation, then exit."""
+        from app.services.game_generation_service import game_generation
+        handled = game_generation.drain()
+        click.echo(f"Juegos IA procesados: {handled}")
+
+    @app.cli.command('backfill-game-assignments')
+    def backfill_game_assignments():
+        """Move games stored in the legacy Appointment.games JSON into AppointmentGame rows."""
+        from app.services.game_assignment_service import GameAssignmentService
+        migrated = GameAssignmentService().backfill()
+        click.echo(f"Sesiones migradas a AppointmentGame: {migrated}")
+
+    @app.cli.command('segment-patients')
+    def segment_patients():
+        """Recompute patient segments (MiniBatchKMeans over per-patient aggregates)."""
+        from app.services.segmentation_service import SegmentationService
+        segmented = SegmentationService().run()
+        click.echo(f"Pacientes segmentados: {segmented}")
+
+    @app.cli.command('benchmark-adaptive')
+    @click.option('--synthetic', type=int, default=0, help='Simular N pacientes en lugar de reproducir session_metrics.')
+    @click.option('--base', type=click.Choice(['model', 'rules']), default='model',
+                  help='Modelo global: el SVC entrenado o las reglas expertas.')
+    def benchmark_adaptive(synthetic, base):
+        """Replay game history through the global model and the adaptive model and compare them."""
+        import json
+        from app.services.ai_service import get_expert_label, load_model
+        from app.services.model_benchmark import benchmark_adaptive, replay_history, simulate_history
+        if base == 'model':
+            model = load_model()
+            predict = lambda accuracy, time_ms: model.predict([[accuracy, time_ms]])[0]
+        else:
+            predict = get_expert_label
+        config = current_app.config
+        plays = simulate_history(patients=synthetic) if synthetic else replay_history()
+        report = benchmark_adaptive(plays, predict, alpha=config.get('ADAPTIVE_EWMA_ALPHA', 0.3),
+                                    min_plays=config.get('ADAPTIVE_MIN_PLAYS', 5),
+                                    current_weight=config.get('ADAPTIVE_CURRENT_WEIGHT', 0.3))
+        click.echo(json.dumps(report, indent=2))
+
+    @app.cli.command('benchmark-models')
+    @click.option('--backend', 'backends', multiple=True, help='Backend a medir (repetible); por defecto todos.')
+    @click.option('--sizes', default='0,1000,5000', help='Puntos reales simulados añadidos al entrenamiento, separados por comas.')
+    @click.option('--from-db', is_flag=True, help='Entrenar con las métricas guardadas en lugar de puntos simulados.')
+    def benchmark_models(backends, sizes, from_db):
+        """Compare model backends: fit time, memory, predict latency and agreement with the expert rules."""
+        from app.models import SessionMetrics, db
+        from app.services.model_benchmark import benchmark_backends
+        real_data = None
+        if from_db:
+            real_data = [[acc, avg_time * 1000] for acc, avg_time in
+                         db.session.query(SessionMetrics.accurracy, SessionMetrics.avg_time)]
+        results = benchmark_backends(backends or None, [int(n) for n in sizes.split(',') if n.strip()], real_data)
+        click.echo(f"{'backend':<8} {'reales':>7} {'fit s':>8} {'pico KB':>9} {'modelo KB':>10} "
+                   f"{'p50 ms':>7} {'p95 ms':>7} {'lote us':>8} {'acuerdo':>8}")
+        for r in results:
+            click.echo(f"{r['backend']:<8} {r['real_points']:>7} {r['fit_s']:>8} {r['fit_peak_kb']:>9} {r['model_kb']:>10} "
+                       f"{r['predict']['p50_ms']:>7} {r['predict']['p95_ms']:>7} {r['batch_us_per_row']:>8} {r['expert_agreement']:>8}")
+
+    @app.cli.command('compile-grid')
+    def compile_grid():
+        """Recompile the decision grid from the saved model and report how far it drifts from it."""
+        import time
+        from app.services.ai_service import compile_grid, load_model
+        model = load_model()
+        grid = compile_grid()
+        report = grid.report(model)
+        started = time.perf_counter()
+        for i in range(100000):
+            grid.predict(i % 100, i % 4000)
+        grid_ns = (time.perf_counter() - started) * 1e4
+        started = time.perf_counter()
+        for i in range(200):
+            model.predict([[i % 100, i % 4000]])
+        model_ns = (time.perf_counter() - started) * 5e6
+        click.echo(f"Celdas: {report['cells']} ({report['kb']} KB)")
+        click.echo(f"Desacuerdo rejilla/modelo: {report['disagreement']:.3%} en {report['samples']} puntos")
+        click.echo(f"Acuerdo con reglas expertas: rejilla {report['grid_expert_agreement']:.2%}, modelo {report['model_expert_agreement']:.2%}")
+        click.echo(f"Predicción: rejilla {grid_ns:.0f} ns, modelo {model_ns / 1000:.0f} us")
+
+    @app.cli.command('evaluate-model')
+    @click.option('--version', default=None, help='Versión a evaluar; por defecto la activa.')
+    @click.option('--snapshot', type=click.Path(exists=True, dir_okay=False), default=None,
+                  help='Copia SQLite de la base de datos (se abre en solo lectura) en lugar de la configurada.')
+    @click.option('--folds', type=int, default=None, help='Ventanas de evaluación (por defecto AI_EVAL_FOLDS).')
+    def evaluate_model(version, snapshot, folds):
+        """Walk-forward evaluation of a model version on the game history; stored in its meta.json."""
+        from app.services.evaluation_service import ModelEvaluationService
+        try:
+            result = ModelEvaluationService().run(version, snapshot, folds)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Versión {result['version']} ({result['backend']}): {result['plays']} partidas de "
+                   f"{result['patients']} pacientes, {result['folds']} ventanas")
+        for window in result['windows']:
+            click.echo(f"  entrenamiento {window['train']:>7}  prueba {window['test']:>6}  acierto {window['label_accuracy']:.2%}")
+        next_play = result['next_play_accuracy']
+        click.echo(f"Acierto: {result['label_accuracy']:.2%} (siguiente partida: "
+                   f"{'-' if next_play is None else f'{next_play:.2%}'})")
+        click.echo(f"Calibración: Brier {result['brier']}, ECE {result['ece']}")
+        for name, summary in result['latency'].items():
+            click.echo(f"Latencia {name}: p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms")
+
+    @app.cli.command('model-versions')
+    def model_versions():
+        """List the retained difficulty model versions, newest first."""
+        from app.services.ai_service import model_store
+        store = model_store()
+        current = store.current()
+        pinned = store.pinned()
+        for version in reversed(store.versions()):
+            meta = store.meta(version)
+            marker = '*' if version == current else ' '
+            click.echo(f"{marker} {version}  {meta.get('backend', '?'):<7} entrenamiento={meta.get('train_size', '?')} "
+                       f"reales={meta.get('real_points', '?')} métricas={meta.get('metrics', {})}"
+                       f"{'  [fijada]' if version == pinned else ''}")
+        if pinned:
+            click.echo(f"Versión fijada: {pinned} (los reentrenamientos no la sustituyen; `flask model-unpin`)")
+
+    @app.cli.command('model-rollback')
+    @click.argument('version')
+    def model_rollback(version):
+        """Make VERSION the active difficulty model again and pin it until `model-unpin`."""
+        from app.services.ai_service import model_store
+        try:
+            model_store().pin(version)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Modelo activo y fijado: {version}")
+
+    @app.cli.command('model-unpin')
+    def model_unpin():
+        """Let retraining activate new difficulty model versions again."""
+        from app.services.ai_service import model_store
+        version = model_store().unpin()
+        click.echo(f"Versión liberada: {version}; el próximo reentrenamiento la sustituirá" if version
+                   else "No hay ninguna versión fijada")
+
+    @app.cli.command('gemini-stub')
+    @click.option('--port', type=int, default=8765, help='Puerto local del servidor Gemini falso.')
+    @click.option('--delay', type=float, default=0.0, help='Segundos de espera antes de cada respuesta.')
+    @click.option('--status', type=int, default=200, help='Código HTTP devuelto (p. ej. 503 para simular una caída).')
+    def gemini_stub(port, delay, status):
+        """Run a local fake Gemini API that echoes prompts, for offline testing of the gateway."""
+        import time
+        from app.services.gemini_stub import FakeGeminiServer
+        stub = FakeGeminiServer(port=port, delay=delay, status=status).start()
+        click.echo(f"Gemini falso escuchando en http://127.0.0.1:{stub.port} (Ctrl+C para salir)")
+        seen = 0
+        try:
+            while True:
+                time.sleep(0.5)
+                for req in stub.requests[seen:]:
+                    click.echo(f"--- {req['path']}\n{req['prompt'][:300]}")
+                seen = len(stub.requests)
+        except KeyboardInterrupt:
+            stub.stop()
+
+    @app.cli.command('smtp-sink')
+    @click.option('--port', type=int, default=1025, help='Puerto local del servidor SMTP falso.')
+    def smtp_sink(port):
+        """Run a local fake SMTP server that prints every received message."""
+        import time
+        from app.services.smtp_sink import FakeSMTPServer
+        sink = FakeSMTPServer(port=port).start()
+        click.echo(f"SMTP falso escuchando en 127.0.0.1:{sink.port} (Ctrl+C para salir)")
+        seen = 0
+        try:
+            while True:
+                time.sleep(0.5)
+                for msg in sink.messages[seen:]:
+                    click.echo(f"--- {msg['subject']} -> {', '.join(msg['recipients'])}\n{msg['body']}")
+                seen = len(sink.messages)
+        except KeyboardInterrupt:
+            sink.stop()
@@ -1,5 +1,6 @@
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy.orm import deferred
 from app.extensions import db
 
 class User(db.Model, UserMixin):
@@ -18,14 +19,49 @@ class User(db.Model, UserMixin):
     date_of_birth = db.Column(db.Date, nullable=True)
     guardian_name = db.Column(db.String(150), nullable=True)
     guardian_contact = db.Column(db.String(150), nullable=True)
-    therapy_goals = db.Column(db.Text, nullable=True)
+    # Wide text columns load on first access only
+    therapy_goals = deferred(db.Column(db.Text, nullable=True))
     timezone = db.Column(db.String(100), nullable=True)
-    notes = db.Column(db.Text, nullable=True)
+    notes = deferred(db.Column(db.Text, nullable=True))
     # Assigned therapist relationship (optional for patients)
     assigned_therapist_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     assigned_therapist = db.relationship('User', remote_side=[id], backref=db.backref('assigned_patients', lazy=True))
-    # JSON string for AI-generated game profile/config per user
-    game_profile = db.Column(db.Text, nullable=True)
+    # Legacy JSON game profile; moved to GameProfile at startup and then cleared
+    game_profile = deferred(db.Column(db.Text, nullable=True))
+
+class GameProfile(db.Model):
+    """Per-patient game data, loaded only by the code that needs it.
+
+    Lifetime and per-game totals are running sums, so `recent` can stay a bounded ring
+    buffer: entries dropped from it are already counted in the aggregates.
+    """
+    __tablename__ = 'game_profile'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    config = db.Column(db.Text, nullable=True)  # JSON config of the last AI-generated game
+    plays = db.Column(db.Integer, default=0, nullable=False)
+    accuracy_sum = db.Column(db.Float, default=0.0, nullable=False)
+    time_ms_sum = db.Column(db.Float, default=0.0, nullable=False)
+    per_game = db.Column(db.Text, nullable=True)  # JSON {game_name: [plays, accuracy_sum, time_ms_sum]}
+    recent = db.Column(db.Text, nullable=True)  # JSON list, newest last, capped at GAME_PROFILE_RECENT_LIMIT
+    last_session_kpis = db.Column(db.Text, nullable=True)  # JSON {avg_accuracy, avg_time_ms, plays}
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class PatientModelState(db.Model):
+    """Online statistics of one patient for the adaptive difficulty model, updated on every play.
+
+    Accuracy and reaction time are exponentially weighted moving averages, so each play updates
+    the row in constant time regardless of how long the patient's history is.
+    """
+    __tablename__ = 'patient_model_state'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    plays = db.Column(db.Integer, default=0, nullable=False)
+    ewma_accuracy = db.Column(db.Float, default=0.0, nullable=False)
+    ewma_time_ms = db.Column(db.Float, default=0.0, nullable=False)
+    trend_accuracy = db.Column(db.Float, default=0.0, nullable=False)  # smoothed change of ewma_accuracy per play
+    trend_time_ms = db.Column(db.Float, default=0.0, nullable=False)
+    contexts = db.Column(db.Text, nullable=True)  # JSON {"g:<game_id>" | "h:<day part>": [plays, ewma_accuracy, ewma_time_ms]}
+    ewma_fatigue = db.Column(db.Float, nullable=True)  # of SessionTrials.fatigue_score, None until a game sends trials
+    last_played_at = db.Column(db.DateTime, nullable=True)
 
 class Game(db.Model):
     __tablename__ = 'game'
@@ -40,15 +76,18 @@ class Game(db.Model):
 class AppointmentGame(db.Model):
     __tablename__ = 'appointment_game'
     id = db.Column(db.Integer, primary_key=True)
-    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False, index=True)
     game_id = db.Column(db.Integer, db.ForeignKey('game.id'), nullable=False)
     config = db.Column(db.Text, nullable=True) # JSON for specific game config (difficulty, etc)
     status = db.Column(db.String(50), default='pending') # pending, completed
     
-    appointment = db.relationship('Appointment', backref=db.backref('appointment_games', lazy=True))
+    appointment = db.relationship('Appointment', backref=db.backref('appointment_games', lazy=True, order_by='AppointmentGame.id', cascade='all, delete-orphan'))
     game = db.relationship('Game', backref=db.backref('game_appointments', lazy=True))
 
 class SessionMetrics(db.Model):
+    __table_args__ = (
+        db.Index('ix_session_metrics_user_date', 'user_id', 'date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     session_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=True)
@@ -57,14 +96,83 @@ class SessionMetrics(db.Model):
     accurracy = db.Column(db.Float, nullable=False)
     avg_time = db.Column(db.Float, nullable=False)
     prediction = db.Column(db.Integer, nullable=False)
+    model_version = db.Column(db.String(40), nullable=True)  # ModelStore version that made the prediction
+    confidence = db.Column(db.Float, nullable=True)  # model probability (0-100) of the prediction, for the features it was shown
     date = db.Column(db.DateTime, default=datetime.utcnow)
     
     game = db.relationship('Game', backref=db.backref('metrics', lazy=True))
 
+class SessionTrials(db.Model):
+    """Per-trial reaction times of one saved game and the fatigue indicators computed from them.
 
+    Kept beside session_metrics so the metrics table stays narrow: the times are one packed
+    little-endian float32 blob (4 bytes per trial) that is only read to recompute indicators.
+    """
+    __tablename__ = 'session_trials'
+    __table_args__ = (
+        db.Index('ix_session_trials_user_date', 'user_id', 'date'),
+    )
+    metric_id = db.Column(db.Integer, db.ForeignKey('session_metrics.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    trials = db.Column(db.Integer, nullable=False)
+    reaction_times = db.Column(db.LargeBinary, nullable=False)  # float32 ms, see FatigueService.pack
+    rt_slope_ms = db.Column(db.Float, nullable=True)  # least-squares change of reaction time per trial
+    slowdown = db.Column(db.Float, nullable=True)  # relative reaction time increase from first to last trial
+    variance_drift = db.Column(db.Float, nullable=True)  # coefficient of variation, second half minus first half
+    fatigue_score = db.Column(db.Float, nullable=True)  # 0-1; None when there were too few trials
+    date = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PatientSegment(db.Model):
+    """Latest segmentation run: one row per clustered patient with the features it was clustered on.
+
+    Segments are numbered from strongest (0) to weakest, so ids and names stay comparable
+    between runs.
+    """
+    __tablename__ = 'patient_segment'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    segment = db.Column(db.Integer, nullable=False, index=True)
+    name = db.Column(db.String(50), nullable=False)
+    plays = db.Column(db.Integer, nullable=False)
+    avg_accuracy = db.Column(db.Float, nullable=False)
+    avg_time_ms = db.Column(db.Float, nullable=False)
+    accuracy_std = db.Column(db.Float, nullable=False)
+    recent_delta = db.Column(db.Float, nullable=False)  # recent average accuracy minus lifetime average
+    support_rate = db.Column(db.Float, nullable=False)  # share of plays that got "Retroceder/Apoyo"
+    distance = db.Column(db.Float, nullable=False)  # to the segment centre, in standardized units
+    computed_at = db.Column(db.DateTime, nullable=False)
+
+
+
+class AppointmentSeries(db.Model):
+    """Recurring sessions stored once as an RRULE; occurrences are expanded per calendar window."""
+    __tablename__ = 'appointment_series'
+    id = db.Column(db.Integer, primary_key=True)
+    therapist_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    title = db.Column(db.String(200), nullable=True)
+    location = db.Column(db.String(200), nullable=True)
+    notes = db.Column(db.Text, nullable=True)
+    games = db.Column(db.Text, nullable=True)
+    # RRULE body without DTSTART, e.g. FREQ=WEEKLY;BYDAY=MO,WE;COUNT=12
+    rrule = db.Column(db.String(255), nullable=False)
+    dtstart = db.Column(db.DateTime, nullable=False)
+    duration_minutes = db.Column(db.Integer, nullable=False, default=60)
+    # IANA timezone the rule is evaluated in (therapist's by default)
+    timezone = db.Column(db.String(100), nullable=True)
+    # Start of the last occurrence, None for open-ended series
+    until = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    therapist = db.relationship('User', foreign_keys=[therapist_id])
+    patient = db.relationship('User', foreign_keys=[patient_id])
 
 class Appointment(db.Model):
     __tablename__ = 'appointment'
+    __table_args__ = (
+        db.Index('ix_appointment_series_occurrence', 'series_id', 'occurrence_start', unique=True),
+        db.Index('ix_appointment_therapist_start', 'therapist_id', 'start_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     therapist_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     patient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -74,29 +182,30 @@ class Appointment(db.Model):
     status = db.Column(db.String(50), default='scheduled')  # scheduled, completed, cancelled
     location = db.Column(db.String(200), nullable=True)
     notes = db.Column(db.Text, nullable=True)
-    # JSON string list of assigned games for this session
+    # Legacy JSON list of assigned games; moved to AppointmentGame by GameAssignmentService.backfill()
     games = db.Column(db.Text, nullable=True)
+    # Progress counters kept in step with AppointmentGame rows by GameAssignmentService
+    games_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    games_played = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Set on occurrences of a series that were edited or completed (materialized)
+    series_id = db.Column(db.Integer, db.ForeignKey('appointment_series.id'), nullable=True)
+    occurrence_start = db.Column(db.DateTime, nullable=True)
 
     therapist = db.relationship('User', foreign_keys=[therapist_id], backref=db.backref('appointments_as_therapist', lazy=True))
     patient = db.relationship('User', foreign_keys=[patient_id], backref=db.backref('appointments_as_patient', lazy=True))
+    series = db.relationship('AppointmentSeries', backref=db.backref('overrides', lazy=True))
 
     @property
     def games_list(self):
-        """Returns list of game filenames from relationship, falling back to legacy JSON."""
-        if self.appointment_games:
-            return [ag.game.filename for ag in self.appointment_games]
-        # Fallback
-        if self.games:
-            import json
-            try:
-                return json.loads(self.games)
-            except:
-                return []
-        return []
+        """Assigned game filenames. Load with game_assignment_service.games_loader() to avoid per-row queries."""
+        return [ag.game.filename for ag in self.appointment_games]
 
 class Notification(db.Model):
+    __table_args__ = (
+        db.Index('ix_notification_user_read_ts', 'user_id', 'is_read', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     message = db.Column(db.String(255), nullable=False)
@@ -121,3 +230,46 @@ class Message(db.Model):
     sender = db.relationship('User', foreign_keys=[sender_id], backref=db.backref('sent_messages', lazy=True))
     receiver = db.relationship('User', foreign_keys=[receiver_id], backref=db.backref('received_messages', lazy=True))
     replies = db.relationship('Message', backref=db.backref('parent', remote_side=[id]), lazy=True)
+
+
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next', 'status', 'next_attempt_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(150), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.String(500), nullable=True)
+    claimed_by = db.Column(db.String(64), nullable=True)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+class GameGenerationJob(db.Model):
+    __tablename__ = 'game_generation_job'
+    __table_args__ = (
+        db.Index('ix_game_generation_job_status_next', 'status', 'next_attempt_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    requested_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    target_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    prompt = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, running, done, failed
+    stage = db.Column(db.String(20), default='queued', nullable=False)  # queued, kpis, generating, saving, done
+    progress = db.Column(db.Integer, default=0, nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    claimed_by = db.Column(db.String(64), nullable=True)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # lease expiry while running
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id'), nullable=True)
+    filename = db.Column(db.String(100), nullable=True)
+    config = db.Column(db.Text, nullable=True)
+    fallback = db.Column(db.Boolean, default=False, nullable=False)
+    error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
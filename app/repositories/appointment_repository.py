@@ -17,3 +17,14 @@ class AppointmentRepository:
             Appointment.start_time >= datetime.utcnow(),
             Appointment.status == 'scheduled'
         ).order_by(Appointment.start_time).limit(limit).all()
+
+    @staticmethod
+    def busy_intervals(therapist_ids, start_dt, end_dt, lookback):
+        """(therapist_id, start_time, end_time) of non-cancelled sessions that may overlap the
+        window, as one range scan per therapist on (therapist_id, start_time)."""
+        return db.session.query(Appointment.therapist_id, Appointment.start_time, Appointment.end_time).filter(
+            Appointment.therapist_id.in_(therapist_ids),
+            Appointment.start_time >= start_dt - lookback,
+            Appointment.start_time < end_dt,
+            Appointment.status != 'cancelled'
+        ).all()
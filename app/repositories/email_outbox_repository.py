@@ -0,0 +1,82 @@
+from app.models import EmailOutbox, db
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+import uuid
+
+class EmailOutboxRepository:
+    @staticmethod
+    def enqueue(recipient, subject, body):
+        item = EmailOutbox(recipient=recipient, subject=subject, body=body)
+        db.session.add(item)
+        db.session.commit()
+        return item
+
+    @staticmethod
+    def enqueue_many(messages):
+        items = [EmailOutbox(recipient=r, subject=s, body=b) for r, s, b in messages]
+        db.session.add_all(items)
+        db.session.commit()
+        return items
+
+    @staticmethod
+    def claim_batch(limit, lease_seconds):
+        """Lease up to `limit` due messages for this worker.
+
+        Rows left in 'sending' by a crashed worker become due again once their lease expires.
+        """
+        now = datetime.utcnow()
+        due = or_(EmailOutbox.status == 'pending', EmailOutbox.status == 'sending')
+        ids = [row.id for row in db.session.query(EmailOutbox.id).filter(
+            due, EmailOutbox.next_attempt_at <= now
+        ).order_by(EmailOutbox.next_attempt_at.asc()).limit(limit).all()]
+        if not ids:
+            return []
+
+        token = uuid.uuid4().hex
+        EmailOutbox.query.filter(
+            EmailOutbox.id.in_(ids), due, EmailOutbox.next_attempt_at <= now
+        ).update({
+            'status': 'sending',
+            'claimed_by': token,
+            'next_attempt_at': now + timedelta(seconds=lease_seconds)
+        }, synchronize_session=False)
+        db.session.commit()
+        return EmailOutbox.query.filter_by(claimed_by=token, status='sending').all()
+
+    @staticmethod
+    def mark_sent(item):
+        item.status = 'sent'
+        item.sent_at = datetime.utcnow()
+        item.attempts += 1
+        item.last_error = None
+        # Bodies may carry temporary credentials; keep only the delivery record
+        item.body = None
+
+    @staticmethod
+    def mark_failed(item, error, retry_at=None):
+        item.attempts += 1
+        item.last_error = str(error)[:500]
+        if retry_at is None:
+            item.status = 'failed'
+            # Never delivered: drop the body (it may carry temporary credentials) like mark_sent
+            item.body = None
+        else:
+            item.status = 'pending'
+            item.next_attempt_at = retry_at
+
+    @staticmethod
+    def count_pending():
+        return EmailOutbox.query.filter(or_(EmailOutbox.status == 'pending', EmailOutbox.status == 'sending')).count()
+
+    @staticmethod
+    def purge_older_than(cutoff):
+        """Delete sent and failed messages finished before `cutoff`; also clears the body of any
+        failed row still holding one."""
+        EmailOutbox.query.filter(EmailOutbox.status == 'failed', EmailOutbox.body.isnot(None))\
+            .update({'body': None}, synchronize_session=False)
+        deleted = EmailOutbox.query.filter(or_(
+            (EmailOutbox.status == 'sent') & (EmailOutbox.sent_at < cutoff),
+            (EmailOutbox.status == 'failed') & (EmailOutbox.created_at < cutoff)
+        )).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
@@ -0,0 +1,97 @@
+from app.models import GameGenerationJob, db
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+import uuid
+
+class GameGenerationJobRepository:
+    @staticmethod
+    def enqueue(requested_by, target_user_id, name, prompt):
+        job = GameGenerationJob(requested_by=requested_by, target_user_id=target_user_id, name=name, prompt=prompt)
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    @staticmethod
+    def get(job_id):
+        return db.session.get(GameGenerationJob, job_id)
+
+    @staticmethod
+    def count_active_by_requester(user_id):
+        return GameGenerationJob.query.filter(
+            GameGenerationJob.requested_by == user_id,
+            or_(GameGenerationJob.status == 'pending', GameGenerationJob.status == 'running')
+        ).count()
+
+    @staticmethod
+    def claim(lease_seconds):
+        """Lease the oldest due job for this worker, None if there is none.
+
+        Jobs left in 'running' by a crashed worker become due again once their lease expires.
+        """
+        now = datetime.utcnow()
+        due = or_(GameGenerationJob.status == 'pending', GameGenerationJob.status == 'running')
+        row = db.session.query(GameGenerationJob.id).filter(
+            due, GameGenerationJob.next_attempt_at <= now
+        ).order_by(GameGenerationJob.next_attempt_at.asc(), GameGenerationJob.id.asc()).first()
+        if row is None:
+            return None
+
+        token = uuid.uuid4().hex
+        claimed = GameGenerationJob.query.filter(
+            GameGenerationJob.id == row.id, due, GameGenerationJob.next_attempt_at <= now
+        ).update({
+            'status': 'running',
+            'claimed_by': token,
+            'attempts': GameGenerationJob.attempts + 1,
+            'started_at': now,
+            'next_attempt_at': now + timedelta(seconds=lease_seconds)
+        }, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            # Another worker won the race; the caller simply polls again
+            return None
+        return GameGenerationJob.query.filter_by(id=row.id, claimed_by=token).first()
+
+    @staticmethod
+    def _owned(job, token):
+        """The job row, only while it is still running under the lease `token`."""
+        return GameGenerationJob.query.filter(
+            GameGenerationJob.id == job.id,
+            GameGenerationJob.claimed_by == token,
+            GameGenerationJob.status == 'running'
+        )
+
+    @classmethod
+    def set_stage(cls, job, token, stage, progress, lease_seconds):
+        """Record progress and renew the lease. Returns False when the lease was lost."""
+        renewed = cls._owned(job, token).update({
+            'stage': stage,
+            'progress': progress,
+            'next_attempt_at': datetime.utcnow() + timedelta(seconds=lease_seconds)
+        }, synchronize_session=False)
+        db.session.commit()
+        return bool(renewed)
+
+    @classmethod
+    def mark_done(cls, job, token, game, config, fallback):
+        """Store the result unless the lease was lost (returns False). The caller commits."""
+        return bool(cls._owned(job, token).update({
+            'status': 'done',
+            'stage': 'done',
+            'progress': 100,
+            'game_id': game.id,
+            'filename': game.filename,
+            'config': config,
+            'fallback': fallback,
+            'error': None,
+            'finished_at': datetime.utcnow()
+        }, synchronize_session=False))
+
+    @classmethod
+    def mark_failed(cls, job, token, error):
+        """Record the failure unless the lease was lost (returns False). The caller commits."""
+        return bool(cls._owned(job, token).update({
+            'status': 'failed',
+            'error': str(error)[:500],
+            'finished_at': datetime.utcnow()
+        }, synchronize_session=False))
@@ -1,4 +1,5 @@
 from app.models import Notification, db
+from sqlalchemy import func
 
 class NotificationRepository:
     @staticmethod
@@ -9,10 +10,53 @@ class NotificationRepository:
         return notif
 
     @staticmethod
-    def get_unread_by_user(user_id):
-        return Notification.query.filter_by(user_id=user_id, is_read=False).order_by(Notification.timestamp.desc()).all()
+    def get_unread_by_user(user_id, limit=None, offset=0):
+        query = Notification.query.filter_by(user_id=user_id, is_read=False).order_by(Notification.timestamp.desc())
+        if limit is not None:
+            query = query.offset(offset).limit(limit)
+        return query.all()
+
+    @staticmethod
+    def get_unread_grouped_by_user(user_id, limit=20, offset=0):
+        """Unread notifications collapsed by (message, link), newest group first.
+
+        Returns rows with id (latest in the group), message, link, count and timestamp.
+        """
+        latest = func.max(Notification.timestamp)
+        return db.session.query(
+            func.max(Notification.id).label('id'),
+            Notification.message,
+            Notification.link,
+            func.count(Notification.id).label('count'),
+            latest.label('timestamp')
+        ).filter(
+            Notification.user_id == user_id,
+            Notification.is_read == False
+        ).group_by(Notification.message, Notification.link)\
+            .order_by(latest.desc())\
+            .offset(offset).limit(limit).all()
+
+    @staticmethod
+    def count_unread(user_id):
+        return Notification.query.filter_by(user_id=user_id, is_read=False).count()
 
     @staticmethod
     def mark_all_read(user_id):
         Notification.query.filter_by(user_id=user_id, is_read=False).update({'is_read': True})
         db.session.commit()
+
+    @staticmethod
+    def purge_read_older_than(cutoff, batch_size=1000):
+        """Delete read notifications older than cutoff in batches. Returns rows deleted."""
+        deleted = 0
+        while True:
+            ids = [row.id for row in db.session.query(Notification.id).filter(
+                Notification.is_read == True,
+                Notification.timestamp < cutoff
+            ).limit(batch_size).all()]
+            if not ids:
+                break
+            Notification.query.filter(Notification.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += len(ids)
+        return deleted
@@ -22,6 +22,15 @@ class UserRepository:
     def count_active_patients_by_therapist(therapist_id):
         return User.query.filter_by(role='jugador', is_active=True, assigned_therapist_id=therapist_id).count()
 
+    @staticmethod
+    def count_active_patients_grouped_by_therapist(therapist_ids=None):
+        """{therapist_id: active patient count} from one GROUP BY."""
+        query = db.session.query(User.assigned_therapist_id, db.func.count(User.id)).filter(
+            User.role == 'jugador', User.is_active.is_(True), User.assigned_therapist_id.isnot(None))
+        if therapist_ids is not None:
+            query = query.filter(User.assigned_therapist_id.in_(therapist_ids))
+        return dict(query.group_by(User.assigned_therapist_id).all())
+
     @staticmethod
     def save(user):
         db.session.add(user)
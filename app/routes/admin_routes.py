@@ -1,9 +1,9 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash
 from flask_login import login_required, current_user
 from app.models import User, Appointment, SessionMetrics, db
 from app.services.dashboard_service import DashboardService
+from app.services.game_service import game_catalog
 from sqlalchemy import func
-import os
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 dashboard_service = DashboardService()
@@ -34,12 +34,7 @@ def games():
     if current_user.role != 'admin':
         flash('Acceso denegado.', 'error')
         return redirect(url_for('main.dashboard'))
-    games_dir = os.path.join(current_app.root_path, 'static', 'games')
-    try:
-        files = [f for f in os.listdir(games_dir) if f.lower().endswith('.html')]
-    except Exception:
-        files = []
-    return render_template('admin/games.html', games=files, active_page='admin_games')
+    return render_template('admin/games.html', games=game_catalog.filenames(), active_page='admin_games')
 
 @admin_bp.route('/reports')
 @login_required
@@ -1,31 +1,51 @@
 from flask import Blueprint, request, jsonify, current_app, url_for
 from flask_login import login_required, current_user
-from app.models import db, User, Notification, Appointment, Message, Game, SessionMetrics
+from app.models import db, User, Notification, Appointment, AppointmentGame, AppointmentSeries, Message, SessionMetrics, GameProfile, GameGenerationJob, PatientModelState, PatientSegment, SessionTrials
 from app.services.appointment_service import AppointmentService
-from app.services.game_service import GameService
+from app.services.game_service import GameService, game_catalog
+from app.services.game_asset_service import game_assets
+from app.services.game_upload_service import GameUploadService, GameTooLarge
+from app.services.game_assignment_service import GameAssignmentService, UnknownGames, games_loader
 from app.services.admin_service import AdminService
+from app.services.availability_service import AvailabilityService
 from app.services.notification_service import NotificationService
 from app.services.patient_service import PatientService
 from app.services.dashboard_service import DashboardService
+from app.services.calendar_service import CalendarService, therapist_events_schema, therapist_day_schema, patient_events_schema
+from app.services.recurrence_service import RecurrenceService, series_schema
+from app.services.schedule_service import ScheduleService, ScheduleConflict
 from app.services.ai_service import predict_level, train_model
+from app.services.adaptive_service import AdaptiveService
+from app.services.fatigue_service import FatigueService
+from app.services.gemini_service import gemini_gateway, GeminiUnavailable
+from app.services.game_generation_service import game_generation, GenerationBusy
+from app.services.game_profile_service import GameProfileService
+from app.repositories.game_generation_job_repository import GameGenerationJobRepository
 from app.utils import get_user_today_utc_range, get_user_now
 from app.schemas import AssignTherapistSchema, UpdateUserSchema, SendMessageSchema
 from app.extensions import bcrypt
 from app.services.email_service import EmailService
+from app.services.password_service import password_service
 from datetime import datetime, timedelta
-import json
 import os
-import requests
-from sqlalchemy import or_, func
 
 api_bp = Blueprint('api', __name__)
 
 appointment_service = AppointmentService()
 game_service = GameService()
+game_upload_service = GameUploadService()
+game_assignment_service = GameAssignmentService()
+game_profile_service = GameProfileService()
+adaptive_service = AdaptiveService()
+fatigue_service = FatigueService()
 admin_service = AdminService()
+availability_service = AvailabilityService()
 notification_service = NotificationService()
 patient_service = PatientService()
 dashboard_service = DashboardService()
+calendar_service = CalendarService()
+recurrence_service = RecurrenceService()
+schedule_service = ScheduleService()
 
 def _parse_datetime(value):
     """Robust datetime parser for ISO and naive strings"""
@@ -51,6 +71,16 @@ def _parse_datetime(value):
                 continue
     return None
 
+def _conditional_json(etag, build):
+    """JSON response tagged with `etag`; answers 304 without calling `build` when the client has it."""
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @api_bp.route('/therapist/insights')
 @login_required
 def therapist_insights():
@@ -63,13 +93,36 @@ def therapist_insights():
 @api_bp.route('/notifications')
 @login_required
 def get_notifications():
-    notifications = notification_service.get_unread_notifications(current_user.id)
-    return jsonify([{
-        'id': n.id,
-        'message': n.message,
-        'timestamp': n.timestamp.strftime('%d %b, %H:%M'),
-        'link': n.link
-    } for n in notifications])
+    """Paginated unread notifications. Duplicates are collapsed into one entry with a count
+    unless grouped=0 is passed. The total unread count is returned in X-Total-Count."""
+    default_per_page = current_app.config.get('NOTIFICATIONS_PER_PAGE', 20)
+    max_per_page = current_app.config.get('NOTIFICATIONS_MAX_PER_PAGE', 100)
+    page = max(request.args.get('page', 1, type=int) or 1, 1)
+    per_page = min(max(request.args.get('per_page', default_per_page, type=int) or default_per_page, 1), max_per_page)
+    offset = (page - 1) * per_page
+
+    if request.args.get('grouped', '1') == '0':
+        rows = notification_service.get_unread_notifications(current_user.id, limit=per_page, offset=offset)
+        results = [{
+            'id': n.id,
+            'message': n.message,
+            'timestamp': n.timestamp.strftime('%d %b, %H:%M'),
+            'link': n.link,
+            'count': 1
+        } for n in rows]
+    else:
+        rows = notification_service.get_unread_grouped(current_user.id, limit=per_page, offset=offset)
+        results = [{
+            'id': n.id,
+            'message': n.message,
+            'timestamp': n.timestamp.strftime('%d %b, %H:%M'),
+            'link': n.link,
+            'count': n.count
+        } for n in rows]
+
+    response = jsonify(results)
+    response.headers['X-Total-Count'] = str(notification_service.count_unread(current_user.id))
+    return response
 
 @api_bp.route('/patients')
 @login_required
@@ -100,52 +153,26 @@ def api_get_sessions():
     if current_user.role != 'terapista':
         return jsonify({'error': 'Acceso denegado'}), 403
 
-    start = request.args.get('start')
-    end = request.args.get('end')
-    
-    if not start and not end:
-        # List view
-        # We can use a service method for this too if we want strict separation
-        # For now, let's use the service for the filtered query
-        pass
-
-    try:
-        start_dt = _parse_datetime(start)
-        end_dt = _parse_datetime(end)
-    except Exception:
-        start_dt = None
-        end_dt = None
+    start_dt = _parse_datetime(request.args.get('start'))
+    end_dt = _parse_datetime(request.args.get('end'))
 
     if start_dt and end_dt:
-        appts = appointment_service.get_therapist_appointments(current_user.id, start_dt, end_dt)
+        criteria = calendar_service.therapist_criteria(current_user.id, start_dt, end_dt)
+        limit, newest_first = None, False
     else:
-        # Fallback or list view logic
-        appts = Appointment.query.filter(Appointment.therapist_id == current_user.id)\
-            .order_by(Appointment.start_time.desc()).limit(200).all()
-
-    results = []
-    for a in appts:
-        start_iso = a.start_time.isoformat() if a.start_time else None
-        if start_iso and a.start_time.tzinfo is None:
-            start_iso += 'Z'
-            
-        end_iso = a.end_time.isoformat() if a.end_time else None
-        if end_iso and a.end_time.tzinfo is None:
-            end_iso += 'Z'
+        # List view: latest 200 stored appointments, series occurrences are not expanded
+        criteria = calendar_service.therapist_criteria(current_user.id)
+        limit, newest_first = 200, True
 
-        results.append({
-            'id': a.id,
-            'title': a.title or (a.patient.username if a.patient else 'Sesión'),
-            'start': start_iso,
-            'end': end_iso,
-            'status': a.status,
-            'patient': {'id': a.patient.id, 'name': a.patient.username} if a.patient else None,
-            'location': a.location,
-            'notes': a.notes,
-            'games': json.loads(a.games) if a.games else []
-        })
+    def build():
+        rows = calendar_service.events(criteria, 'patient', newest_first=newest_first, limit=limit)
+        if start_dt and end_dt:
+            rows = calendar_service.merge(rows, recurrence_service.occurrences('therapist', current_user.id, start_dt, end_dt))
+        return therapist_events_schema.dump(rows)
 
-    return jsonify(results)
+    etag = calendar_service.fingerprint(criteria, 'therapist', current_user.id, limit,
+                                        *recurrence_service.fingerprint_parts('therapist', current_user.id))
+    return _conditional_json(etag, build)
 
 
 # Therapist upcoming sessions (compact list)
@@ -155,26 +182,7 @@ def api_upcoming_sessions():
     if current_user.role != 'terapista':
         return jsonify({'error': 'Acceso denegado'}), 403
         
-    appts = appointment_service.get_upcoming_sessions(current_user.id)
-    results = []
-    for a in appts:
-        patient = User.query.get(a.patient_id)
-        start_iso = a.start_time.isoformat()
-        if a.start_time.tzinfo is None:
-            start_iso += 'Z'
-            
-        end_iso = a.end_time.isoformat() if a.end_time else None
-        if end_iso and a.end_time.tzinfo is None:
-            end_iso += 'Z'
-
-        results.append({
-            'id': a.id,
-            'patient': patient.username or patient.email,
-            'start_time': start_iso,
-            'end_time': end_iso
-            ,'games': json.loads(a.games) if a.games else []
-        })
-    return jsonify(results)
+    return jsonify(appointment_service.get_upcoming_feed(current_user.id))
 
 
 @api_bp.route('/appointments/patient', methods=['GET'])
@@ -184,41 +192,28 @@ def api_get_patient_appointments():
     if current_user.role != 'jugador':
         return jsonify({'error': 'Acceso denegado'}), 403
 
-    start = request.args.get('start')
-    end = request.args.get('end')
-    
-    try:
-        start_dt = _parse_datetime(start)
-        end_dt = _parse_datetime(end)
-    except Exception:
-        start_dt = None
-        end_dt = None
-        
-    appts = appointment_service.get_patient_appointments(current_user.id, start_dt, end_dt)
+    start_dt = _parse_datetime(request.args.get('start'))
+    end_dt = _parse_datetime(request.args.get('end'))
 
-    results = []
-    for a in appts:
-        start_iso = a.start_time.isoformat() if a.start_time else None
-        if start_iso and a.start_time.tzinfo is None:
-            start_iso += 'Z'
-            
-        end_iso = a.end_time.isoformat() if a.end_time else None
-        if end_iso and a.end_time.tzinfo is None:
-            end_iso += 'Z'
-
-        results.append({
-            'id': a.id,
-            'title': a.title,
-            'start': start_iso,
-            'end': end_iso,
-            'status': a.status,
-            'therapist': {'id': a.therapist.id, 'name': a.therapist.username} if a.therapist else None,
-            'location': a.location,
-            'notes': a.notes,
-            'games': json.loads(a.games) if a.games else []
-        })
-    
-    return jsonify(results)
+    if start_dt and end_dt:
+        criteria = calendar_service.patient_criteria(current_user.id, start_dt, end_dt)
+        limit = None
+    else:
+        # Default: upcoming and today's sessions in the patient's timezone
+        start_dt, _ = get_user_today_utc_range(current_user)
+        end_dt = start_dt + timedelta(days=current_app.config.get('RECURRENCE_LOOKAHEAD_DAYS', 90))
+        criteria = calendar_service.patient_criteria(current_user.id, start_dt, status='scheduled')
+        limit = 10
+
+    def build():
+        rows = calendar_service.merge(calendar_service.events(criteria, 'therapist', limit=limit),
+                                      recurrence_service.occurrences('patient', current_user.id, start_dt, end_dt),
+                                      limit=limit)
+        return patient_events_schema.dump(rows)
+
+    etag = calendar_service.fingerprint(criteria, 'patient', current_user.id, limit, start_dt, end_dt,
+                                        *recurrence_service.fingerprint_parts('patient', current_user.id))
+    return _conditional_json(etag, build)
 
 
 @api_bp.route('/games', methods=['GET'])
@@ -256,34 +251,70 @@ def api_get_sessions_day():
     except Exception:
         return jsonify({'success': False, 'message': 'Formato de fecha inválido'}), 400
 
-    query = Appointment.query.filter(Appointment.therapist_id == current_user.id,
-                                     Appointment.start_time >= query_start,
-                                     Appointment.start_time < query_end).order_by(Appointment.start_time.asc()).all()
+    criteria = calendar_service.therapist_criteria(current_user.id, query_start, query_end, end_exclusive=True)
+    etag = calendar_service.fingerprint(criteria, 'day', current_user.id,
+                                        *recurrence_service.fingerprint_parts('therapist', current_user.id))
+    return _conditional_json(etag, lambda: {
+        'date': date_str,
+        'sessions': therapist_day_schema.dump(calendar_service.merge(
+            calendar_service.events(criteria, 'patient'),
+            recurrence_service.occurrences('therapist', current_user.id, query_start, query_end - timedelta(microseconds=1))))
+    })
 
-    results = []
-    for a in query:
-        start_iso = a.start_time.isoformat()
-        if a.start_time.tzinfo is None:
-            start_iso += 'Z'
-            
-        end_iso = None
-        if a.end_time:
-            end_iso = a.end_time.isoformat()
-            if a.end_time.tzinfo is None:
-                end_iso += 'Z'
-
-        results.append({
-            'id': a.id,
-            'title': a.title or (a.patient.username if a.patient else 'Sesión'),
-            'start': start_iso,
-            'end': end_iso,
-            'status': a.status,
-            'patient': {'id': a.patient.id, 'name': a.patient.username} if a.patient else None,
-            'notes': a.notes,
-            'location': a.location
-        })
-
-    return jsonify({'date': date_str, 'sessions': results})
+
+def _session_payload(appt):
+    payload = {
+        'id': appt.id,
+        'title': appt.title,
+        'start_time': appt.start_time.isoformat() if appt.start_time else None,
+        'end_time': appt.end_time.isoformat() if appt.end_time else None,
+        'status': appt.status,
+        'patient': {'id': appt.patient.id, 'name': appt.patient.username} if appt.patient else None,
+        'location': appt.location,
+        'notes': appt.notes
+    }
+    payload['games'] = appt.games_list
+    return payload
+
+
+def _conflicts_payload(conflicts):
+    return [{
+        'id': c.appointment_id,
+        'series_id': c.series_id,
+        'title': c.title,
+        'start_time': c.start.isoformat() + 'Z',
+        'end_time': c.end.isoformat() + 'Z'
+    } for c in conflicts]
+
+
+def _conflict_response(error):
+    """409 listing the overlapping sessions; resend with allow_overlap=true to book anyway."""
+    return jsonify({
+        'success': False,
+        'message': str(error),
+        'conflicts': _conflicts_payload(error.conflicts[:20])
+    }), 409
+
+
+@api_bp.route('/sessions/free-slots', methods=['GET'])
+@login_required
+def api_free_slots():
+    """Next free slots for the current therapist: duration (minutes, default 60), after (ISO,
+    default now) and count (default 5, max 20)."""
+    if current_user.role != 'terapista':
+        return jsonify({'error': 'Acceso denegado'}), 403
+
+    duration = request.args.get('duration', 60, type=int) or 60
+    if duration <= 0 or duration > 12 * 60:
+        return jsonify({'error': 'Duración inválida'}), 400
+    count = min(max(request.args.get('count', 5, type=int) or 5, 1), 20)
+    after = _parse_datetime(request.args.get('after'))
+
+    slots = schedule_service.free_slots(current_user.id, duration, after=after, count=count)
+    return jsonify({'slots': [{
+        'start_time': slot['start'].isoformat() + 'Z',
+        'end_time': slot['end'].isoformat() + 'Z'
+    } for slot in slots]})
 
 
 @api_bp.route('/sessions', methods=['POST'])
@@ -307,27 +338,18 @@ def api_create_session():
 
     try:
         appt = appointment_service.create_session(current_user.id, data, current_user.username)
+    except ScheduleConflict as e:
+        return _conflict_response(e)
     except ValueError as e:
         return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
-    created = {
-        'id': appt.id,
-        'title': appt.title,
-        'start_time': appt.start_time.isoformat() if appt.start_time else None,
-        'end_time': appt.end_time.isoformat() if appt.end_time else None,
-        'status': appt.status,
-        'patient': {'id': appt.patient.id, 'name': appt.patient.username} if appt.patient else None,
-        'location': appt.location,
-        'notes': appt.notes
-    }
-    # include games if any
-    try:
-        created['games'] = json.loads(appt.games) if appt.games else []
-    except Exception:
-        created['games'] = []
-    return jsonify(created)
+    payload = _session_payload(appt)
+    if data.get('allow_overlap'):
+        payload['conflicts'] = _conflicts_payload(schedule_service.conflicts(
+            current_user.id, appt.start_time, appt.end_time, ignore_id=appt.id))
+    return jsonify(payload)
 
 
 @api_bp.route('/sessions/<int:session_id>', methods=['PUT'])
@@ -342,7 +364,10 @@ def api_update_session(session_id):
     if 'end_time' in data:
         data['end_time'] = _parse_datetime(data.get('end_time'))
         
-    appt = appointment_service.update_session(session_id, data)
+    try:
+        appt = appointment_service.update_session(session_id, data)
+    except ScheduleConflict as e:
+        return _conflict_response(e)
     if not appt:
         return jsonify({'success': False, 'message': 'Sesión no encontrada'}), 404
 
@@ -372,6 +397,62 @@ def api_delete_session(session_id):
 
     return jsonify({'success': True})
 
+
+@api_bp.route('/series', methods=['POST'])
+@login_required
+def api_create_series():
+    """Create a recurring series. Expects patient_id, start_time, rrule (e.g. FREQ=WEEKLY;COUNT=12)
+    and end_time or duration_minutes; title, notes, location, games and timezone are optional."""
+    if current_user.role != 'terapista':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    data = request.get_json(silent=True) or {}
+    data['start_time'] = _parse_datetime(data.get('start_time'))
+    data['end_time'] = _parse_datetime(data.get('end_time'))
+    if not data.get('patient_id') or not data.get('start_time') or not data.get('rrule'):
+        return jsonify({'success': False, 'message': 'patient_id, start_time and rrule are required'}), 400
+
+    try:
+        series = recurrence_service.create_series(current_user.id, data, current_user.username)
+    except ScheduleConflict as e:
+        return _conflict_response(e)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(series_schema.dump(series)), 201
+
+
+@api_bp.route('/series/<int:series_id>/occurrences', methods=['POST'])
+@login_required
+def api_materialize_occurrence(series_id):
+    """Turn one generated occurrence ({"occurrence": start ISO}) into a stored session so it can
+    be edited, completed or cancelled through the /api/sessions/<id> endpoints."""
+    series = AppointmentSeries.query.get(series_id)
+    if not series:
+        return jsonify({'success': False, 'message': 'Serie no encontrada'}), 404
+    if current_user.id not in (series.therapist_id, series.patient_id):
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    occurrence = _parse_datetime((request.get_json(silent=True) or {}).get('occurrence'))
+    appt = recurrence_service.materialize(series, occurrence) if occurrence else None
+    if not appt:
+        return jsonify({'success': False, 'message': 'La serie no tiene una sesión en esa fecha'}), 404
+    return jsonify(_session_payload(appt))
+
+
+@api_bp.route('/series/<int:series_id>', methods=['DELETE'])
+@login_required
+def api_end_series(series_id):
+    """Stop a series from `from` (ISO, default now). Stored sessions are kept."""
+    series = AppointmentSeries.query.get(series_id)
+    if not series:
+        return jsonify({'success': False, 'message': 'Serie no encontrada'}), 404
+    if current_user.id != series.therapist_id:
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    from_dt = _parse_datetime(request.args.get('from')) or datetime.utcnow()
+    kept = recurrence_service.end_series(series, from_dt)
+    return jsonify({'success': True, 'series': series_schema.dump(series) if kept else None})
+
 @api_bp.route('/admin/assign-therapist', methods=['POST'])
 @login_required
 def api_admin_assign_therapist():
@@ -414,11 +495,12 @@ def api_admin_delete_game():
     name = (data.get('name') or '').strip()
     if not name:
         return jsonify({'success': False, 'message': 'Nombre requerido'}), 400
-    games_dir = os.path.join(current_app.root_path, 'static', 'games')
-    path = os.path.join(games_dir, name)
+    path = os.path.join(game_catalog.games_dir(), os.path.basename(name))
     try:
         if os.path.isfile(path):
             os.remove(path)
+            game_catalog.invalidate()
+            game_assets.unpublish(name)
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'message': 'Archivo no encontrado'}), 404
@@ -454,6 +536,56 @@ def api_admin_list_users():
     users = admin_service.list_users(role)
     return jsonify({'success': True, 'users': [{'id': u.id, 'email': u.email, 'username': u.username, 'role': u.role} for u in users]})
 
+@api_bp.route('/admin/auth-metrics')
+@login_required
+def api_admin_auth_metrics():
+    """Login/verification latency percentiles and rejected (pool saturated) checks."""
+    if current_user.role != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+    return jsonify({'success': True, 'metrics': password_service.stats()})
+
+@api_bp.route('/admin/ai-metrics')
+@login_required
+def api_admin_ai_metrics():
+    """Gemini gateway latency, cache hits, rejections and circuit breaker state."""
+    if current_user.role != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+    return jsonify({'success': True, 'metrics': gemini_gateway.stats()})
+
+@api_bp.route('/admin/availability')
+@login_required
+def api_admin_availability():
+    """Earliest free slots across therapists plus their caseloads, for assigning patients.
+
+    Query args: start/end (ISO, default now and 7 days later), duration (minutes, default 60),
+    limit (default 20), per_therapist (default 3) and therapist_ids (comma separated).
+    """
+    if current_user.role != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    start_dt = _parse_datetime(request.args.get('start')) or datetime.utcnow()
+    end_dt = _parse_datetime(request.args.get('end')) or start_dt + timedelta(days=7)
+    if end_dt <= start_dt or end_dt - start_dt > timedelta(days=current_app.config.get('AVAILABILITY_MAX_DAYS', 31)):
+        return jsonify({'success': False, 'message': 'Rango de fechas inválido'}), 400
+    duration = request.args.get('duration', 60, type=int) or 60
+    if duration <= 0 or duration > 12 * 60:
+        return jsonify({'success': False, 'message': 'Duración inválida'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int) or 20, 1), 200)
+    per_therapist = min(max(request.args.get('per_therapist', 3, type=int) or 3, 1), 50)
+    try:
+        therapist_ids = [int(x) for x in (request.args.get('therapist_ids') or '').split(',') if x.strip()] or None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'therapist_ids inválido'}), 400
+
+    result = availability_service.search(start_dt, end_dt, duration, limit, per_therapist, therapist_ids)
+    return jsonify({
+        'success': True,
+        'slots': [dict(slot, start=slot['start'].isoformat() + 'Z', end=slot['end'].isoformat() + 'Z')
+                  for slot in result['slots']],
+        'therapists': [dict(t, next_free=t['next_free'].isoformat() + 'Z' if t['next_free'] else None)
+                       for t in result['therapists']]
+    })
+
 @api_bp.route('/admin/update-user', methods=['POST'])
 @login_required
 def api_admin_update_user():
@@ -487,8 +619,16 @@ def api_admin_delete_user():
     try:
         # Cascade delete messages and appointments
         Message.query.filter((Message.sender_id==u.id)|(Message.receiver_id==u.id)).delete()
+        appt_ids = db.session.query(Appointment.id).filter((Appointment.therapist_id==u.id)|(Appointment.patient_id==u.id))
+        AppointmentGame.query.filter(AppointmentGame.appointment_id.in_(appt_ids)).delete(synchronize_session=False)
         Appointment.query.filter((Appointment.therapist_id==u.id)|(Appointment.patient_id==u.id)).delete()
+        AppointmentSeries.query.filter((AppointmentSeries.therapist_id==u.id)|(AppointmentSeries.patient_id==u.id)).delete()
+        SessionTrials.query.filter(SessionTrials.user_id==u.id).delete()
         SessionMetrics.query.filter(SessionMetrics.user_id==u.id).delete()
+        GameProfile.query.filter(GameProfile.user_id==u.id).delete()
+        PatientModelState.query.filter(PatientModelState.user_id==u.id).delete()
+        PatientSegment.query.filter(PatientSegment.user_id==u.id).delete()
+        GameGenerationJob.query.filter((GameGenerationJob.requested_by==u.id)|(GameGenerationJob.target_user_id==u.id)).delete()
         db.session.delete(u)
         db.session.commit()
         return jsonify({'success': True})
@@ -505,6 +645,16 @@ def save_game():
         accuracy = float(data.get('accuracy') or 0)
         avg_time = float(data.get('avg_time') or 0)
         session_id = data.get('session_id')
+        # Optional per-trial reaction times (ms): a JSON list or a base64 Float32Array
+        try:
+            reaction_times = fatigue_service.parse(data.get('reaction_times'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        fatigue = None
+        if reaction_times is not None:
+            fatigue = fatigue_service.indicators(reaction_times)
+            if data.get('avg_time') is None and len(reaction_times):
+                avg_time = float(reaction_times.mean()) / 1000
         
         # Security Validation
         appt = None
@@ -520,57 +670,44 @@ def save_game():
             # 2. Status check
             if appt.status == 'completed':
                 return jsonify({'error': 'Esta sesión ya ha sido completada'}), 400
-                
-            # 3. Game Assignment check (Optional but recommended)
-            # We check if the game being saved is actually part of the session
-            # Using the new property games_list that handles both legacy and new models
-            # We normalize names for comparison (remove .html, case insensitive)
-            assigned_normalized = [g.lower().replace('.html', '').replace('_', ' ') for g in appt.games_list]
-            current_normalized = game_name.lower().replace('.html', '').replace('_', ' ')
-            
-            # Note: We allow saving if list is empty (legacy/testing) or if match found
-            # If strict mode is desired, uncomment the else block
-            if appt.games_list and current_normalized not in assigned_normalized:
-                # Log warning but maybe allow for now to avoid breaking legacy games with different naming conventions
-                current_app.logger.warning(f"Game mismatch: {game_name} not in {appt.games_list}")
-                # return jsonify({'error': 'Juego no asignado a esta sesión'}), 400
 
-        pred_code, label = predict_level(accuracy, avg_time * 1000)  # avg_time expected in seconds; convert ms for model input
+        # Link to the catalog game: explicit game_id, filename or normalized title
+        try:
+            game_id = int(data['game_id']) if data.get('game_id') is not None else None
+        except (TypeError, ValueError):
+            game_id = None
+        game_obj = game_catalog.resolve(game_name, game_id)
+
+        # Personalized decision from the patient's running stats; avg_time comes in seconds, the model uses ms
+        pred_code, label, model_version, confidence = adaptive_service.observe(current_user.id, accuracy, avg_time * 1000,
+                                                    game_id=game_obj.id if game_obj else None,
+                                                    hour=get_user_now(current_user).hour,
+                                                    fatigue=fatigue['fatigue_score'] if fatigue else None)
 
         # Persist metrics
         m = SessionMetrics(
             user_id=current_user.id,
             session_id=int(session_id) if session_id else None,
+            game_id=game_obj.id if game_obj else None,
             game_name=game_name,
             accurracy=accuracy,
             avg_time=avg_time,
-            prediction=pred_code
+            prediction=pred_code,
+            model_version=model_version,
+            confidence=confidence
         )
-        
-        # Link to Game model if possible
-        # Try to find game by filename or title
-        game_obj = Game.query.filter(or_(Game.filename == game_name, Game.title == game_name)).first()
-        if game_obj:
-            m.game_id = game_obj.id
-            
         db.session.add(m)
+        if reaction_times is not None:
+            db.session.flush()
+            fatigue_service.record(m, reaction_times, fatigue)
 
-        # If tied to a session, check progress
+        # If tied to a session, advance its progress counter; completes on the last assigned game
         if appt:
-            # Flush to ensure the new metric is countable
-            db.session.flush()
-            
-            # Count total metrics for this session
-            played_count = SessionMetrics.query.filter_by(session_id=appt.id).count()
-            
-            # Only close if we have played at least as many games as assigned
-            # Use the robust games_list property
-            total_assigned = len(appt.games_list)
-            
-            if played_count >= total_assigned and total_assigned > 0:
-                appt.status = 'completed'
-                appt.end_time = datetime.utcnow()
-                db.session.add(appt)
+            if game_obj is None:
+                current_app.logger.warning(f"Game not in catalog for session {appt.id}: {game_name}")
+            if game_assignment_service.record_play(appt, game_obj.id if game_obj else None):
+                # The last assigned game completed the session: fold it here, /complete will not
+                _fold_session(appt)
                 # Optional: create a notification for therapist
                 try:
                     notification_service.create_notification(appt.therapist_id, f"Sesión #{appt.id} completada por {current_user.username}", link=url_for('therapist.patients', _external=False))
@@ -599,7 +736,8 @@ def save_game():
             current_app.logger.error(f"AI Retraining failed: {e}")
         # -----------------------------
 
-        return jsonify({'status': 'ok', 'prediction': pred_code, 'recommendation': label})
+        return jsonify({'status': 'ok', 'prediction': pred_code, 'recommendation': label, 'model_version': model_version,
+                        'fatigue': fatigue})
     except Exception as e:
         return jsonify({'error': 'save_failed', 'detail': str(e)}), 400
 
@@ -609,17 +747,24 @@ def save_game():
 def upload_game():
     if current_user.role != 'terapista':
         return jsonify({'error': 'Acceso denegado'}), 403
+    # Refuse oversized bodies before the multipart parser spools them
+    max_bytes = game_upload_service.max_bytes()
+    if request.content_length and request.content_length > max_bytes + 64 * 1024:
+        return jsonify({'error': f'El juego supera el tamaño máximo de {max_bytes // 1024} KB'}), 413
     file = request.files.get('file')
     name = request.form.get('name')
     if not file or not name:
         return jsonify({'error': 'Falta archivo o nombre'}), 400
-    if not name.lower().endswith('.html'):
-        name = f"{name}.html"
-    dest_dir = os.path.join(current_app.root_path, 'static', 'games')
-    os.makedirs(dest_dir, exist_ok=True)
-    path = os.path.join(dest_dir, name)
-    file.save(path)
-    return jsonify({'status': 'ok', 'file': name, 'url': url_for('static', filename=f'games/{name}')})
+    try:
+        game, digest = game_upload_service.save(file.stream, name, title=request.form.get('title'))
+    except GameTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except OSError as e:
+        current_app.logger.error(f"Game upload failed: {e}")
+        return jsonify({'error': 'No se pudo guardar el juego'}), 500
+    return jsonify({'status': 'ok', 'file': game.filename, 'game_id': game.id, 'sha256': digest, 'url': game_assets.url(game.filename)})
 
 
 @api_bp.route('/ai/gemini', methods=['POST'])
@@ -627,146 +772,56 @@ def upload_game():
 def gemini_proxy():
     if current_user.role not in ('terapista','admin'):
         return jsonify({'error': 'Acceso denegado'}), 403
-    api_key = current_app.config.get('GEMINI_API_KEY')
     payload = request.get_json() or {}
     prompt = payload.get('prompt')
     context = payload.get('context')
     if not prompt:
         return jsonify({'error': 'Falta prompt'}), 400
-    if not api_key:
-        # Fallback: use internal recommendation label based on context if available
+    try:
+        text = gemini_gateway.generate(prompt, context)
+        return jsonify({'status': 'ok', 'response': text})
+    except GeminiUnavailable as e:
+        # Fallback: internal recommendation label based on context if available
         acc = (context or {}).get('accuracy') or 0
         avg = (context or {}).get('avg_time') or 0
         _, label = predict_level(acc, avg)
-        return jsonify({'status': 'no_external', 'recommendation': label})
-    # Real call to Gemini Pro
-    try:
-        import requests
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key={api_key}"
-        headers = {'Content-Type': 'application/json'}
-        data = {
-            "contents": [{
-                "parts": [{"text": f"Context: {json.dumps(context)}. Prompt: {prompt}"}]
-            }]
-        }
-        resp = requests.post(url, headers=headers, json=data)
-        if resp.status_code == 200:
-            result = resp.json()
-            text = result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
-            return jsonify({'status': 'ok', 'response': text})
-        else:
-            return jsonify({'error': 'Gemini API error', 'details': resp.text}), 500
-    except Exception as e:
-        return jsonify({'error': 'Gemini proxy failed', 'detail': str(e)}), 500
+        if e.reason == 'no_key':
+            return jsonify({'status': 'no_external', 'recommendation': label})
+        current_app.logger.warning(f"Gemini proxy fallback: {e}")
+        return jsonify({'status': 'fallback', 'reason': e.reason, 'recommendation': label})
 
 @api_bp.route('/ai/generate_game', methods=['POST'])
 @login_required
 def generate_game():
+    """Queue an AI game generation; poll the returned status_url for progress and the result."""
     if current_user.role not in ('terapista','admin'):
         return jsonify({'error': 'Acceso denegado'}), 403
-    api_key = current_app.config.get('GEMINI_API_KEY')
     payload = request.get_json() or {}
     prompt = payload.get('prompt') or 'Genera un juego terapéutico en HTML.'
     target_user_id = payload.get('user_id')
-    game_name = (payload.get('name') or 'ai_game').strip().replace(' ', '_')
+    game_name = (payload.get('name') or 'ai_game').strip()
     if not target_user_id:
         return jsonify({'error': 'Falta user_id'}), 400
     user = User.query.get(target_user_id)
     if not user:
         return jsonify({'error': 'Usuario no encontrado'}), 404
-
-    # Collect KPIs from DB for user
-    kpi = {}
-    kpi['total_sessions'] = SessionMetrics.query.filter_by(user_id=user.id).count()
-    kpi['avg_accuracy'] = float(db.session.query(func.avg(SessionMetrics.accurracy)).filter_by(user_id=user.id).scalar() or 0)
-    kpi['avg_time_ms'] = float((db.session.query(func.avg(SessionMetrics.avg_time)).filter_by(user_id=user.id).scalar() or 0) * 1000)
-    kpi['last_games'] = [
-        {
-            'game_name': m.game_name,
-            'accuracy': float(m.accurracy),
-            'avg_time_ms': float(m.avg_time * 1000),
-            'prediction': int(m.prediction),
-            'date': m.date.isoformat()
-        } for m in SessionMetrics.query.filter_by(user_id=user.id).order_by(SessionMetrics.date.desc()).limit(10)
-    ]
-
-    # Build prompt including KPIs to instruct Gemini to output HTML and JSON
-    full_prompt = (
-        f"{prompt}\n\n"
-        "Genera dos bloques: 1) HTML completo para un juego sencillo de reflejos/cognitivo con UI moderna, tailwindcdn y FontAwesome (no frameworks).\n"
-        "2) JSON de configuración KPI con claves: kpis(avg_accuracy, avg_time_ms, total_sessions), goals, difficulty, and tracking schema for events.\n"
-        f"KPIs del paciente: {json.dumps(kpi, ensure_ascii=False)}\n"
-        "Devuelve primero el JSON (entre marcadores ---JSON---) y luego el HTML (entre ---HTML---)."
-    )
-
-    if not api_key:
-        # Fallback: simple generated HTML and JSON locally
-        config = {
-            'kpis': {'avg_accuracy': kpi['avg_accuracy'], 'avg_time_ms': kpi['avg_time_ms'], 'total_sessions': kpi['total_sessions']},
-            'goals': ['Mejorar reflejos', 'Reducir tiempo de reacción'],
-            'difficulty': 'medium',
-            'tracking': {'events': ['click', 'hit', 'miss'], 'schema_version': 1}
-        }
-        html = '<!DOCTYPE html><html><head><meta charset="utf-8"><script src="https://cdn.tailwindcss.com"></script></head><body class="p-6">\n' \
-               '<h2 class="text-2xl font-bold">Juego IA (fallback)</h2>\n' \
-               '<p class="text-gray-600">Config basado en KPIs.</p>\n' \
-               '</body></html>'
-    else:
-        try:
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key={api_key}"
-            body = {"contents": [{"parts": [{"text": full_prompt}]}]}
-            resp = requests.post(url, json=body, timeout=15)
-            resp.raise_for_status()
-            j = resp.json()
-            text = (
-                j.get('candidates', [{}])[0]
-                .get('content', {})
-                .get('parts', [{}])[0]
-                .get('text') or ''
-            )
-            # Extract JSON and HTML by markers
-            json_start = text.find('---JSON---')
-            html_start = text.find('---HTML---')
-            if json_start != -1 and html_start != -1:
-                json_block = text[json_start + len('---JSON---'): html_start].strip()
-                html_block = text[html_start + len('---HTML---'):].strip()
-                try:
-                    config = json.loads(json_block)
-                except Exception:
-                    config = {'raw': json_block}
-                html = html_block
-            else:
-                # If markers missing, store raw
-                config = {'raw': text}
-                html = '<!DOCTYPE html><html><body><pre>Salida IA sin marcadores</pre></body></html>'
-        except Exception as e:
-            config = {'error': str(e), 'kpis': kpi}
-            html = '<!DOCTYPE html><html><body><pre>Error generando juego IA</pre></body></html>'
-
-    # Save HTML file
-    dest_dir = os.path.join(current_app.root_path, 'static', 'games')
-    os.makedirs(dest_dir, exist_ok=True)
-    filename = f"{game_name}.html"
-    path = os.path.join(dest_dir, filename)
-    try:
-        with open(path, 'w', encoding='utf-8') as f:
-            f.write(html)
-    except Exception as e:
-        return jsonify({'error': 'write_failed', 'detail': str(e)}), 500
-
-    # Persist JSON config in user.game_profile
     try:
-        user.game_profile = json.dumps(config, ensure_ascii=False)
-        db.session.commit()
-    except Exception as e:
-        return jsonify({'error': 'persist_failed', 'detail': str(e)}), 500
+        job = game_generation.enqueue(current_user.id, user.id, game_name, prompt)
+    except GenerationBusy as e:
+        return jsonify({'error': str(e)}), 429
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = game_generation.status(job)
+    response['status_url'] = url_for('api.generate_game_status', job_id=job.id)
+    return jsonify(response), 202
 
-    return jsonify({
-        'status': 'ok',
-        'file': filename,
-        'url': url_for('static', filename=f'games/{filename}'),
-        'config': config
-    })
+@api_bp.route('/ai/generate_game/<int:job_id>')
+@login_required
+def generate_game_status(job_id):
+    job = GameGenerationJobRepository.get(job_id)
+    if not job or (job.requested_by != current_user.id and current_user.role != 'admin'):
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(game_generation.status(job))
 
 @api_bp.route('/sessions/assign-games', methods=['POST'])
 @login_required
@@ -776,12 +831,15 @@ def assign_games_to_session():
     data = request.get_json() or {}
     session_id = data.get('session_id')
     games = data.get('games') or []  # list of {'name': 'file.html', 'url': '/static/games/file.html'}
-    appt = Appointment.query.get(session_id)
+    appt = Appointment.query.options(games_loader()).get(session_id)
     if not appt:
         return jsonify({'error': 'Sesión no encontrada'}), 404
-    appt.games = json.dumps(games, ensure_ascii=False)
+    try:
+        assigned = game_assignment_service.assign(appt, games)
+    except UnknownGames as e:
+        return jsonify({'error': str(e), 'unknown': e.filenames}), 400
     db.session.commit()
-    return jsonify({'status': 'ok', 'assigned': games})
+    return jsonify({'status': 'ok', 'assigned': [{'name': f, 'url': game_assets.url(f)} for f in assigned]})
 
 
 # Check available games for a session (only during time window)
@@ -795,15 +853,25 @@ def session_games(session_id):
     # Allow access if now is between start and end (or within scheduled with end None -> 2h)
     end_time = appt.end_time or (appt.start_time + timedelta(hours=2))
     enabled = appt.status == 'scheduled' and appt.start_time <= now <= end_time
-    games = []
-    try:
-        games = json.loads(appt.games) if appt.games else []
-    except Exception:
-        games = []
-    return jsonify({'enabled': enabled, 'games': games})
+    return jsonify({'enabled': enabled, 'games': appt.games_list})
 
 
-# Aggregate session results and update user profile (game_profile)
+def _fold_session(appt):
+    """Fold the patient's plays of a session that just completed into their bounded GameProfile
+    (running sums + recent plays). Returns (profile, plays); the caller commits."""
+    metrics = SessionMetrics.query.filter_by(user_id=appt.patient_id, session_id=appt.id).all()
+    if not metrics:
+        return None, 0
+    last_games = [{
+        'game_name': m.game_name,
+        'accuracy': float(m.accurracy),
+        'avg_time_ms': float(m.avg_time * 1000),
+        'prediction': int(m.prediction),
+        'date': m.date.isoformat()
+    } for m in metrics]
+    return game_profile_service.record_session(appt.patient_id, last_games), len(metrics)
+
+# Aggregate session results and update the patient's game profile
 @api_bp.route('/sessions/<int:session_id>/complete', methods=['POST'])
 @login_required
 def complete_session(session_id):
@@ -814,44 +882,23 @@ def complete_session(session_id):
     if current_user.id != appt.therapist_id:
         return jsonify({'error': 'Acceso denegado'}), 403
 
-    # Mark completed if not already
-    if appt.status != 'completed':
-        appt.status = 'completed'
-        appt.end_time = datetime.utcnow()
-        db.session.add(appt)
-
-    # Aggregate metrics for patient within this session
-    metrics = SessionMetrics.query.filter_by(user_id=appt.patient_id, session_id=session_id).all()
-    if not metrics:
-        db.session.commit()
-        return jsonify({'status': 'ok', 'message': 'Sin métricas para agregar'})
-
-    avg_acc = float(sum(m.accurracy for m in metrics) / len(metrics))
-    avg_time_ms = float(sum(m.avg_time for m in metrics) / len(metrics) * 1000)
-    plays = len(metrics)
-    last_games = [{
-        'game_name': m.game_name,
-        'accuracy': float(m.accurracy),
-        'avg_time_ms': float(m.avg_time * 1000),
-        'prediction': int(m.prediction),
-        'date': m.date.isoformat()
-    } for m in metrics]
-
-    # Merge into user.game_profile JSON
-    patient = User.query.get(appt.patient_id)
-    try:
-        existing = json.loads(patient.game_profile) if patient.game_profile else {}
-    except Exception:
-        existing = {}
-    existing.setdefault('history', []).extend(last_games)
-    existing['kpis'] = {
-        'avg_accuracy': avg_acc,
-        'avg_time_ms': avg_time_ms,
-        'plays': plays
-    }
+    # Only the request that moves the session to completed folds its plays into the lifetime
+    # sums; a repeated call (or a session its last game already completed) changes nothing
+    finished_at = datetime.utcnow()
+    moved = Appointment.query.filter(Appointment.id == appt.id, Appointment.status != 'completed').update(
+        {'status': 'completed', 'end_time': finished_at}, synchronize_session=False)
+    if not moved:
+        db.session.rollback()
+        return jsonify({'status': 'ok', 'message': 'La sesión ya estaba completada',
+                        'updated_profile': game_profile_service.as_dict(game_profile_service.get(appt.patient_id))})
+    # Same values through the ORM so commit-time cache invalidation sees the change
+    appt.status = 'completed'
+    appt.end_time = finished_at
 
-    patient.game_profile = json.dumps(existing, ensure_ascii=False)
+    profile, plays = _fold_session(appt)
     db.session.commit()
+    if not plays:
+        return jsonify({'status': 'ok', 'message': 'Sin métricas para agregar'})
 
     # Notify both therapist and patient about completion
     try:
@@ -860,7 +907,7 @@ def complete_session(session_id):
     except Exception:
         pass
 
-    return jsonify({'status': 'ok', 'updated_profile': existing})
+    return jsonify({'status': 'ok', 'updated_profile': game_profile_service.as_dict(profile)})
 
 @api_bp.route('/resources/<int:resource_id>')
 @login_required
@@ -1,11 +1,25 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required
 from app.services.auth_service import AuthService
+from app.services.password_service import PasswordHasherBusy
+from app.services.rate_limiter import TokenBucketLimiter
 from email_validator import validate_email, EmailNotValidError
 
 auth_bp = Blueprint('auth', __name__)
 auth_service = AuthService()
 
+def _validate_limiters():
+    """Per-IP and per-email token buckets for /api/auth/validate, built once per app."""
+    limiters = current_app.extensions.get('auth_validate_limiters')
+    if limiters is None:
+        config = current_app.config
+        limiters = (
+            TokenBucketLimiter(config.get('AUTH_VALIDATE_IP_PER_MINUTE', 20) / 60.0, config.get('AUTH_VALIDATE_IP_BURST', 10)),
+            TokenBucketLimiter(config.get('AUTH_VALIDATE_EMAIL_PER_MINUTE', 5) / 60.0, config.get('AUTH_VALIDATE_EMAIL_BURST', 5))
+        )
+        current_app.extensions['auth_validate_limiters'] = limiters
+    return limiters
+
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -20,7 +34,11 @@ def login():
             flash('Por favor, ingresa un correo electrónico válido.', 'error')
             return render_template('login.html')
         
-        success, user = auth_service.login(email, password)
+        try:
+            success, user = auth_service.login(email, password)
+        except PasswordHasherBusy:
+            flash('El servidor está ocupado. Intenta de nuevo en unos segundos.', 'error')
+            return render_template('login.html'), 503
         
         if success:
             return redirect(url_for('main.dashboard'))
@@ -36,6 +54,12 @@ def logout():
     auth_service.logout()
     return redirect(url_for('auth.login'))
 
+def _too_many_requests(retry_after):
+    response = jsonify({'valid': False, 'message': 'Demasiados intentos. Intenta más tarde.'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
 @auth_bp.route('/api/auth/validate', methods=['POST'])
 def api_auth_validate():
     try:
@@ -44,9 +68,18 @@ def api_auth_validate():
         password = data.get('password') or ''
         if not email or not password:
             return jsonify({'valid': False})
-        
+
+        ip_limiter, email_limiter = _validate_limiters()
+        ip = request.remote_addr or 'unknown'
+        if not ip_limiter.allow(ip):
+            return _too_many_requests(ip_limiter.retry_after(ip))
+        if not email_limiter.allow(email):
+            return _too_many_requests(email_limiter.retry_after(email))
+
         is_valid = auth_service.validate_credentials(email, password)
         return jsonify({'valid': is_valid})
+    except PasswordHasherBusy:
+        return jsonify({'valid': False, 'message': 'Servidor ocupado'}), 503
     except Exception as e:
         current_app.logger.warning(f"/api/auth/validate error: {e}")
         return jsonify({'valid': False})
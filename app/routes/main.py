@@ -1,8 +1,10 @@
-from flask import Blueprint, render_template, request, redirect, url_for, jsonify, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, jsonify, current_app, abort, send_file
 from flask_login import login_required, current_user, logout_user
 from app.extensions import bcrypt
 from app.models import db
 from app.services.email_service import EmailService
+from app.services.game_asset_service import game_assets
+from app.services.password_service import password_service, PasswordHasherBusy
 from datetime import datetime
 
 main_bp = Blueprint('main', __name__)
@@ -27,6 +29,43 @@ def dashboard():
 def game():
     return render_template('game.html')
 
+@main_bp.route('/games/<filename>')
+def play_game(filename):
+    """Stable game URL: redirects to the current hashed copy, query string included."""
+    entry = game_assets.resolve(filename)
+    if entry is None:
+        abort(404)
+    target = url_for('main.game_asset', name=entry['file'])
+    if request.query_string:
+        target = f"{target}?{request.query_string.decode()}"
+    response = redirect(target)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@main_bp.route('/games/assets/<name>')
+def game_asset(name):
+    """Hashed game file, precompressed variant picked from Accept-Encoding."""
+    found = game_assets.lookup(name)
+    if found is None:
+        abort(404)
+    path, encodings = found
+    digest = name.rsplit('.', 2)[-2]
+    encoding = next((e for e in encodings if request.accept_encodings[e]), None)
+    suffix = {'br': '.br', 'gzip': '.gz'}.get(encoding, '')
+    response = send_file(
+        path + suffix,
+        mimetype='text/html',
+        etag=f"{digest}-{encoding}" if encoding else digest,
+        max_age=current_app.config.get('GAME_ASSETS_MAX_AGE_SECONDS', 365 * 24 * 3600),
+        conditional=True
+    )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @main_bp.route('/logout')
 @login_required
 def logout():
@@ -122,8 +161,10 @@ def change_password():
 
     # Verify current password
     try:
-        if not bcrypt.check_password_hash(current_user.password, current_password):
+        if not password_service.verify(current_user.password, current_password):
             return jsonify({'success': False, 'message': 'La contraseña actual es incorrecta'}), 400
+    except PasswordHasherBusy:
+        return jsonify({'success': False, 'message': 'El servidor está ocupado. Intenta de nuevo.'}), 503
     except Exception:
         # In case legacy hashes cause issues, fail securely
         return jsonify({'success': False, 'message': 'No se pudo verificar la contraseña actual'}), 400
@@ -5,7 +5,6 @@ from app.services.dashboard_service import DashboardService
 from app.services.appointment_service import AppointmentService
 from app.utils import get_user_today_utc_range, get_user_now
 from sqlalchemy import func, or_
-import json
 import pytz
 from datetime import datetime, timedelta
 
@@ -32,11 +31,7 @@ def dashboard():
     # Process sessions to include game info
     sessions_data = []
     for s in today_sessions:
-        games = []
-        try:
-            games = json.loads(s.games) if s.games else []
-        except:
-            games = []
+        games = s.games_list
         
         # Localize DB times to UTC for comparison with aware 'now'
         # DB stores naive UTC
@@ -52,6 +47,8 @@ def dashboard():
         
         sessions_data.append({
             'id': s.id,
+            'series_id': getattr(s, 'series_id', None),
+            'occurrence_start': s.start_time.isoformat() if s.id is None else None,
             'title': s.title,
             'start_time': s_start_aware,
             'end_time': s_end_aware,
@@ -81,11 +78,7 @@ def sessions():
     now = datetime.utcnow()
     
     for s in sessions:
-        games = []
-        try:
-            games = json.loads(s.games) if s.games else []
-        except:
-            games = []
+        games = s.games_list
             
         # Check if active
         is_active = False
@@ -101,6 +94,8 @@ def sessions():
         
         sessions_data.append({
             'id': s.id,
+            'series_id': getattr(s, 'series_id', None),
+            'occurrence_start': s.start_time.isoformat() if s.id is None else None,
             'title': s.title,
             'start_time': s.start_time,
             'therapist_name': s.therapist.username if s.therapist else 'Terapeuta',
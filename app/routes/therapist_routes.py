@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, jsonify, flash, make_response, current_app
 from flask_login import login_required, current_user
-from app.models import SessionMetrics, db, User, Appointment, Message
+from app.models import SessionMetrics, db, User, Appointment, AppointmentGame, AppointmentSeries, Message, GameProfile, GameGenerationJob, PatientModelState, PatientSegment, SessionTrials
+from app.services.game_assignment_service import games_loader
 from app.extensions import bcrypt
 from app.services.dashboard_service import DashboardService
 from app.services.email_service import EmailService
@@ -8,6 +9,11 @@ from app.services.appointment_service import AppointmentService
 from app.services.game_service import GameService
 from app.services.notification_service import NotificationService
 from app.services.patient_service import PatientService
+from app.services.patient_import_service import PatientImportService
+from app.services.segmentation_service import SegmentationService
+from app.services.evaluation_service import ModelEvaluationService
+from app.services.fatigue_service import FatigueService
+from app.services.ai_service import model_store
 from app.utils import get_user_today_utc_range
 from sqlalchemy import func, or_
 import json
@@ -26,7 +32,11 @@ dashboard_service = DashboardService()
 appointment_service = AppointmentService()
 game_service = GameService()
 notification_service = NotificationService()
+segmentation_service = SegmentationService()
+evaluation_service = ModelEvaluationService()
+fatigue_service = FatigueService()
 patient_service = PatientService()
+patient_import_service = PatientImportService()
 
 def _parse_datetime(value):
     """Robust datetime parser for ISO and naive strings"""
@@ -61,8 +71,8 @@ def dashboard():
     stats = dashboard_service.get_therapist_stats(current_user.id)
     patients = dashboard_service.get_therapist_patients_data(current_user.id)
 
-    # Alerts: simple heuristics
-    alerts = []
+    # Alerts: fatigue detected in per-trial reaction times, then simple heuristics
+    alerts = fatigue_service.alerts(current_user.id)
     low_accuracy_users = db.session.query(User.username)\
         .join(SessionMetrics, SessionMetrics.user_id == User.id)\
         .filter(User.role == 'jugador', SessionMetrics.accurracy < 60)\
@@ -151,8 +161,12 @@ def analytics():
     advance_predictions = SessionMetrics.query.filter_by(prediction=1).count()
     success_rate = (advance_predictions / total_predictions * 100) if total_predictions > 0 else 0
     
-    # Active models (Static for MVP, but could be dynamic if we had multiple model files)
-    active_models_count = 1 
+    # Retained difficulty model versions (one is active, the rest are rollback targets)
+    store = model_store()
+    active_models_count = len(store.versions())
+    # CURRENT only: a page view must not train a model when none is published yet
+    current_version = store.current()
+    active_meta = store.meta(current_version) if current_version else {}
 
     ai_overview = {
         "total_adaptations": total_metrics,
@@ -162,15 +176,21 @@ def analytics():
         "success_rate": round(success_rate, 1),
         "success_rate_increase": 0, # Placeholder
         "active_models": active_models_count,
-        "insight": "El modelo SVM se está adaptando a los patrones de tiempo y precisión de los pacientes."
+        "insight": f"El modelo {active_meta.get('backend', '')} se está adaptando a los patrones de tiempo y precisión de los pacientes."
     }
 
-    # 2. Model Performance (Mocked for MVP as we don't have ground truth labels in DB yet)
-    # In a real system, we'd compare prediction vs therapist feedback
-    model_performance = [
-        {"name": "Clasificación de Nivel", "accuracy": 92},
-        {"name": "Detección de Fatiga", "accuracy": 85}, # Future feature
-    ]
+    # 2. Model Performance: last walk-forward evaluation (`flask evaluate-model`), scored against
+    # the expert labels until therapist feedback is recorded
+    model_evaluation = evaluation_service.latest()
+    model_performance = []
+    if model_evaluation:
+        model_performance = [
+            {"name": "Clasificación de Nivel", "accuracy": round(model_evaluation['label_accuracy'] * 100, 1)},
+            {"name": "Calibración (1 - ECE)", "accuracy": round((1 - model_evaluation['ece']) * 100, 1)},
+        ]
+        if model_evaluation.get('next_play_accuracy') is not None:
+            model_performance.insert(1, {"name": "Acierto en la siguiente partida",
+                                         "accuracy": round(model_evaluation['next_play_accuracy'] * 100, 1)})
 
     # 3. Recent Adaptations (Last 10 metrics)
     recent_metrics = db.session.query(SessionMetrics, User).join(User, SessionMetrics.user_id == User.id)\
@@ -178,6 +198,8 @@ def analytics():
     
     recent_adaptations = []
     labels = {0: "Mantener Nivel", 1: "Avanzar Nivel", 2: "Retroceder/Apoyo"}
+    confidences = evaluation_service.confidences([m for m, _ in recent_metrics])
+    fatigue_scores = fatigue_service.scores([m.id for m, _ in recent_metrics])
     
     for m, u in recent_metrics:
         recent_adaptations.append({
@@ -186,9 +208,10 @@ def analytics():
             "game_type": m.game_name,
             "prev_level": "?", # We don't track prev level explicitly in metrics yet
             "new_level": labels.get(m.prediction, "Desconocido"),
-            "reason": f"Precisión: {m.accurracy:.1f}%, Tiempo: {m.avg_time:.2f}s",
+            "reason": f"Precisión: {m.accurracy:.1f}%, Tiempo: {m.avg_time:.2f}s"
+                      + (", fatiga detectada" if fatigue_service.is_fatigued(fatigue_scores.get(m.id)) else ""),
             "timestamp": m.date.strftime("%d/%m %H:%M"),
-            "confidence": 90 # Mock confidence
+            "confidence": confidences.get(m.id)
         })
 
     # 4. Charts Data
@@ -270,10 +293,12 @@ def analytics():
     return render_template('therapist/analytics.html',
                            ai_overview=ai_overview,
                            model_performance=model_performance,
+                           model_evaluation=model_evaluation,
                            recent_adaptations=recent_adaptations,
                            difficulty_adaptation_data=difficulty_adaptation_data,
                            patient_progress_data=patient_progress_data,
                            adaptation_frequency_data=adaptation_frequency_data,
+                           patient_segments=segmentation_service.summary(current_user.id),
                            active_page='analytics')
 
 @therapist_bp.route('/reports')
@@ -447,7 +472,7 @@ def export_reports():
         return jsonify({'error': 'Fechas inválidas'}), 400
 
     # Query appointments for this therapist in range
-    appts = Appointment.query.filter(
+    appts = Appointment.query.options(games_loader()).filter(
         Appointment.therapist_id == current_user.id,
         Appointment.start_time >= start_dt,
         Appointment.start_time <= end_dt
@@ -468,10 +493,7 @@ def export_reports():
         avg_time = db.session.query(func.avg(SessionMetrics.avg_time)).filter(SessionMetrics.user_id == pid, SessionMetrics.date >= start_dt, SessionMetrics.date <= end_dt).scalar() or 0
         last_session = db.session.query(func.max(SessionMetrics.date)).filter(SessionMetrics.user_id == pid).scalar()
         last_session_str = last_session.isoformat() if last_session else ''
-        try:
-            games_list = json.loads(a.games) if a.games else []
-        except Exception:
-            games_list = []
+        games_list = a.games_list
 
         writer.writerow([
             a.id,
@@ -634,7 +656,7 @@ def add_patient():
     # Always show credentials in flash message for easy access
     if email_sent:
         flash(f'✅ Paciente {new_patient.username} agregado exitosamente.<br>'
-              f'📧 Email enviado a: <strong>{email}</strong><br>'
+              f'📧 Email en cola de envío a: <strong>{email}</strong><br>'
               f'🔑 Contraseña temporal: <strong>{password}</strong><br>'
               f'<small>El paciente recibirá estas credenciales por correo.</small>', 'success')
     else:
@@ -646,6 +668,36 @@ def add_patient():
     
     return redirect(url_for('therapist.patients'))
 
+@therapist_bp.route('/patients/import', methods=['POST'])
+@login_required
+def import_patients():
+    """Bulk-create patients from a CSV upload (`file`) or JSON ({"patients": [{email, username}]})."""
+    if current_user.role != 'terapista':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    file = request.files.get('file')
+    try:
+        if file:
+            rows = patient_import_service.parse_csv(file.stream)
+        else:
+            data = request.get_json(silent=True) or {}
+            rows = data.get('patients') if isinstance(data, dict) else data
+    except (UnicodeDecodeError, csv.Error):
+        return jsonify({'success': False, 'message': 'Archivo CSV inválido'}), 400
+
+    if not rows or not isinstance(rows, list):
+        return jsonify({'success': False, 'message': 'No hay pacientes para importar'}), 400
+    max_rows = current_app.config.get('PATIENT_IMPORT_MAX_ROWS', 1000)
+    if len(rows) > max_rows:
+        return jsonify({'success': False, 'message': f'Máximo {max_rows} pacientes por importación'}), 400
+
+    try:
+        report = patient_import_service.import_patients(current_user, rows)
+    except Exception:
+        current_app.logger.exception("Patient import failed")
+        return jsonify({'success': False, 'message': 'No se pudo completar la importación'}), 500
+    return jsonify({'success': True, **report})
+
 @therapist_bp.route('/patients/toggle/<int:patient_id>', methods=['POST'])
 @login_required
 def toggle_patient_status(patient_id):
@@ -681,8 +733,16 @@ def delete_patient(patient_id):
     
     try:
         # Delete patient's related records first to satisfy FK constraints
+        SessionTrials.query.filter_by(user_id=patient_id).delete()
         SessionMetrics.query.filter_by(user_id=patient_id).delete()
+        appt_ids = db.session.query(Appointment.id).filter_by(patient_id=patient_id)
+        AppointmentGame.query.filter(AppointmentGame.appointment_id.in_(appt_ids)).delete(synchronize_session=False)
         Appointment.query.filter_by(patient_id=patient_id).delete()
+        AppointmentSeries.query.filter_by(patient_id=patient_id).delete()
+        GameProfile.query.filter_by(user_id=patient_id).delete()
+        PatientModelState.query.filter_by(user_id=patient_id).delete()
+        PatientSegment.query.filter_by(user_id=patient_id).delete()
+        GameGenerationJob.query.filter_by(target_user_id=patient_id).delete()
         db.session.delete(patient)
 
         notification_service.create_notification(
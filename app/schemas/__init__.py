@@ -1,4 +1,5 @@
 from marshmallow import Schema, fields, validate, ValidationError
+from app.services.game_assignment_service import GameAssignmentService
 
 class CreateUserSchema(Schema):
     email = fields.Email(required=True)
@@ -19,3 +20,73 @@ class SendMessageSchema(Schema):
     receiver_id = fields.Int(required=True)
     subject = fields.Str(required=False, allow_none=True)
     body = fields.Str(required=True, validate=validate.Length(min=1))
+
+
+class UTCDateTime(fields.DateTime):
+    """Naive datetimes are stored in UTC; serialize them with an explicit Z suffix."""
+    def _serialize(self, value, attr, obj, **kwargs):
+        if value is None:
+            return None
+        iso = value.isoformat()
+        return iso + 'Z' if value.tzinfo is None else iso
+
+class ParticipantSchema(Schema):
+    id = fields.Int()
+    name = fields.Str(attribute='username')
+
+class CalendarEventSchema(Schema):
+    id = fields.Int(allow_none=True)
+    title = fields.Str()
+    start = UTCDateTime(attribute='start_time')
+    end = UTCDateTime(attribute='end_time')
+    status = fields.Str()
+    location = fields.Str()
+    notes = fields.Str()
+    games = fields.Method('get_games')
+    # Recurring sessions: id is null until the occurrence is materialized
+    series_id = fields.Int(allow_none=True)
+    occurrence = UTCDateTime(attribute='occurrence_start', allow_none=True)
+
+    def get_games(self, obj):
+        return obj.games_list
+
+class TherapistCalendarEventSchema(CalendarEventSchema):
+    title = fields.Method('get_title')
+    patient = fields.Nested(ParticipantSchema, allow_none=True)
+
+    def get_title(self, obj):
+        return obj.title or (obj.patient.username if obj.patient else 'Sesión')
+
+class PatientCalendarEventSchema(CalendarEventSchema):
+    therapist = fields.Nested(ParticipantSchema, allow_none=True)
+
+class UpcomingSessionSchema(Schema):
+    id = fields.Int(allow_none=True)
+    patient = fields.Method('get_patient')
+    start_time = UTCDateTime()
+    end_time = UTCDateTime()
+    games = fields.Method('get_games')
+    series_id = fields.Int(allow_none=True)
+    occurrence = UTCDateTime(attribute='occurrence_start', allow_none=True)
+
+    def get_patient(self, obj):
+        return (obj.patient.username or obj.patient.email) if obj.patient else None
+
+    def get_games(self, obj):
+        return obj.games_list
+
+class AppointmentSeriesSchema(Schema):
+    id = fields.Int()
+    title = fields.Str()
+    rrule = fields.Str()
+    start = UTCDateTime(attribute='dtstart')
+    until = UTCDateTime(allow_none=True)
+    duration_minutes = fields.Int()
+    timezone = fields.Str(allow_none=True)
+    location = fields.Str(allow_none=True)
+    notes = fields.Str(allow_none=True)
+    games = fields.Method('get_games')
+    patient = fields.Nested(ParticipantSchema, allow_none=True)
+
+    def get_games(self, obj):
+        return GameAssignmentService.parse_legacy(obj.games)
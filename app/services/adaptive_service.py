@@ -0,0 +1,169 @@
+import json
+from datetime import datetime
+import pytz
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from app.models import PatientModelState, SessionMetrics, SessionTrials, User, db
+from app.services.ai_service import LABELS, predict_scored, predict_versioned
+from app.utils import get_user_timezone
+
+def local_hour(utc_dt, tz):
+    """Hour of day in `tz` for a naive UTC datetime."""
+    return pytz.UTC.localize(utc_dt).astimezone(tz).hour
+
+def _contexts(state):
+    try:
+        return json.loads(state.contexts) if state.contexts else {}
+    except ValueError:
+        return {}
+
+class AdaptiveModel:
+    """Global difficulty model personalized with a patient's online statistics.
+
+    The global model still makes the decision, but it is shown the patient's estimated level
+    instead of the raw play: the play is first corrected for how this patient usually does in
+    this game and part of the day, then blended with the running EWMA level and its trend.
+    Both predict() and update() do a constant amount of work per play. They only touch a
+    PatientModelState, persisted or not, so the benchmark can replay history in memory.
+
+    With a `fatigue_threshold`, the fatigue score of plays that sent per-trial reaction times
+    caps the decision: a patient who is tired now or lately is not moved up a level, and one
+    who is tired now and lately is given support.
+    """
+
+    # Plays a context (game or part of the day) needs before its offset is trusted
+    MIN_CONTEXT_PLAYS = 3
+
+    def __init__(self, base, alpha=0.3, min_plays=5, current_weight=0.3, fatigue_threshold=None):
+        self.base = base
+        self.alpha = alpha
+        self.min_plays = min_plays
+        self.current_weight = current_weight
+        self.fatigue_threshold = fatigue_threshold
+
+    @staticmethod
+    def new_state(user_id=None):
+        return PatientModelState(user_id=user_id, plays=0, ewma_accuracy=0.0, ewma_time_ms=0.0,
+                                 trend_accuracy=0.0, trend_time_ms=0.0)
+
+    @staticmethod
+    def context_keys(game_id, hour):
+        keys = [] if hour is None else [f'h:{hour // 6}']
+        if game_id is not None:
+            keys.append(f'g:{game_id}')
+        return keys
+
+    def features(self, state, accuracy, time_ms, game_id=None, hour=None):
+        """(accuracy, time_ms) the global model is asked about for this play."""
+        if state is None or (state.plays or 0) < self.min_plays:
+            return accuracy, time_ms
+        contexts = _contexts(state)
+        offset_accuracy = offset_time = 0.0
+        for key in self.context_keys(game_id, hour):
+            ctx = contexts.get(key)
+            if ctx and ctx[0] >= self.MIN_CONTEXT_PLAYS:
+                offset_accuracy += ctx[1] - state.ewma_accuracy
+                offset_time += ctx[2] - state.ewma_time_ms
+        w = self.current_weight
+        accuracy = w * (accuracy - offset_accuracy) + (1 - w) * (state.ewma_accuracy + state.trend_accuracy)
+        time_ms = w * (time_ms - offset_time) + (1 - w) * (state.ewma_time_ms + state.trend_time_ms)
+        return min(max(accuracy, 0.0), 100.0), max(time_ms, 0.0)
+
+    def predict(self, state, accuracy, time_ms, game_id=None, hour=None, fatigue=None):
+        code = int(self.base(*self.features(state, accuracy, time_ms, game_id, hour)))
+        if self.fatigue_threshold is None:
+            return code
+        tired_now = fatigue is not None and fatigue >= self.fatigue_threshold
+        tired_lately = state is not None and state.ewma_fatigue is not None and state.ewma_fatigue >= self.fatigue_threshold
+        if code == 1 and (tired_now or tired_lately):
+            return 0
+        if code == 0 and tired_now and tired_lately:
+            return 2
+        return code
+
+    def update(self, state, accuracy, time_ms, game_id=None, hour=None, played_at=None, fatigue=None):
+        """Fold one play into `state`."""
+        a = self.alpha
+        if not state.plays:
+            state.ewma_accuracy, state.ewma_time_ms = accuracy, time_ms
+            state.trend_accuracy = state.trend_time_ms = 0.0
+        else:
+            prev_accuracy, prev_time = state.ewma_accuracy, state.ewma_time_ms
+            state.ewma_accuracy += a * (accuracy - prev_accuracy)
+            state.ewma_time_ms += a * (time_ms - prev_time)
+            state.trend_accuracy += a * ((state.ewma_accuracy - prev_accuracy) - state.trend_accuracy)
+            state.trend_time_ms += a * ((state.ewma_time_ms - prev_time) - state.trend_time_ms)
+        state.plays = (state.plays or 0) + 1
+
+        contexts = _contexts(state)
+        for key in self.context_keys(game_id, hour):
+            ctx = contexts.get(key)
+            if ctx is None:
+                contexts[key] = [1, accuracy, time_ms]
+            else:
+                contexts[key] = [ctx[0] + 1, ctx[1] + a * (accuracy - ctx[1]), ctx[2] + a * (time_ms - ctx[2])]
+        state.contexts = json.dumps(contexts)
+        if fatigue is not None:
+            state.ewma_fatigue = fatigue if state.ewma_fatigue is None else state.ewma_fatigue + a * (fatigue - state.ewma_fatigue)
+        state.last_played_at = played_at or datetime.utcnow()
+        return state
+
+class AdaptiveService:
+    """Per-patient adaptive decisions for save_game, backed by PatientModelState rows."""
+
+    @staticmethod
+    def model(base=None):
+        config = current_app.config
+        return AdaptiveModel(base or (lambda accuracy, time_ms: predict_versioned(accuracy, time_ms)[0]),
+                             alpha=config.get('ADAPTIVE_EWMA_ALPHA', 0.3),
+                             min_plays=config.get('ADAPTIVE_MIN_PLAYS', 5),
+                             current_weight=config.get('ADAPTIVE_CURRENT_WEIGHT', 0.3),
+                             fatigue_threshold=config.get('FATIGUE_ALERT_SCORE', 0.6))
+
+    @staticmethod
+    def _seed(state, model):
+        """Build a new patient's state from the plays stored before it existed (once per patient)."""
+        user = db.session.get(User, state.user_id)
+        tz = get_user_timezone(user)
+        rows = db.session.query(
+            SessionMetrics.game_id, SessionMetrics.accurracy, SessionMetrics.avg_time, SessionMetrics.date,
+            SessionTrials.fatigue_score
+        ).outerjoin(SessionTrials, SessionTrials.metric_id == SessionMetrics.id).filter(
+            SessionMetrics.user_id == state.user_id
+        ).order_by(SessionMetrics.date, SessionMetrics.id)
+        for game_id, accuracy, avg_time, date, fatigue in rows:
+            model.update(state, accuracy, avg_time * 1000, game_id, local_hour(date, tz) if date else None, date, fatigue)
+
+    def _get_or_create(self, user_id, model):
+        state = db.session.get(PatientModelState, user_id)
+        if state is None:
+            state = model.new_state(user_id)
+            self._seed(state, model)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(state)
+            except IntegrityError:
+                # A concurrent play of the same patient created the row first
+                state = db.session.get(PatientModelState, user_id, populate_existing=True)
+        return state
+
+    def observe(self, user_id, accuracy, time_ms, game_id=None, hour=None, fatigue=None):
+        """(code, label, model version, confidence) for this play from the patient's state, then
+        fold the play into the state. Until ADAPTIVE_MIN_PLAYS plays are known this is the global
+        model's answer, capped by `fatigue` (FatigueService score of the play, if it sent trials).
+        `confidence` is the model's probability (0-100) of the code for the features it was shown,
+        None when the fatigue cap changed the code or the model has no probabilities.
+        The caller commits."""
+        served = {}
+
+        def base(accuracy, time_ms):
+            code, served['confidence'], served['version'] = predict_scored(accuracy, time_ms)
+            served['code'] = code
+            return code
+
+        model = self.model(base)
+        state = self._get_or_create(user_id, model)
+        code = model.predict(state, accuracy, time_ms, game_id, hour, fatigue)
+        model.update(state, accuracy, time_ms, game_id, hour, fatigue=fatigue)
+        confidence = served.get('confidence') if served.get('code') == code else None
+        return code, LABELS[code], served.get('version'), confidence
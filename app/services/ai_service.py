@@ -1,11 +1,57 @@
 import os
+import time
 import numpy as np
-import pandas as pd
-from sklearn.cluster import KMeans
-from joblib import load, dump
-from sklearn.svm import SVC
+from flask import current_app, has_app_context
+from joblib import load
+from app.services.decision_grid import DecisionGrid
+from app.services.model_store import ModelStore
 
-MODEL_PATH= 'ai_models/svm_model.pkl'
+# scikit-learn is imported only where a model is fitted or unpickled, so a web worker that
+# answers predict_level from the decision grid never loads it.
+
+MODEL_DIR = 'ai_models'
+# Single-file model written by older releases; ensure_model imports it into the store once
+LEGACY_MODEL_PATH = os.path.join(MODEL_DIR, 'svm_model.pkl')
+
+LABELS = {0: "Mantener Nivel", 1: "Avanzar Nivel", 2: "Retroceder/Apoyo"}
+
+def _setting(name, default):
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return os.getenv(name, default)
+
+# Accuracy (0-100) and time (ms) live on very different scales, so distance/gradient based
+# models get a StandardScaler in front.
+def _scaled(estimator):
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    return make_pipeline(StandardScaler(), estimator)
+
+def _svc():
+    from sklearn.svm import SVC
+    return _scaled(SVC(kernel='rbf', probability=True))
+
+def _logreg():
+    from sklearn.linear_model import LogisticRegression
+    return _scaled(LogisticRegression(max_iter=1000))
+
+def _gbt():
+    from sklearn.ensemble import HistGradientBoostingClassifier
+    return HistGradientBoostingClassifier(max_iter=100)
+
+def _tree():
+    from sklearn.tree import DecisionTreeClassifier
+    return DecisionTreeClassifier(max_depth=6)
+
+# Estimators train_model can fit, by AI_MODEL_BACKEND name. Each factory returns an unfitted
+# scikit-learn classifier over [accuracy, avg_time_ms]; register_backend adds more.
+BACKENDS = {'svc': _svc, 'logreg': _logreg, 'gbt': _gbt, 'tree': _tree}
+
+def register_backend(name, factory):
+    BACKENDS[name] = factory
+
+def default_backend():
+    return _setting('AI_MODEL_BACKEND', 'tree')
 
 def get_expert_label(accuracy, avg_time_ms):
     """
@@ -22,63 +68,193 @@ def get_expert_label(accuracy, avg_time_ms):
     else:
         return 0
 
-def train_model(real_data=None):
-    """
-    Train the SVM model.
-    real_data: List of [accuracy, avg_time_ms] from actual user sessions.
-    """
-    X = []
-    Y = []
-    
+def expert_labels(accuracy, avg_time_ms):
+    """get_expert_label over NumPy arrays."""
+    accuracy = np.asarray(accuracy, dtype=float)
+    avg_time_ms = np.asarray(avg_time_ms, dtype=float)
+    labels = np.zeros(accuracy.shape, dtype=int)
+    labels[(accuracy < 60) | (avg_time_ms > 2500)] = 2
+    labels[(accuracy >= 80) & (avg_time_ms <= 1500)] = 1
+    return labels
+
+def training_set(real_data=None):
+    """(X, y) for train_model: synthetic base knowledge plus the real points, oversampled."""
     # 1. Generate Synthetic Data (Base Knowledge) to ensure model stability
     # We use 300 points to maintain a solid baseline
-    for _ in range(300):
-        acc = np.random.uniform(0, 100)
-        time = np.random.uniform(500, 3000)
-        label = get_expert_label(acc, time)
-        X.append([acc, time])
-        Y.append(label)
+    X = np.column_stack([np.random.uniform(0, 100, 300), np.random.uniform(500, 3000, 300)])
 
     # 2. Incorporate Real Data (Retraining/Adaptation)
-    if real_data and len(real_data) > 0:
-        print(f"Retraining with {len(real_data)} real data points...")
-        for data_point in real_data:
-            acc = data_point[0]
-            time = data_point[1]
-            # In a future version, this label could come from therapist feedback
-            # For now, we auto-label to adapt the decision boundaries to the user's data distribution
-            label = get_expert_label(acc, time)
-            
-            # We add the real data multiple times (oversampling) to give it more weight
-            # This ensures the model adapts to the specific user patterns
-            for _ in range(3): 
-                X.append([acc, time])
-                Y.append(label)
-
-    model = SVC(kernel='rbf', probability=True)
-    model.fit(X, Y)
-    
-    # ensure the directory for the model exists
-    model_dir = os.path.dirname(MODEL_PATH)
-    if model_dir and not os.path.exists(model_dir):
-        os.makedirs(model_dir, exist_ok=True)
-    dump(model, MODEL_PATH)
-    print("Modelo re-entrenado y guardado exitosamente.")
+    if real_data is not None and len(real_data) > 0:
+        # We add the real data multiple times (oversampling) to give it more weight
+        # This ensures the model adapts to the specific user patterns
+        X = np.vstack([X, np.repeat(np.asarray(real_data, dtype=float).reshape(-1, 2), 3, axis=0)])
+
+    # In a future version, real labels could come from therapist feedback
+    # For now, we auto-label to adapt the decision boundaries to the user's data distribution
+    return X, expert_labels(X[:, 0], X[:, 1])
+
+def fit_model(real_data=None, backend=None):
+    """Estimator of `backend` (AI_MODEL_BACKEND by default) fitted on training_set(), not published."""
+    X, y = training_set(real_data)
+    model = BACKENDS[backend or default_backend()]()
+    model.fit(X, y)
+    return model
+
+def referenced_versions():
+    """Model versions that stored predictions (SessionMetrics.model_version) point to."""
+    if not has_app_context():
+        return set()
+    from app.models import SessionMetrics, db
+    return {v for (v,) in db.session.query(SessionMetrics.model_version).distinct() if v}
+
+def model_store():
+    return ModelStore(MODEL_DIR, keep=int(_setting('AI_MODEL_KEEP_VERSIONS', 5)), referenced=referenced_versions)
+
+def train_model(real_data=None, backend=None):
+    """
+    Train the difficulty model with the configured backend and publish it as a new version,
+    activated unless a version is pinned by `flask model-rollback`.
+    real_data: List of [accuracy, avg_time_ms] from actual user sessions.
+    Returns the version id.
+    """
+    real_points = len(real_data) if real_data is not None else 0
+    if real_points > 0:
+        print(f"Retraining with {real_points} real data points...")
+    backend = backend or default_backend()
+    X, y = training_set(real_data)
+    started = time.perf_counter()
+    model = BACKENDS[backend]()
+    model.fit(X, y)
+    fit_seconds = time.perf_counter() - started
+
+    grid = build_grid(model) if grid_enabled() else None
+    if grid is not None:
+        report = grid.report(model, samples=5000)
+        metrics = {'expert_agreement': report['model_expert_agreement'], 'grid_disagreement': report['disagreement']}
+    else:
+        sample = np.column_stack([np.random.uniform(0, 100, 5000), np.random.uniform(0, 5000, 5000)])
+        agreement = (np.asarray(model.predict(sample)) == expert_labels(sample[:, 0], sample[:, 1])).mean()
+        metrics = {'expert_agreement': round(float(agreement), 4)}
+    store = model_store()
+    pinned = store.pinned()
+    version = store.publish(model, {
+        'backend': backend,
+        'train_size': len(X),
+        'real_points': real_points,
+        'fit_seconds': round(fit_seconds, 3),
+        'metrics': metrics
+    }, grid, activate=pinned is None)
+    if pinned is not None:
+        print(f"Modelo re-entrenado y guardado ({version}); sigue activa la versión fijada {pinned}.")
+        return version
+    global _active
+    _active = (version, time.monotonic())
+    print(f"Modelo re-entrenado y guardado exitosamente ({version}).")
+    return version
+
+def ensure_model():
+    """Make sure there is an active model version, training one with AI_MODEL_BACKEND if needed,
+    and compile a missing grid. Never retrains an existing model.
+
+    A legacy svm_model.pkl (unscaled SVC that answers almost everything with one class) is kept
+    as an inactive version, only reachable with `flask model-rollback`.
+    """
+    store = model_store()
+    version = store.current()
+    if version is None:
+        if os.path.exists(LEGACY_MODEL_PATH):
+            store.publish(load(LEGACY_MODEL_PATH), {'backend': 'legacy', 'imported_from': LEGACY_MODEL_PATH},
+                          activate=False)
+        version = train_model()
+    elif grid_enabled() and not store.has_grid(version):
+        compile_grid()
+    return version
+
+# Active version of this process: (version id, monotonic time of the last CURRENT read)
+_active = (None, 0.0)
+# Seconds between checks for a version published or rolled back by another process
+VERSION_RECHECK_SECONDS = 1.0
+
+def model_version():
+    """Id of the active model version."""
+    global _active
+    version, checked_at = _active
+    now = time.monotonic()
+    if version is None or now - checked_at >= VERSION_RECHECK_SECONDS:
+        version = model_store().current() or ensure_model()
+        _active = (version, now)
+    return version
+
+# Models of this process, unpickled once per version: (version id, model) and (version id, grid)
+_loaded = (None, None)
+_grid = (None, None)
+
+def load_model(version=None):
+    """The fitted model of `version` (the active one by default)."""
+    global _loaded
+    version = version or model_version()
+    if _loaded[0] != version:
+        _loaded = (version, model_store().load_model(version))
+    return _loaded[1]
+
+def grid_enabled():
+    value = _setting('AI_DECISION_GRID', True)
+    return value if isinstance(value, bool) else str(value).lower() in ('1', 'true', 'yes')
+
+def build_grid(model):
+    """`model` evaluated on the AI_GRID_* lattice."""
+    return DecisionGrid.compile(model,
+                                accuracy_step=float(_setting('AI_GRID_ACCURACY_STEP', 0.5)),
+                                time_step_ms=float(_setting('AI_GRID_TIME_STEP_MS', 10)),
+                                max_time_ms=float(_setting('AI_GRID_MAX_TIME_MS', 5000)))
+
+def compile_grid(version=None):
+    """(Re)compile the grid of `version` (the active one by default) and store it with the model."""
+    global _grid
+    store = model_store()
+    version = version or model_version()
+    grid = build_grid(load_model(version))
+    grid.save(store.path(version, store.GRID_FILE))
+    _grid = (version, grid)
+    return grid
+
+def load_grid(version=None):
+    """The compiled decision grid of `version`, None if it has none."""
+    global _grid
+    version = version or model_version()
+    if _grid[0] != version:
+        store = model_store()
+        _grid = (version, DecisionGrid.load(store.path(version, store.GRID_FILE)) if store.has_grid(version) else None)
+    return _grid[1]
+
+def predict_versioned(accuracy, avg_time):
+    """(code, label, model version) for one play."""
+    version = model_version()
+    grid = load_grid(version) if grid_enabled() else None
+    if grid is not None:
+        pred = grid.predict(accuracy, avg_time)
+    else:
+        model = load_model(version)
+        # predict returns an array; take the first (and only) element
+        pred = model.predict([[accuracy, avg_time]])[0]
+
+    return int(pred), LABELS[int(pred)], version
+
+def predict_scored(accuracy, avg_time):
+    """(code, probability 0-100 of that code or None, model version) for one play."""
+    version = model_version()
+    grid = load_grid(version) if grid_enabled() else None
+    if grid is not None and grid.confidence is not None:
+        code, confidence = grid.predict_scored(accuracy, avg_time)
+        return int(code), int(confidence), version
+    model = load_model(version)
+    code = int(model.predict([[accuracy, avg_time]])[0])
+    confidence = None
+    if hasattr(model, 'predict_proba'):
+        classes = list(model.classes_)
+        confidence = round(float(model.predict_proba([[accuracy, avg_time]])[0][classes.index(code)]) * 100)
+    return code, confidence, version
 
 def predict_level(accuracy, avg_time):
-    if not os.path.exists(MODEL_PATH):
-        train_model()
-    
-    model = load(MODEL_PATH)
-    # predict returns an array; take the first (and only) element
-    pred = model.predict([[accuracy, avg_time]])[0]
-
-    labels = {0: "Mantener Nivel", 1: "Avanzar Nivel", 2: "Retroceder/Apoyo"}
-    
-    return int(pred), labels[int(pred)]
-
-def get_cluster(metrics_data):
-    if len(metrics_data) < 3: return []
-    kmeans = KMeans(n_clusters=3, n_init=10)
-    kmeans.fit(metrics_data)
-    return kmeans.labels_
+    code, label, _ = predict_versioned(accuracy, avg_time)
+    return code, label
@@ -1,13 +1,38 @@
-from app.models import Appointment, db, User
+from app.models import Appointment, AppointmentSeries, db, User
+from app.schemas import UpcomingSessionSchema
+from app.services.cache import TTLCache, invalidate_on_commit
+from app.services.game_assignment_service import GameAssignmentService, games_loader
 from app.services.notification_service import NotificationService
+from app.services.recurrence_service import RecurrenceService
+from app.services.schedule_service import ScheduleService
 from app.utils import get_user_today_utc_range
-from flask import url_for
-import json
+from flask import current_app, url_for
 from datetime import datetime, timedelta
+from sqlalchemy.orm import joinedload
+
+# Serialized upcoming-session feed per therapist id. Dropped whenever one of the
+# therapist's appointments is committed; the TTL covers patient renames.
+upcoming_sessions_cache = TTLCache(ttl=60, max_size=5000)
+invalidate_on_commit(Appointment, upcoming_sessions_cache, lambda appt: appt.therapist_id)
+invalidate_on_commit(AppointmentSeries, upcoming_sessions_cache, lambda series: series.therapist_id)
+
+upcoming_sessions_schema = UpcomingSessionSchema(many=True)
 
 class AppointmentService:
     def __init__(self):
         self.notification_service = NotificationService()
+        self.recurrence_service = RecurrenceService()
+        self.schedule_service = ScheduleService()
+        self.game_assignment_service = GameAssignmentService()
+
+    @staticmethod
+    def _lookahead(start_dt):
+        return start_dt + timedelta(days=current_app.config.get('RECURRENCE_LOOKAHEAD_DAYS', 90))
+
+    @staticmethod
+    def _merge(rows, occurrences, limit=None):
+        merged = sorted(list(rows) + occurrences, key=lambda a: a.start_time)
+        return merged[:limit] if limit else merged
 
     def get_therapist_appointments(self, therapist_id, start_dt, end_dt):
         return Appointment.query.filter(
@@ -24,13 +49,40 @@ class AppointmentService:
             Appointment.status == 'scheduled'
         ).order_by(Appointment.start_time.asc()).limit(limit).all()
 
+    def get_upcoming_feed(self, therapist_id, limit=20):
+        """Serialized upcoming sessions with patient names, from one joined query.
+
+        Sessions that started while the feed sat in the cache are dropped on read.
+        """
+        cached = upcoming_sessions_cache.get(therapist_id)
+        if cached is None:
+            now = datetime.utcnow()
+            appts = Appointment.query.options(
+                joinedload(Appointment.patient).load_only(User.id, User.username, User.email),
+                games_loader()
+            ).filter(
+                Appointment.therapist_id == therapist_id,
+                Appointment.start_time >= now,
+                Appointment.status == 'scheduled'
+            ).order_by(Appointment.start_time.asc()).limit(limit).all()
+            appts = self._merge(appts, self.recurrence_service.occurrences(
+                'therapist', therapist_id, now, self._lookahead(now)), limit)
+            cached = list(zip([a.start_time for a in appts], upcoming_sessions_schema.dump(appts)))
+            upcoming_sessions_cache.set(therapist_id, cached)
+        now = datetime.utcnow()
+        return [item for start, item in cached if start >= now]
+
     def get_patient_appointments(self, patient_id, start_dt=None, end_dt=None, limit=10):
-        query = Appointment.query.filter(Appointment.patient_id == patient_id)
+        """Stored sessions merged with generated series occurrences. Read-only: occurrences keep
+        id None and are materialized through POST /api/series/<id>/occurrences when played."""
+        query = Appointment.query.options(games_loader(), joinedload(Appointment.therapist)).filter(
+            Appointment.patient_id == patient_id)
         if start_dt and end_dt:
-            return query.filter(
+            rows = query.filter(
                 Appointment.start_time >= start_dt,
                 Appointment.start_time <= end_dt
             ).order_by(Appointment.start_time.asc()).all()
+            return self._merge(rows, self.recurrence_service.occurrences('patient', patient_id, start_dt, end_dt))
         else:
             # Default: upcoming and today's sessions
             # Use user's timezone to determine "today"
@@ -40,13 +92,14 @@ class AppointmentService:
             else:
                 today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
 
-            return query.filter(
+            rows = query.filter(
                 Appointment.start_time >= today_start,
                 Appointment.status == 'scheduled'
             ).order_by(Appointment.start_time.asc()).limit(limit).all()
+            return self._merge(rows, self.recurrence_service.occurrences(
+                'patient', patient_id, today_start, self._lookahead(today_start)), limit)
 
     def create_session(self, therapist_id, data, therapist_username):
-        from app.models import User, Game, AppointmentGame
         patient_id = data.get('patient_id')
         start_time = data.get('start_time') # Assumes datetime object
         end_time = data.get('end_time') # Assumes datetime object
@@ -55,6 +108,10 @@ class AppointmentService:
         if not patient or patient.role != 'jugador':
             raise ValueError("Paciente no válido")
 
+        if (data.get('status') or 'scheduled') != 'cancelled':
+            self.schedule_service.ensure_free(therapist_id, start_time, end_time,
+                                              allow_overlap=bool(data.get('allow_overlap')))
+
         appt = Appointment(
             therapist_id=therapist_id,
             patient_id=patient_id,
@@ -66,35 +123,8 @@ class AppointmentService:
             status=data.get('status') or 'scheduled'
         )
         
-        # Handle games
-        games_payload = data.get('games')
-        games_list = []
-        if games_payload:
-            if isinstance(games_payload, str):
-                games_list = [g.strip() for g in games_payload.split(',') if g.strip()]
-            elif isinstance(games_payload, list):
-                games_list = games_payload
-        
-        # Legacy support: save to JSON column
-        if games_list:
-            appt.games = json.dumps(games_list)
-        
         db.session.add(appt)
-        db.session.flush() # Get ID
-        
-        # New support: save to AppointmentGame table
-        if games_list:
-            for game_filename in games_list:
-                # Find game by filename
-                game = Game.query.filter_by(filename=game_filename).first()
-                if game:
-                    assoc = AppointmentGame(appointment_id=appt.id, game_id=game.id)
-                    db.session.add(assoc)
-                else:
-                    # Auto-create if missing (fallback for custom/legacy files not in DB yet)
-                    # Ideally we shouldn't do this, but for stability:
-                    pass 
-
+        self.game_assignment_service.assign(appt, data.get('games'))
         db.session.commit()
 
         # Notifications
@@ -110,6 +140,15 @@ class AppointmentService:
         appt = Appointment.query.get(session_id)
         if not appt:
             return None
+
+        start_time = data.get('start_time') if 'start_time' in data else appt.start_time
+        end_time = data.get('end_time') if 'end_time' in data else appt.end_time
+        status = data.get('status') if 'status' in data else appt.status
+        moved = start_time != appt.start_time or end_time != appt.end_time or (
+            status != 'cancelled' and appt.status == 'cancelled')
+        if moved and start_time and status != 'cancelled':
+            self.schedule_service.ensure_free(appt.therapist_id, start_time, end_time, ignore_id=appt.id,
+                                              allow_overlap=bool(data.get('allow_overlap')))
             
         if 'start_time' in data:
             appt.start_time = data.get('start_time')
@@ -139,7 +178,11 @@ class AppointmentService:
         patient_id = appt.patient_id
         title = appt.title
         
-        db.session.delete(appt)
+        if appt.series_id:
+            # Keep the row as a tombstone so the series does not generate the occurrence again
+            appt.status = 'cancelled'
+        else:
+            db.session.delete(appt)
         db.session.commit()
 
         try:
@@ -1,17 +1,27 @@
 from app.repositories.user_repository import UserRepository
-from app.extensions import bcrypt
+from app.services.password_service import password_service
 from flask_login import login_user, logout_user
+import time
 
 class AuthService:
     def __init__(self):
         self.user_repo = UserRepository()
 
     def login(self, email, password):
-        user = self.user_repo.get_by_email(email)
-        if user and user.is_active and bcrypt.check_password_hash(user.password, password):
-            login_user(user)
-            return True, user
-        return False, None
+        """Raises PasswordHasherBusy when the verification pool is saturated."""
+        started = time.perf_counter()
+        try:
+            user = self.user_repo.get_by_email(email)
+            if user and user.is_active and password_service.verify(user.password, password):
+                # Upgrade hashes made with an older work factor while we have the plain password
+                if password_service.needs_rehash(user.password):
+                    user.password = password_service.hash(password)
+                    self.user_repo.save(user)
+                login_user(user)
+                return True, user
+            return False, None
+        finally:
+            password_service.login_latency.record((time.perf_counter() - started) * 1000)
 
     def logout(self):
         logout_user()
@@ -20,4 +30,4 @@ class AuthService:
         user = self.user_repo.get_by_email(email)
         if not user or not user.is_active:
             return False
-        return bcrypt.check_password_hash(user.password, password)
+        return password_service.verify(user.password, password)
@@ -0,0 +1,125 @@
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from flask import current_app
+from app.models import User
+from app.repositories.appointment_repository import AppointmentRepository
+from app.repositories.user_repository import UserRepository
+from app.services.recurrence_service import RecurrenceService
+
+class AvailabilityService:
+    """Free slots for many therapists at once.
+
+    The window is cut into SCHEDULE_SLOT_STEP_MINUTES cells and every therapist becomes a row
+    of a (therapists x cells) grid. Working hours are one mask per distinct timezone, busy
+    intervals are marked with a difference array and a single cumsum, and the cells where a
+    slot of the requested length fits come from a sliding-window sum. Three queries in total:
+    therapists with caseloads, stored sessions and series occurrences.
+    """
+
+    # Sessions are shorter than this, so looking back this far finds every overlap
+    MAX_SESSION = timedelta(days=1)
+
+    def __init__(self):
+        self.recurrence_service = RecurrenceService()
+
+    @staticmethod
+    def _working_mask(start_dt, cells, step_minutes, timezones):
+        """{timezone: bool[cells]} True where the whole cell falls inside working hours."""
+        config = current_app.config
+        opening = config.get('SCHEDULE_WORKDAY_START_HOUR', 8) * 60
+        closing = config.get('SCHEDULE_WORKDAY_END_HOUR', 20) * 60
+        workdays = list(config.get('SCHEDULE_WORKDAYS', (0, 1, 2, 3, 4)))
+        grid = pd.date_range(start=start_dt, periods=cells, freq=f'{step_minutes}min', tz='UTC')
+        masks = {}
+        for tz in timezones:
+            try:
+                local = grid.tz_convert(tz or 'UTC')
+            except Exception:
+                local = grid
+            minutes = local.hour.values * 60 + local.minute.values
+            masks[tz] = (np.isin(local.weekday.values, workdays)
+                         & (minutes >= opening) & (minutes + step_minutes <= closing))
+        return masks
+
+    def search(self, start_dt, end_dt, duration_minutes=60, limit=20, per_therapist=3, therapist_ids=None):
+        """Earliest `limit` slots across therapists (at most `per_therapist` each) plus caseloads."""
+        step = current_app.config.get('SCHEDULE_SLOT_STEP_MINUTES', 15)
+        # Align the grid to the step so slots start on round times
+        start_dt = start_dt.replace(second=0, microsecond=0)
+        start_dt += timedelta(minutes=-start_dt.minute % step)
+        cells = int((end_dt - start_dt).total_seconds() // (step * 60))
+        need = -(-duration_minutes // step)
+
+        query = User.query.filter(User.role == 'terapista', User.is_active.is_(True))
+        if therapist_ids:
+            query = query.filter(User.id.in_(therapist_ids))
+        therapists = query.with_entities(User.id, User.username, User.email, User.timezone).order_by(User.id).all()
+        ids = [t.id for t in therapists]
+        caseloads = UserRepository.count_active_patients_grouped_by_therapist(ids) if ids else {}
+
+        summary = [{'id': t.id, 'username': t.username, 'email': t.email,
+                    'caseload': caseloads.get(t.id, 0), 'free_minutes': 0, 'next_free': None}
+                   for t in therapists]
+        if not ids or cells < need:
+            return {'slots': [], 'therapists': summary}
+
+        row_of = {tid: i for i, tid in enumerate(ids)}
+        default = timedelta(minutes=current_app.config.get('SCHEDULE_DEFAULT_DURATION_MINUTES', 60))
+        busy = [(tid, s, e if e and e > s else s + default)
+                for tid, s, e in AppointmentRepository.busy_intervals(ids, start_dt, end_dt, self.MAX_SESSION)]
+        busy.extend((o.therapist_id, o.start_time, o.end_time)
+                    for o in self.recurrence_service.occurrences_many('therapist', ids, start_dt - self.MAX_SESSION, end_dt))
+
+        # Busy cells: +1 at the first covered cell, -1 after the last, cumsum along time
+        delta = np.zeros((len(ids), cells + 1), dtype=np.int32)
+        if busy:
+            rows = np.fromiter((row_of[tid] for tid, _, _ in busy), dtype=np.int64, count=len(busy))
+            step_s = step * 60
+            first = np.fromiter(((s - start_dt).total_seconds() // step_s for _, s, _ in busy), dtype=np.int64, count=len(busy))
+            last = np.fromiter((-((start_dt - e).total_seconds() // step_s) for _, _, e in busy), dtype=np.int64, count=len(busy))
+            first = np.clip(first, 0, cells)
+            last = np.clip(last, 0, cells)
+            keep = last > first
+            np.add.at(delta, (rows[keep], first[keep]), 1)
+            np.add.at(delta, (rows[keep], last[keep]), -1)
+        occupied = np.cumsum(delta[:, :cells], axis=1) > 0
+
+        timezones = [t.timezone for t in therapists]
+        masks = self._working_mask(start_dt, cells, step, set(timezones))
+        working = np.vstack([masks[tz] for tz in timezones])
+        free = working & ~occupied
+
+        # fits[r, c]: cells c .. c+need-1 are all free for therapist r
+        run = np.zeros((len(ids), cells + 1), dtype=np.int32)
+        np.cumsum(free, axis=1, out=run[:, 1:])
+        fits = (run[:, need:] - run[:, :-need]) == need
+
+        free_minutes = free.sum(axis=1) * step
+        candidates = []
+        for r, row in enumerate(fits):
+            summary[r]['free_minutes'] = int(free_minutes[r])
+            picked, next_allowed = 0, 0
+            for c in np.flatnonzero(row):
+                if c < next_allowed:
+                    continue
+                if picked == 0:
+                    summary[r]['next_free'] = start_dt + timedelta(minutes=int(c) * step)
+                candidates.append((int(c), r))
+                picked += 1
+                next_allowed = c + need
+                if picked >= per_therapist:
+                    break
+
+        candidates.sort()
+        slots = []
+        for c, r in candidates[:limit]:
+            slot_start = start_dt + timedelta(minutes=c * step)
+            slots.append({
+                'therapist_id': ids[r],
+                'therapist': therapists[r].username or therapists[r].email,
+                'caseload': summary[r]['caseload'],
+                'start': slot_start,
+                'end': slot_start + timedelta(minutes=duration_minutes)
+            })
+        return {'slots': slots, 'therapists': summary}
@@ -0,0 +1,66 @@
+import threading
+import time
+from itertools import chain
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+class TTLCache:
+    """Small thread-safe process-level cache with per-entry expiry."""
+
+    def __init__(self, ttl=30, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self._entries.clear()
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def invalidate_on_commit(model, cache, key):
+    """Drop cache[key(obj)] after every commit that inserts, updates or deletes a `model` row.
+
+    Keys are collected at flush time and only applied once the transaction commits, so a
+    concurrent reader cannot re-cache the old row between flush and commit. Bulk
+    query.update()/delete() bypass the ORM and are covered by the cache TTL only.
+    """
+    bucket = f'cache_invalidate_{model.__name__}_{id(cache)}'
+
+    @event.listens_for(Session, 'after_flush')
+    def _collect(session, flush_context):
+        keys = session.info.setdefault(bucket, set())
+        for obj in chain(session.new, session.dirty, session.deleted):
+            if isinstance(obj, model):
+                value = key(obj)
+                if value is not None:
+                    keys.add(value)
+
+    @event.listens_for(Session, 'after_commit')
+    def _invalidate(session):
+        for value in session.info.pop(bucket, ()):
+            cache.invalidate(value)
+
+    @event.listens_for(Session, 'after_rollback')
+    def _discard(session):
+        session.info.pop(bucket, None)
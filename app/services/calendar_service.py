@@ -0,0 +1,74 @@
+from app.models import Appointment, User, db
+from app.schemas import TherapistCalendarEventSchema, PatientCalendarEventSchema
+from app.services.game_assignment_service import games_loader
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, load_only
+import hashlib
+
+# Built once at import; marshmallow resolves the fields up front
+therapist_events_schema = TherapistCalendarEventSchema(many=True)
+therapist_day_schema = TherapistCalendarEventSchema(many=True, exclude=('games',))
+patient_events_schema = PatientCalendarEventSchema(many=True)
+
+EVENT_COLUMNS = (
+    Appointment.id, Appointment.title, Appointment.start_time, Appointment.end_time,
+    Appointment.status, Appointment.location, Appointment.notes,
+    Appointment.patient_id, Appointment.therapist_id, Appointment.series_id, Appointment.occurrence_start
+)
+
+class CalendarService:
+    """Calendar feeds: range criteria, a cheap change fingerprint for ETags, and
+    event rows loaded with their participant in the same SELECT."""
+
+    @staticmethod
+    def therapist_criteria(therapist_id, start_dt=None, end_dt=None, end_exclusive=False):
+        return CalendarService._range(Appointment.therapist_id == therapist_id, start_dt, end_dt, end_exclusive)
+
+    @staticmethod
+    def patient_criteria(patient_id, start_dt=None, end_dt=None, status=None):
+        criteria = CalendarService._range(Appointment.patient_id == patient_id, start_dt, end_dt, False)
+        if status:
+            criteria.append(Appointment.status == status)
+        return criteria
+
+    @staticmethod
+    def _range(owner, start_dt, end_dt, end_exclusive):
+        criteria = [owner]
+        if start_dt:
+            criteria.append(Appointment.start_time >= start_dt)
+        if end_dt:
+            criteria.append(Appointment.start_time < end_dt if end_exclusive else Appointment.start_time <= end_dt)
+        return criteria
+
+    @staticmethod
+    def fingerprint(criteria, *extra):
+        """Strong ETag for the rows matching `criteria`.
+
+        Any insert, delete or update in the range changes the count, max id or max updated_at.
+        """
+        count, last_update, last_id = db.session.query(
+            func.count(Appointment.id), func.max(Appointment.updated_at), func.max(Appointment.id)
+        ).filter(*criteria).one()
+        raw = ':'.join(str(part) for part in (count, last_update, last_id) + extra)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def merge(rows, occurrences, newest_first=False, limit=None):
+        """Stored rows and generated series occurrences in one start-ordered list."""
+        if not occurrences:
+            return rows
+        merged = sorted(list(rows) + list(occurrences), key=lambda e: e.start_time, reverse=newest_first)
+        return merged[:limit] if limit else merged
+
+    @staticmethod
+    def events(criteria, participant, newest_first=False, limit=None):
+        relationship = Appointment.patient if participant == 'patient' else Appointment.therapist
+        order = Appointment.start_time.desc() if newest_first else Appointment.start_time.asc()
+        query = Appointment.query.options(
+            load_only(*EVENT_COLUMNS),
+            joinedload(relationship).load_only(User.id, User.username),
+            games_loader()
+        ).filter(*criteria).order_by(order)
+        if limit:
+            query = query.limit(limit)
+        return query.all()
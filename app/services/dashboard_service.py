@@ -1,6 +1,7 @@
 from app.repositories.user_repository import UserRepository
 from app.repositories.metrics_repository import MetricsRepository
 from app.repositories.appointment_repository import AppointmentRepository
+from app.services.fatigue_service import FatigueService
 from datetime import datetime, timedelta
 from app.utils import get_user_today_utc_range, get_user_timezone
 import pytz
@@ -128,7 +129,8 @@ class DashboardService:
         seven_days_ago = datetime.utcnow() - timedelta(days=7)
         risky = SessionMetrics.query.filter(SessionMetrics.date >= seven_days_ago, SessionMetrics.prediction == 2)\
             .order_by(SessionMetrics.date.desc()).limit(5).all()
-        alerts = []
+        # Fatigue seen in per-trial reaction times of the therapist's own patients goes first
+        alerts = FatigueService.alerts(user.id) if user else []
         for r in risky:
             u = User.query.get(r.user_id)
             alerts.append({
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import numpy as np
+
+class DecisionGrid:
+    """A fitted difficulty model evaluated once on a dense accuracy x reaction time lattice.
+
+    The model only has two bounded inputs, so its decisions can be stored as a small int8
+    array and a prediction becomes rounding both inputs to the nearest node and reading one
+    cell: no scikit-learn, no unpickling. Inputs outside the lattice are clamped to its edge.
+    For models with predict_proba, the probability (0-100) of each cell's decision is kept in a
+    second uint8 array.
+    """
+
+    def __init__(self, labels, accuracy_step, time_step_ms, confidence=None):
+        self.labels = np.asarray(labels, dtype=np.int8)
+        self.confidence = None if confidence is None else np.asarray(confidence, dtype=np.uint8)
+        self.accuracy_step = float(accuracy_step)
+        self.time_step_ms = float(time_step_ms)
+        self._rows = self.labels.tolist()  # nested lists: plain-Python reads are the fastest lookup
+        self._confidence_rows = None if self.confidence is None else self.confidence.tolist()
+        self._last_row = self.labels.shape[0] - 1
+        self._last_col = self.labels.shape[1] - 1
+
+    @property
+    def max_time_ms(self):
+        return self._last_col * self.time_step_ms
+
+    @classmethod
+    def compile(cls, model, accuracy_step=0.5, time_step_ms=10, max_time_ms=5000):
+        accuracy = np.arange(0, 100 + accuracy_step / 2, accuracy_step)
+        time_ms = np.arange(0, max_time_ms + time_step_ms / 2, time_step_ms)
+        acc_mesh, time_mesh = np.meshgrid(accuracy, time_ms, indexing='ij')
+        points = np.column_stack([acc_mesh.ravel(), time_mesh.ravel()])
+        labels = np.asarray(model.predict(points))
+        confidence = None
+        if hasattr(model, 'predict_proba'):
+            proba = np.asarray(model.predict_proba(points))
+            column = np.searchsorted(np.asarray(model.classes_), labels)
+            confidence = np.rint(proba[np.arange(len(labels)), column] * 100).reshape(acc_mesh.shape)
+        return cls(labels.reshape(acc_mesh.shape), accuracy_step, time_step_ms, confidence)
+
+    def _cell(self, accuracy, time_ms):
+        i = int(accuracy / self.accuracy_step + 0.5)
+        j = int(time_ms / self.time_step_ms + 0.5)
+        i = 0 if i < 0 else self._last_row if i > self._last_row else i
+        j = 0 if j < 0 else self._last_col if j > self._last_col else j
+        return i, j
+
+    def predict(self, accuracy, time_ms):
+        # Inlined rather than calling _cell: this is the per-play hot path
+        i = int(accuracy / self.accuracy_step + 0.5)
+        j = int(time_ms / self.time_step_ms + 0.5)
+        i = 0 if i < 0 else self._last_row if i > self._last_row else i
+        j = 0 if j < 0 else self._last_col if j > self._last_col else j
+        return self._rows[i][j]
+
+    def predict_scored(self, accuracy, time_ms):
+        """(decision, its probability 0-100 or None)."""
+        i, j = self._cell(accuracy, time_ms)
+        return self._rows[i][j], None if self._confidence_rows is None else self._confidence_rows[i][j]
+
+    def predict_many(self, accuracy, time_ms):
+        i = np.clip(np.rint(np.asarray(accuracy, dtype=float) / self.accuracy_step), 0, self._last_row).astype(int)
+        j = np.clip(np.rint(np.asarray(time_ms, dtype=float) / self.time_step_ms), 0, self._last_col).astype(int)
+        return self.labels[i, j]
+
+    def report(self, model, samples=100000, seed=0):
+        """How far the grid drifts from the model it was compiled from, on uniform random inputs
+        over the lattice (plus 10% beyond the time edge)."""
+        from app.services.ai_service import expert_labels
+        rng = np.random.default_rng(seed)
+        accuracy = rng.uniform(0, 100, samples)
+        time_ms = rng.uniform(0, self.max_time_ms * 1.1, samples)
+        from_grid = self.predict_many(accuracy, time_ms)
+        from_model = np.asarray(model.predict(np.column_stack([accuracy, time_ms])))
+        expected = expert_labels(accuracy, time_ms)
+        return {
+            'cells': int(self.labels.size),
+            'kb': round(self.labels.nbytes / 1024, 1),
+            'samples': samples,
+            'disagreement': round(float((from_grid != from_model).mean()), 5),
+            'grid_expert_agreement': round(float((from_grid == expected).mean()), 4),
+            'model_expert_agreement': round(float((from_model == expected).mean()), 4)
+        }
+
+    def save(self, path):
+        """Write atomically so a reader never sees a half-written grid."""
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.npz.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                arrays = {'labels': self.labels, 'steps': np.array([self.accuracy_step, self.time_step_ms])}
+                if self.confidence is not None:
+                    arrays['confidence'] = self.confidence
+                np.savez(f, **arrays)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            accuracy_step, time_step_ms = data['steps']
+            return cls(data['labels'], accuracy_step, time_step_ms,
+                       data['confidence'] if 'confidence' in data.files else None)
@@ -0,0 +1,117 @@
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mail import Message as MailMessage
+from app.extensions import db, mail
+from app.repositories.email_outbox_repository import EmailOutboxRepository
+
+class EmailOutboxService:
+    """Persistent email queue drained by background sender threads.
+
+    Request handlers only insert a row; workers claim due rows in batches, deliver each
+    batch over a single SMTP connection and retry failures with exponential backoff.
+    """
+
+    def __init__(self):
+        self.repo = EmailOutboxRepository()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def enqueue(self, recipient, subject, body):
+        item = self.repo.enqueue(recipient, subject, body)
+        self._wakeup.set()
+        return item
+
+    def enqueue_many(self, messages):
+        """Queue (recipient, subject, body) tuples with a single commit."""
+        items = self.repo.enqueue_many(messages)
+        self._wakeup.set()
+        return items
+
+    def process_batch(self):
+        """Deliver one batch of due messages. Returns how many messages were claimed."""
+        config = current_app.config
+        batch = self.repo.claim_batch(config.get('EMAIL_OUTBOX_BATCH_SIZE', 20),
+                                      config.get('EMAIL_OUTBOX_LEASE_SECONDS', 300))
+        if not batch:
+            return 0
+
+        try:
+            with mail.connect() as conn:
+                for item in batch:
+                    try:
+                        conn.send(MailMessage(subject=item.subject, recipients=[item.recipient], body=item.body or ''))
+                        self.repo.mark_sent(item)
+                    except smtplib.SMTPServerDisconnected:
+                        raise
+                    except Exception as e:
+                        current_app.logger.warning(f"Email to {item.recipient} failed: {e}")
+                        self._schedule_retry(item, e)
+        except Exception as e:
+            # Connection-level failure: everything not delivered yet goes back to the queue
+            current_app.logger.error(f"SMTP batch failed: {e}")
+            for item in batch:
+                if item.status == 'sending':
+                    self._schedule_retry(item, e)
+
+        db.session.commit()
+        return len(batch)
+
+    def drain(self):
+        """Process batches until nothing is due. Returns the number of messages handled."""
+        total = 0
+        while True:
+            handled = self.process_batch()
+            if not handled:
+                return total
+            total += handled
+
+    def purge(self, days):
+        """Delete sent and failed messages older than `days`. Returns the number deleted."""
+        return self.repo.purge_older_than(datetime.utcnow() - timedelta(days=days))
+
+    def _schedule_retry(self, item, error):
+        config = current_app.config
+        attempt = item.attempts + 1
+        if attempt >= config.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 5):
+            self.repo.mark_failed(item, error)
+            return
+        delay = min(config.get('EMAIL_OUTBOX_BACKOFF_SECONDS', 30) * (2 ** (attempt - 1)),
+                    config.get('EMAIL_OUTBOX_MAX_BACKOFF_SECONDS', 3600))
+        self.repo.mark_failed(item, error, retry_at=datetime.utcnow() + timedelta(seconds=delay))
+
+    def start(self, app):
+        """Spawn the sender pool (EMAIL_OUTBOX_WORKERS daemon threads) for this process."""
+        if self._threads:
+            return
+        for i in range(app.config.get('EMAIL_OUTBOX_WORKERS', 1)):
+            t = threading.Thread(target=self._run, args=(app,), name=f'email-outbox-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        self._stop.clear()
+
+    def _run(self, app):
+        poll = app.config.get('EMAIL_OUTBOX_POLL_SECONDS', 5)
+        batch_size = app.config.get('EMAIL_OUTBOX_BATCH_SIZE', 20)
+        while not self._stop.is_set():
+            handled = 0
+            with app.app_context():
+                try:
+                    handled = self.process_batch()
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Email outbox worker error: {e}")
+            if handled < batch_size:
+                self._wakeup.wait(poll)
+                self._wakeup.clear()
+
+email_outbox = EmailOutboxService()
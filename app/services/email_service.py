@@ -1,6 +1,5 @@
 from flask import current_app
-from flask_mail import Message as MailMessage
-from app.extensions import mail
+from app.services.email_outbox_service import email_outbox
 import secrets
 import string
 
@@ -12,34 +11,55 @@ class EmailService:
         password = ''.join(secrets.choice(alphabet) for i in range(length))
         return password
 
+    @staticmethod
+    def _welcome_email(recipient_email, plain_password, username):
+        subject = "Bienvenido a Moscowle"
+        body = (
+            f"Hola {username or recipient_email},\n\n"
+            f"Tu cuenta ha sido creada exitosamente en Moscowle.\n\n"
+            f"Credenciales de acceso:\n"
+            f"Correo: {recipient_email}\n"
+            f"Contraseña temporal: {plain_password}\n\n"
+            f"Inicia sesión y cambia tu contraseña temporal por una más segura desde tu perfil.\n\n"
+            "Saludos,\nEquipo Moscowle"
+        )
+        return subject, body
+
     @staticmethod
     def send_welcome_email(recipient_email: str, plain_password: str, username: str):
-        """Send a welcome email with credentials."""
+        """Queue a welcome email with credentials. Delivery happens in the email outbox workers."""
         if not current_app.config.get('MAIL_USERNAME') or not current_app.config.get('MAIL_PASSWORD'):
             current_app.logger.warning("Email not configured. Skipping welcome email.")
             return False
         try:
-            subject = "Bienvenido a Moscowle"
-            body = (
-                f"Hola {username or recipient_email},\n\n"
-                f"Tu cuenta ha sido creada exitosamente en Moscowle.\n\n"
-                f"Credenciales de acceso:\n"
-                f"Correo: {recipient_email}\n"
-                f"Contraseña temporal: {plain_password}\n\n"
-                f"Inicia sesión y cambia tu contraseña temporal por una más segura desde tu perfil.\n\n"
-                "Saludos,\nEquipo Moscowle"
-            )
-            msg = MailMessage(subject=subject, recipients=[recipient_email], body=body)
-            mail.send(msg)
-            current_app.logger.info(f"Welcome email sent successfully to {recipient_email}")
+            subject, body = EmailService._welcome_email(recipient_email, plain_password, username)
+            email_outbox.enqueue(recipient_email, subject, body)
+            current_app.logger.info(f"Welcome email queued for {recipient_email}")
+            return True
+        except Exception as e:
+            current_app.logger.error(f"Failed to queue welcome email to {recipient_email}: {str(e)}")
+            return False
+
+    @staticmethod
+    def send_welcome_emails(entries):
+        """Queue welcome emails for many (email, password, username) tuples in one transaction."""
+        if not current_app.config.get('MAIL_USERNAME') or not current_app.config.get('MAIL_PASSWORD'):
+            current_app.logger.warning("Email not configured. Skipping welcome emails.")
+            return False
+        try:
+            email_outbox.enqueue_many([
+                (email, *EmailService._welcome_email(email, password, username))
+                for email, password, username in entries
+            ])
+            current_app.logger.info(f"{len(entries)} welcome emails queued")
             return True
         except Exception as e:
-            current_app.logger.error(f"Failed to send welcome email to {recipient_email}: {str(e)}")
+            current_app.logger.error(f"Failed to queue welcome emails: {str(e)}")
             return False
 
     @staticmethod
     def send_password_change_email(recipient_email: str, new_password: str, username: str):
-        """Send an email notifying password change."""
+        """Queue an email notifying password change."""
         if not current_app.config.get('MAIL_USERNAME') or not current_app.config.get('MAIL_PASSWORD'):
             current_app.logger.warning("Email not configured. Skipping password change email.")
             return False
@@ -52,10 +72,9 @@ class EmailService:
                 "Si no realizaste este cambio, por favor contacta al administrador de inmediato.\n\n"
                 "Saludos,\nEquipo Moscowle"
             )
-            msg = MailMessage(subject=subject, recipients=[recipient_email], body=body)
-            mail.send(msg)
-            current_app.logger.info(f"Password change email sent to {recipient_email}")
+            email_outbox.enqueue(recipient_email, subject, body)
+            current_app.logger.info(f"Password change email queued for {recipient_email}")
             return True
         except Exception as e:
-            current_app.logger.error(f"Failed to send password change email to {recipient_email}: {str(e)}")
+            current_app.logger.error(f"Failed to queue password change email to {recipient_email}: {str(e)}")
             return False
@@ -0,0 +1,180 @@
+import time
+from datetime import datetime
+import numpy as np
+from flask import current_app
+from app.services import ai_service
+from app.services.ai_service import expert_labels, fit_model, model_store
+from app.services.model_benchmark import replay_history
+from app.services.password_service import LatencyRecorder
+
+class ModelEvaluationService:
+    """Offline evaluation of the difficulty model on the recorded game history.
+
+    The history is replayed in time order and cut into windows. For each window a model is
+    fitted the way train_model does, on everything played before it, and scored on the window:
+    accuracy against the expert label of each play and of the patient's next play, Brier
+    score and expected calibration error of its predict_proba, and single-row latency of the
+    served artifact. Results are stored in the meta.json of the evaluated model version.
+    Meant to run from cron or by hand (`flask evaluate-model`), never per request.
+    """
+
+    CALIBRATION_BINS = 10
+
+    @staticmethod
+    def load_plays(snapshot=None):
+        """(accuracy, time_ms, user_ids) arrays of the history, oldest first. `snapshot` is the
+        path of a SQLite copy of the database, opened read-only."""
+        session = None
+        if snapshot:
+            from sqlalchemy import create_engine
+            from sqlalchemy.orm import Session
+            engine = create_engine(f"sqlite:///file:{snapshot}?mode=ro&uri=true")
+            session = Session(engine)
+        try:
+            plays = [(p.accuracy, p.time_ms, p.user_id) for p in replay_history(session=session)]
+        finally:
+            if session is not None:
+                session.close()
+                engine.dispose()
+        data = np.array(plays, dtype=float).reshape(-1, 3)
+        return data[:, 0], data[:, 1], data[:, 2].astype(int)
+
+    @staticmethod
+    def next_play_targets(labels, user_ids):
+        """Expert label of each play's next play by the same patient, -1 for the last one."""
+        targets = np.full(len(labels), -1, dtype=int)
+        last = {}
+        for i, user_id in enumerate(user_ids.tolist()):
+            if user_id in last:
+                targets[last[user_id]] = labels[i]
+            last[user_id] = i
+        return targets
+
+    def score(self, model, X, labels, targets):
+        """Counts and sums over one window, combined by evaluate()."""
+        proba = np.asarray(model.predict_proba(X))
+        classes = np.asarray(model.classes_)
+        predicted = classes[proba.argmax(axis=1)]
+        confidence = proba.max(axis=1)
+        correct = predicted == labels
+        one_hot = (classes[None, :] == labels[:, None]).astype(float)
+        bins = np.minimum((confidence * self.CALIBRATION_BINS).astype(int), self.CALIBRATION_BINS - 1)
+        scored = targets >= 0
+        return {
+            'plays': len(labels),
+            'correct': int(correct.sum()),
+            'next_scored': int(scored.sum()),
+            'next_correct': int((predicted[scored] == targets[scored]).sum()),
+            'brier_sum': float(((proba - one_hot) ** 2).sum()),
+            'bin_count': np.bincount(bins, minlength=self.CALIBRATION_BINS),
+            'bin_confidence': np.bincount(bins, confidence, minlength=self.CALIBRATION_BINS),
+            'bin_correct': np.bincount(bins, correct, minlength=self.CALIBRATION_BINS)
+        }
+
+    def evaluate(self, accuracy, time_ms, user_ids, backend=None, folds=5, seed=0):
+        """Walk-forward evaluation of `backend` over a time-ordered history: the first of
+        `folds` + 1 equal windows only trains, every later one is predicted by a model fitted
+        on all the plays before it."""
+        n = len(accuracy)
+        if n < folds + 1:
+            raise ValueError(f"Historial insuficiente: {n} partidas para {folds} ventanas de evaluación")
+        backend = backend or ai_service.default_backend()
+        X = np.column_stack([accuracy, time_ms])
+        labels = expert_labels(accuracy, time_ms)
+        targets = self.next_play_targets(labels, user_ids)
+        bounds = np.linspace(0, n, folds + 2).astype(int)
+
+        windows, totals = [], None
+        for start, end in zip(bounds[1:-1], bounds[2:]):
+            np.random.seed(seed)
+            model = fit_model(X[:start], backend)
+            window = self.score(model, X[start:end], labels[start:end], targets[start:end])
+            windows.append({
+                'train': int(start),
+                'test': window['plays'],
+                'label_accuracy': round(window['correct'] / window['plays'], 4)
+            })
+            totals = window if totals is None else {k: totals[k] + v for k, v in window.items()}
+
+        count = totals['bin_count']
+        filled = count > 0
+        ece = np.abs(totals['bin_correct'][filled] - totals['bin_confidence'][filled]).sum() / totals['plays']
+        return {
+            'backend': backend,
+            'plays': n,
+            'patients': int(len(np.unique(user_ids))),
+            'folds': folds,
+            'label_accuracy': round(totals['correct'] / totals['plays'], 4),
+            'next_play_accuracy': round(totals['next_correct'] / totals['next_scored'], 4) if totals['next_scored'] else None,
+            'brier': round(totals['brier_sum'] / totals['plays'], 4),
+            'ece': round(float(ece), 4),
+            'reliability': [
+                {'confidence': round(float(c / k), 3), 'accuracy': round(float(a / k), 3), 'plays': int(k)}
+                for c, a, k in zip(totals['bin_confidence'], totals['bin_correct'], count) if k
+            ],
+            'windows': windows
+        }
+
+    @staticmethod
+    def latency(version, X, calls=500):
+        """Single-row predict latency of the stored model of `version` and of its grid."""
+        recorders = {'model': LatencyRecorder(size=calls), 'grid': LatencyRecorder(size=calls)}
+        model = model_store().load_model(version)
+        grid = ai_service.load_grid(version)
+        for accuracy, time_ms in X[:calls].tolist():
+            started = time.perf_counter()
+            model.predict([[accuracy, time_ms]])
+            recorders['model'].record((time.perf_counter() - started) * 1000)
+            if grid is not None:
+                started = time.perf_counter()
+                grid.predict(accuracy, time_ms)
+                recorders['grid'].record((time.perf_counter() - started) * 1000)
+        return {name: recorder.summary() for name, recorder in recorders.items() if recorder.count}
+
+    def run(self, version=None, snapshot=None, folds=None):
+        """Evaluate the backend of `version` (the active one by default) on the history and store
+        the result in its meta.json. Returns the result."""
+        store = model_store()
+        version = version or ai_service.model_version()
+        if version not in store.versions():
+            raise ValueError(f"Versión de modelo desconocida: {version}")
+        folds = folds or current_app.config.get('AI_EVAL_FOLDS', 5)
+        backend = store.meta(version).get('backend')
+        if backend not in ai_service.BACKENDS:
+            backend = None  # imported legacy model: evaluate the configured backend instead
+
+        accuracy, time_ms, user_ids = self.load_plays(snapshot)
+        result = self.evaluate(accuracy, time_ms, user_ids, backend, folds)
+        result.update(
+            version=version,
+            source=snapshot or 'database',
+            evaluated_at=datetime.utcnow().isoformat(),
+            latency=self.latency(version, np.column_stack([accuracy, time_ms])[::-1])
+        )
+        store.update_meta(version, evaluation=result)
+        return result
+
+    @staticmethod
+    def latest():
+        """Evaluation of the active model version or, if it has none yet (retraining publishes
+        new versions often), of the newest retained version that has one."""
+        store = model_store()
+        current = store.current()
+        versions = store.versions()
+        if current in versions:
+            versions.remove(current)
+            versions.append(current)
+        for version in reversed(versions):
+            evaluation = store.meta(version).get('evaluation')
+            if evaluation:
+                return evaluation
+        return None
+
+    @staticmethod
+    def confidences(metrics):
+        """{SessionMetrics.id: model probability (0-100) of the decision stored for it}.
+
+        Only the probability captured when the decision was made is shown; plays saved before
+        it was recorded are missing and shown as "—". Page views never load a model for this.
+        """
+        return {m.id: round(m.confidence) for m in metrics if m.confidence is not None}
@@ -0,0 +1,121 @@
+import base64
+import binascii
+from datetime import datetime, timedelta
+import numpy as np
+from flask import current_app
+from app.models import SessionMetrics, SessionTrials, User, db
+
+class FatigueService:
+    """Fatigue indicators from the reaction time of every trial of a game.
+
+    A tiring patient gets slower and less steady as the game goes on, which the averages kept in
+    session_metrics cannot show. From the per-trial times sent with save_game this computes,
+    with a few vectorized NumPy passes:
+
+    - rt_slope_ms: least-squares change of reaction time per trial
+    - slowdown: that slope over the whole game, relative to the mean time
+    - variance_drift: coefficient of variation of the second half minus the first half
+
+    and combines them into a 0-1 fatigue_score (FATIGUE_SLOWDOWN and FATIGUE_VARIANCE_DRIFT are the
+    values that count fully). Scores of FATIGUE_ALERT_SCORE or more alert the therapist.
+    """
+
+    DTYPE = np.dtype('<f4')
+    SLOWDOWN_WEIGHT = 0.6
+
+    def parse(self, value):
+        """Reaction times (ms) sent by a game: a JSON list of numbers, or a base64 string of
+        little-endian float32 (a Float32Array buffer). None when absent; ValueError when invalid."""
+        if value is None or value == '' or value == []:
+            return None
+        if isinstance(value, str):
+            try:
+                times = np.frombuffer(base64.b64decode(value, validate=True), dtype=self.DTYPE)
+            except (binascii.Error, ValueError):
+                raise ValueError("reaction_times no es un float32 en base64 válido")
+        elif isinstance(value, list):
+            try:
+                times = np.array(value, dtype=float)
+            except (TypeError, ValueError):
+                raise ValueError("reaction_times debe contener solo números")
+            if times.ndim != 1:
+                raise ValueError("reaction_times debe ser una lista plana")
+        else:
+            raise ValueError("reaction_times debe ser una lista o una cadena base64")
+        if not np.isfinite(times).all() or (times < 0).any():
+            raise ValueError("reaction_times contiene tiempos no válidos")
+        max_trials = current_app.config.get('FATIGUE_MAX_TRIALS', 2000)
+        if len(times) > max_trials:
+            raise ValueError(f"reaction_times admite como máximo {max_trials} intentos")
+        return times.astype(float)
+
+    def pack(self, times):
+        return np.asarray(times, dtype=self.DTYPE).tobytes()
+
+    def unpack(self, blob):
+        return np.frombuffer(blob, dtype=self.DTYPE).astype(float)
+
+    def indicators(self, times):
+        """Indicator columns of SessionTrials for `times`; all None with fewer than FATIGUE_MIN_TRIALS."""
+        config = current_app.config
+        times = np.asarray(times, dtype=float)
+        n = len(times)
+        mean = times.mean() if n else 0.0
+        if n < max(config.get('FATIGUE_MIN_TRIALS', 6), 4) or mean <= 0:
+            return {'rt_slope_ms': None, 'slowdown': None, 'variance_drift': None, 'fatigue_score': None}
+
+        trial = np.arange(n) - (n - 1) / 2
+        slope = float(trial @ (times - mean) / (trial @ trial))
+        slowdown = slope * (n - 1) / mean
+        half = n // 2
+        early, late = times[:half], times[n - half:]
+        early_mean, late_mean = early.mean(), late.mean()
+        variance_drift = float(late.std() / late_mean - early.std() / early_mean) if early_mean > 0 and late_mean > 0 else 0.0
+
+        score = (self.SLOWDOWN_WEIGHT * min(max(slowdown / config.get('FATIGUE_SLOWDOWN', 0.3), 0.0), 1.0)
+                 + (1 - self.SLOWDOWN_WEIGHT) * min(max(variance_drift / config.get('FATIGUE_VARIANCE_DRIFT', 0.2), 0.0), 1.0))
+        return {
+            'rt_slope_ms': round(slope, 3),
+            'slowdown': round(float(slowdown), 4),
+            'variance_drift': round(variance_drift, 4),
+            'fatigue_score': round(float(score), 3)
+        }
+
+    def record(self, metric, times, indicators=None):
+        """Store the trials of `metric` (already flushed, so it has an id) with their indicators,
+        computed here unless given. The caller commits."""
+        trials = SessionTrials(metric_id=metric.id, user_id=metric.user_id, trials=len(times),
+                               reaction_times=self.pack(times), date=metric.date or datetime.utcnow(),
+                               **(indicators or self.indicators(times)))
+        db.session.add(trials)
+        return trials
+
+    @staticmethod
+    def is_fatigued(score):
+        return score is not None and score >= current_app.config.get('FATIGUE_ALERT_SCORE', 0.6)
+
+    @staticmethod
+    def scores(metric_ids):
+        """{SessionMetrics.id: fatigue_score} for the given metrics that sent trials."""
+        if not metric_ids:
+            return {}
+        return dict(db.session.query(SessionTrials.metric_id, SessionTrials.fatigue_score).filter(
+            SessionTrials.metric_id.in_(metric_ids), SessionTrials.fatigue_score.isnot(None)))
+
+    @staticmethod
+    def alerts(therapist_id, days=7, limit=5):
+        """Latest games of the therapist's patients whose fatigue score reached FATIGUE_ALERT_SCORE."""
+        since = datetime.utcnow() - timedelta(days=days)
+        rows = db.session.query(SessionTrials, SessionMetrics.game_name, User.username, User.email).join(
+            SessionMetrics, SessionMetrics.id == SessionTrials.metric_id
+        ).join(User, User.id == SessionTrials.user_id).filter(
+            User.assigned_therapist_id == therapist_id,
+            SessionTrials.date >= since,
+            SessionTrials.fatigue_score >= current_app.config.get('FATIGUE_ALERT_SCORE', 0.6)
+        ).order_by(SessionTrials.date.desc()).limit(limit).all()
+        return [{
+            'type': 'yellow',
+            'patient': username or email,
+            'message': f"Posible fatiga en {game_name}: tiempo de reacción +{max(t.slowdown or 0, 0):.0%} "
+                       f"a lo largo de {t.trials} intentos"
+        } for t, game_name, username, email in rows]
@@ -0,0 +1,186 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from flask import current_app, url_for
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip variants are produced
+    brotli = None
+
+MANIFEST = 'manifest.json'
+# Suffix and Content-Encoding of each precompressed variant, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+class GameAssetService:
+    """Content-hashed copies of the games in static/games.
+
+    publish() copies a game to GAME_ASSETS_DIR as <stem>.<hash>.html next to .gz (and .br when
+    the brotli package is installed) variants, and records it in manifest.json under its logical
+    filename. Hashed files never change, so they are served with an immutable Cache-Control and
+    the hash as strong ETag. static/games stays the source of truth: a game edited or copied there
+    by hand is republished the next time its URL is resolved.
+    """
+
+    # Previous versions kept per game so pages loaded just before a republish still work
+    KEEP_VERSIONS = 2
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._manifest_mtime = None
+
+    @staticmethod
+    def source_dir():
+        return os.path.join(current_app.root_path, 'static', 'games')
+
+    @staticmethod
+    def build_dir():
+        return current_app.config.get('GAME_ASSETS_DIR') or os.path.join(current_app.instance_path, 'game_assets')
+
+    def _manifest_path(self):
+        return os.path.join(self.build_dir(), MANIFEST)
+
+    def manifest(self):
+        """{logical filename: entry}, re-read when another worker rewrote the file."""
+        path = self._manifest_path()
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return self._manifest or {}
+        if self._manifest is None or mtime != self._manifest_mtime:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self._manifest = json.load(f)
+                self._manifest_mtime = mtime
+            except (OSError, ValueError):
+                self._manifest = self._manifest or {}
+        return self._manifest
+
+    def _save_manifest(self, manifest):
+        path = self._manifest_path()
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+        self._manifest = manifest
+        self._manifest_mtime = os.stat(path).st_mtime_ns
+
+    @staticmethod
+    def _write(path, data):
+        if not os.path.exists(path):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+    def publish(self, filename):
+        """Hash, copy and precompress one game. Returns its manifest entry, None if missing."""
+        filename = os.path.basename(filename)
+        source = os.path.join(self.source_dir(), filename)
+        try:
+            stat = os.stat(source)
+            with open(source, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        stem, ext = os.path.splitext(filename)
+        hashed = f"{stem}.{digest}{ext}"
+        build_dir = self.build_dir()
+        os.makedirs(build_dir, exist_ok=True)
+
+        self._write(os.path.join(build_dir, hashed), data)
+        encodings = ['gzip']
+        self._write(os.path.join(build_dir, hashed + '.gz'), gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            self._write(os.path.join(build_dir, hashed + '.br'), brotli.compress(data, quality=11))
+            encodings.insert(0, 'br')
+
+        with self._lock:
+            manifest = dict(self.manifest())
+            previous = manifest.get(filename) or {}
+            # Newest first: the version being replaced, then the ones it kept
+            history = [f for f in [previous.get('file')] + previous.get('previous', []) if f and f != hashed]
+            keep, stale = history[:self.KEEP_VERSIONS - 1], history[self.KEEP_VERSIONS - 1:]
+            entry = {
+                'file': hashed,
+                'hash': digest,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'encodings': encodings,
+                'previous': keep
+            }
+            manifest[filename] = entry
+            self._save_manifest(manifest)
+        for old in stale:
+            self._remove_files(old)
+        return entry
+
+    def _remove_files(self, hashed):
+        for suffix in ('',) + tuple(s for _, s in ENCODINGS):
+            try:
+                os.remove(os.path.join(self.build_dir(), hashed + suffix))
+            except OSError:
+                pass
+
+    def unpublish(self, filename):
+        """Forget a deleted game and remove its hashed files."""
+        filename = os.path.basename(filename)
+        with self._lock:
+            manifest = dict(self.manifest())
+            entry = manifest.pop(filename, None)
+            if entry is None:
+                return False
+            self._save_manifest(manifest)
+        for hashed in [entry['file']] + entry.get('previous', []):
+            self._remove_files(hashed)
+        return True
+
+    def sync(self):
+        """Publish every game that is new or changed since its last publish. Returns the count."""
+        try:
+            files = [f for f in os.listdir(self.source_dir()) if f.lower().endswith('.html')]
+        except OSError:
+            return 0
+        published = 0
+        for filename in files:
+            if self._is_stale(filename, self.manifest().get(filename)):
+                published += self.publish(filename) is not None
+        return published
+
+    def _is_stale(self, filename, entry):
+        if entry is None:
+            return True
+        try:
+            stat = os.stat(os.path.join(self.source_dir(), filename))
+        except OSError:
+            return False
+        return stat.st_mtime_ns != entry['mtime'] or stat.st_size != entry['size']
+
+    def resolve(self, filename):
+        """Current manifest entry for a logical game filename, publishing it if needed."""
+        filename = os.path.basename(filename or '')
+        entry = self.manifest().get(filename)
+        if self._is_stale(filename, entry):
+            entry = self.publish(filename) or entry
+        return entry
+
+    def url(self, filename):
+        """Immutable URL of a game, or its static/games URL when it cannot be published."""
+        entry = self.resolve(filename)
+        if entry is None:
+            return url_for('static', filename=f'games/{os.path.basename(filename)}')
+        return url_for('main.game_asset', name=entry['file'])
+
+    def lookup(self, hashed):
+        """(path, encodings) of a hashed file this process may serve, None if unknown."""
+        hashed = os.path.basename(hashed)
+        path = os.path.join(self.build_dir(), hashed)
+        if not hashed.lower().endswith('.html') or not os.path.isfile(path):
+            return None
+        return path, [name for name, suffix in ENCODINGS if os.path.isfile(path + suffix)]
+
+game_assets = GameAssetService()
@@ -0,0 +1,197 @@
+import json
+import os
+from datetime import datetime
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import selectinload
+from app.models import Appointment, AppointmentGame, Game, db
+from app.services.game_service import game_catalog, title_for
+
+class UnknownGames(ValueError):
+    """Raised when an assignment names games that are not in static/games."""
+
+    def __init__(self, filenames):
+        super().__init__(f"Juegos no disponibles: {', '.join(filenames)}")
+        self.filenames = filenames
+
+def games_loader():
+    """Loader option that fetches assignments and their games for a whole result set in two
+    batched SELECTs, so Appointment.games_list never lazy-loads per row."""
+    return selectinload(Appointment.appointment_games).selectinload(AppointmentGame.game).load_only(Game.id, Game.filename)
+
+class GameAssignmentService:
+    """Games assigned to a session, stored as AppointmentGame rows.
+
+    The Appointment.games JSON column is only read by backfill(), which moves old
+    assignments to AppointmentGame once and clears the column. Appointment.games_total and
+    games_played mirror the assignment rows so completion is a counter comparison.
+    """
+
+    BACKFILL_BATCH = 500
+
+    @staticmethod
+    def normalize(payload):
+        """Filenames from a comma separated string, a list of filenames or a list of
+        {'name': ..., 'url': ...} dicts (the assign-games format). Order kept, duplicates dropped."""
+        if not payload:
+            return []
+        if isinstance(payload, str):
+            items = payload.split(',')
+        elif isinstance(payload, (list, tuple)):
+            items = payload
+        else:
+            return []
+        filenames = []
+        for item in items:
+            if isinstance(item, dict):
+                item = item.get('name') or item.get('filename') or item.get('file') or ''
+            if not isinstance(item, str):
+                continue
+            # Bare filenames only, assignments always point into static/games
+            name = os.path.basename(item.strip())
+            if name and name not in filenames:
+                filenames.append(name)
+        return filenames
+
+    @staticmethod
+    def parse_legacy(raw):
+        """Filenames from a JSON value (legacy Appointment.games, AppointmentSeries.games);
+        unparseable values count as no games."""
+        try:
+            return GameAssignmentService.normalize(json.loads(raw) if raw else [])
+        except (TypeError, ValueError):
+            return []
+
+    @staticmethod
+    def playable(filenames):
+        """The given filenames that exist in static/games, order kept."""
+        available = set(game_catalog.filenames())
+        return [f for f in filenames if f in available]
+
+    @classmethod
+    def ensure_playable(cls, filenames):
+        """Raise UnknownGames unless every filename is a game in static/games."""
+        playable = set(cls.playable(filenames))
+        unknown = [f for f in filenames if f not in playable]
+        if unknown:
+            raise UnknownGames(unknown)
+
+    @classmethod
+    def resolve_games(cls, filenames, legacy=False):
+        """{filename: Game} with one IN query. Names must be games in static/games (UnknownGames
+        otherwise); only `legacy` data (backfill) may create catalog rows for other files."""
+        if not filenames:
+            return {}
+        if not legacy:
+            cls.ensure_playable(filenames)
+        games = {g.filename: g for g in Game.query.filter(Game.filename.in_(filenames)).all()}
+        missing = [f for f in filenames if f not in games]
+        for filename in missing:
+            game = Game(title=title_for(filename), filename=filename, is_active=True)
+            db.session.add(game)
+            games[filename] = game
+        if missing:
+            db.session.flush()
+        return games
+
+    def assign(self, appt, payload):
+        """Make `appt`'s assignments exactly the games in `payload`. Existing assignments keep
+        their status and config. Raises UnknownGames before changing anything when a game is
+        not in static/games. The caller commits."""
+        filenames = self.normalize(payload)
+        games = self.resolve_games(filenames)
+        wanted = {games[f].id for f in filenames}
+        current = {ag.game_id: ag for ag in appt.appointment_games}
+        for game_id, assoc in current.items():
+            if game_id not in wanted:
+                appt.appointment_games.remove(assoc)
+                db.session.delete(assoc)
+        for filename in filenames:
+            game = games[filename]
+            if game.id not in current:
+                appt.appointment_games.append(AppointmentGame(game_id=game.id, game=game, status='pending'))
+        appt.games = None
+        appt.games_total = len(filenames)
+        appt.games_played = sum(1 for ag in appt.appointment_games if ag.status == 'completed')
+        return filenames
+
+    @staticmethod
+    def record_play(appt, game_id=None):
+        """Mark one pending assignment of `appt` as completed and bump its played counter.
+
+        The assignment for `game_id` is preferred; plays of unassigned or unknown games
+        complete the oldest pending one, so N plays still finish N assigned games. Every step
+        is a single conditional UPDATE, so concurrent plays cannot double count. Returns True
+        when this play completed the session. The caller commits.
+        """
+        pending = (AppointmentGame.appointment_id == appt.id, AppointmentGame.status == 'pending')
+        done = 0
+        if game_id is not None:
+            done = db.session.execute(
+                update(AppointmentGame).where(AppointmentGame.game_id == game_id, *pending)
+                .values(status='completed').execution_options(synchronize_session=False)
+            ).rowcount
+        if not done:
+            oldest = select(AppointmentGame.id).where(*pending).order_by(AppointmentGame.id).limit(1).scalar_subquery()
+            done = db.session.execute(
+                update(AppointmentGame).where(AppointmentGame.id == oldest, *pending)
+                .values(status='completed').execution_options(synchronize_session=False)
+            ).rowcount
+        if not done:
+            return False
+
+        db.session.execute(
+            update(Appointment).where(Appointment.id == appt.id)
+            .values(games_played=Appointment.games_played + 1).execution_options(synchronize_session=False)
+        )
+        finished_at = datetime.utcnow()
+        finished = db.session.execute(
+            update(Appointment).where(
+                Appointment.id == appt.id,
+                Appointment.status == 'scheduled',
+                Appointment.games_total > 0,
+                Appointment.games_played >= Appointment.games_total
+            ).values(status='completed', end_time=finished_at).execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.expire(appt, ['games_played'])
+        if finished:
+            # Same values through the ORM so commit-time cache invalidation sees the change
+            appt.status = 'completed'
+            appt.end_time = finished_at
+        return bool(finished)
+
+    def backfill(self):
+        """Move Appointment.games JSON into AppointmentGame rows. Idempotent: processed rows
+        have their JSON cleared. Returns the number of sessions migrated."""
+        migrated = 0
+        while True:
+            batch = db.session.query(Appointment.id, Appointment.games).filter(
+                Appointment.games.isnot(None)
+            ).order_by(Appointment.id).limit(self.BACKFILL_BATCH).all()
+            if not batch:
+                return migrated
+
+            parsed = {appt_id: self.parse_legacy(raw) for appt_id, raw in batch}
+            games = self.resolve_games(sorted({f for names in parsed.values() for f in names}), legacy=True)
+            existing = set(db.session.query(AppointmentGame.appointment_id, AppointmentGame.game_id).filter(
+                AppointmentGame.appointment_id.in_(list(parsed))
+            ).all())
+            rows = []
+            totals = {appt_id: 0 for appt_id in parsed}
+            for appt_id, game_id in existing:
+                totals[appt_id] += 1
+            for appt_id, filenames in parsed.items():
+                for filename in filenames:
+                    key = (appt_id, games[filename].id)
+                    if key not in existing:
+                        existing.add(key)
+                        totals[appt_id] += 1
+                        rows.append({'appointment_id': appt_id, 'game_id': key[1], 'status': 'pending'})
+            if rows:
+                db.session.execute(AppointmentGame.__table__.insert(), rows)
+            table = Appointment.__table__
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('appt_id')).values(games=None, games_total=bindparam('total')),
+                [{'appt_id': appt_id, 'total': total} for appt_id, total in totals.items()]
+            )
+            db.session.commit()
+            migrated += len(batch)
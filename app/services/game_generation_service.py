@@ -0,0 +1,245 @@
+import io
+import json
+import threading
+from flask import current_app, url_for
+from sqlalchemy import func
+from app.extensions import db
+from app.models import SessionMetrics, User
+from app.repositories.game_generation_job_repository import GameGenerationJobRepository
+from app.services.game_asset_service import game_assets
+from app.services.game_profile_service import GameProfileService
+from app.services.game_upload_service import GameUploadService
+from app.services.gemini_service import gemini_gateway, GeminiUnavailable
+from app.services.notification_service import NotificationService
+
+FALLBACK_HTML = '<!DOCTYPE html><html><head><meta charset="utf-8"><script src="https://cdn.tailwindcss.com"></script></head><body class="p-6">\n' \
+                '<h2 class="text-2xl font-bold">Juego IA (fallback)</h2>\n' \
+                '<p class="text-gray-600">Config basado en KPIs.</p>\n' \
+                '</body></html>'
+
+class GenerationBusy(ValueError):
+    """Raised when the requester already has GAME_GENERATION_MAX_ACTIVE_PER_USER jobs queued or running."""
+
+class LeaseLost(Exception):
+    """Raised when a job's lease expired and another worker claimed it again."""
+
+class GameGenerationService:
+    """AI game generation as persistent background jobs.
+
+    The request only validates and inserts a job row. GAME_GENERATION_WORKERS daemon threads
+    per process claim jobs one at a time (which also caps concurrent generations), collect the
+    patient's KPIs, ask Gemini through the gateway, save the game through the upload pipeline
+    and record stage/progress on the row so clients can poll it. Jobs of a crashed worker are
+    picked up again once their lease expires.
+    """
+
+    def __init__(self):
+        self.repo = GameGenerationJobRepository()
+        self.upload_service = GameUploadService()
+        self.notification_service = NotificationService()
+        self.profile_service = GameProfileService()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def enqueue(self, requested_by, target_user_id, name, prompt):
+        """Queue a generation for `target_user_id`. Raises ValueError for an invalid name and
+        GenerationBusy when the requester is over quota."""
+        name = self.upload_service.sanitize_name(name)[:-5]
+        limit = current_app.config.get('GAME_GENERATION_MAX_ACTIVE_PER_USER', 3)
+        if self.repo.count_active_by_requester(requested_by) >= limit:
+            raise GenerationBusy(f"Ya tienes {limit} juegos generándose; espera a que terminen")
+        job = self.repo.enqueue(requested_by, target_user_id, name, prompt)
+        self._wakeup.set()
+        return job
+
+    def status(self, job):
+        payload = {
+            'job_id': job.id,
+            'status': job.status,
+            'stage': job.stage,
+            'progress': job.progress,
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None
+        }
+        if job.status == 'done':
+            payload.update({
+                'file': job.filename,
+                'game_id': job.game_id,
+                'url': game_assets.url(job.filename),
+                'fallback': job.fallback,
+                'config': json.loads(job.config) if job.config else None
+            })
+        elif job.status == 'failed':
+            payload['error'] = job.error
+        return payload
+
+    @staticmethod
+    def collect_kpis(user_id):
+        """Aggregates in one query plus the last 10 results."""
+        total, avg_accuracy, avg_time = db.session.query(
+            func.count(SessionMetrics.id), func.avg(SessionMetrics.accurracy), func.avg(SessionMetrics.avg_time)
+        ).filter(SessionMetrics.user_id == user_id).one()
+        return {
+            'total_sessions': total,
+            'avg_accuracy': float(avg_accuracy or 0),
+            'avg_time_ms': float((avg_time or 0) * 1000),
+            'last_games': [
+                {
+                    'game_name': m.game_name,
+                    'accuracy': float(m.accurracy),
+                    'avg_time_ms': float(m.avg_time * 1000),
+                    'prediction': int(m.prediction),
+                    'date': m.date.isoformat()
+                } for m in SessionMetrics.query.filter_by(user_id=user_id).order_by(SessionMetrics.date.desc()).limit(10)
+            ]
+        }
+
+    @staticmethod
+    def build_prompt(prompt, kpi):
+        return (
+            f"{prompt}\n\n"
+            "Genera dos bloques: 1) HTML completo para un juego sencillo de reflejos/cognitivo con UI moderna, tailwindcdn y FontAwesome (no frameworks).\n"
+            "2) JSON de configuración KPI con claves: kpis(avg_accuracy, avg_time_ms, total_sessions), goals, difficulty, and tracking schema for events.\n"
+            f"KPIs del paciente: {json.dumps(kpi, ensure_ascii=False)}\n"
+            "Devuelve primero el JSON (entre marcadores ---JSON---) y luego el HTML (entre ---HTML---)."
+        )
+
+    @staticmethod
+    def parse_answer(text):
+        """(config, html) from a ---JSON--- ... ---HTML--- answer."""
+        json_start = text.find('---JSON---')
+        html_start = text.find('---HTML---')
+        if json_start == -1 or html_start == -1:
+            # If markers missing, store raw
+            return {'raw': text}, '<!DOCTYPE html><html><body><pre>Salida IA sin marcadores</pre></body></html>'
+        json_block = text[json_start + len('---JSON---'): html_start].strip()
+        html_block = text[html_start + len('---HTML---'):].strip()
+        try:
+            config = json.loads(json_block)
+        except ValueError:
+            config = {'raw': json_block}
+        return config, html_block
+
+    @staticmethod
+    def fallback(kpi):
+        """Local config and placeholder game used when Gemini is not available."""
+        config = {
+            'kpis': {'avg_accuracy': kpi['avg_accuracy'], 'avg_time_ms': kpi['avg_time_ms'], 'total_sessions': kpi['total_sessions']},
+            'goals': ['Mejorar reflejos', 'Reducir tiempo de reacción'],
+            'difficulty': 'medium',
+            'tracking': {'events': ['click', 'hit', 'miss'], 'schema_version': 1}
+        }
+        return config, FALLBACK_HTML
+
+    def _stage(self, job, token, stage, progress):
+        if not self.repo.set_stage(job, token, stage, progress,
+                                   current_app.config.get('GAME_GENERATION_LEASE_SECONDS', 300)):
+            raise LeaseLost(job.id)
+
+    def run(self, job, token):
+        """Generate, save and register the game of a job claimed with `token`. Every stage renews
+        the lease and raises LeaseLost once another worker owns the job. The caller handles failures."""
+        self._stage(job, token, 'kpis', 10)
+        kpi = self.collect_kpis(job.target_user_id)
+
+        self._stage(job, token, 'generating', 30)
+        try:
+            text = gemini_gateway.generate(self.build_prompt(job.prompt, kpi),
+                                           read_timeout=current_app.config.get('GEMINI_GENERATE_TIMEOUT_SECONDS', 45))
+            config, html = self.parse_answer(text)
+            fallback = False
+        except GeminiUnavailable as e:
+            if e.reason != 'no_key':
+                current_app.logger.warning(f"Gemini game generation fallback (job {job.id}): {e}")
+            config, html = self.fallback(kpi)
+            fallback = True
+
+        self._stage(job, token, 'saving', 80)
+        game, _ = self.upload_service.save(io.BytesIO(html.encode('utf-8')), job.name)
+        if not self.repo.mark_done(job, token, game, json.dumps(config, ensure_ascii=False), fallback):
+            raise LeaseLost(job.id)
+        if db.session.get(User, job.target_user_id) is not None:
+            self.profile_service.set_config(job.target_user_id, config)
+        db.session.commit()
+        return job
+
+    def process_one(self):
+        """Claim and run one due job. Returns False when nothing was due."""
+        config = current_app.config
+        job = self.repo.claim(config.get('GAME_GENERATION_LEASE_SECONDS', 300))
+        if job is None:
+            return False
+        # Read once: after a commit job.claimed_by reloads and may already be another worker's
+        token = job.claimed_by
+        if job.attempts > config.get('GAME_GENERATION_MAX_ATTEMPTS', 2):
+            failed = self.repo.mark_failed(job, token, "Se agotaron los intentos de generación")
+            db.session.commit()
+            if failed:
+                self._notify(job)
+            return True
+        try:
+            self.run(job, token)
+        except LeaseLost:
+            db.session.rollback()
+            current_app.logger.warning(f"Game generation job {job.id} lost its lease; result dropped")
+            return True
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Game generation job {job.id} failed: {e}")
+            failed = self.repo.mark_failed(job, token, e)
+            db.session.commit()
+            if not failed:
+                return True
+        self._notify(job)
+        return True
+
+    def _notify(self, job):
+        try:
+            message = f"Juego IA listo: {job.filename}" if job.status == 'done' else f"Falló la generación del juego IA '{job.name}'"
+            # Workers have no request; build the relative link in a throwaway one
+            with current_app.test_request_context():
+                link = url_for('therapist.games')
+            self.notification_service.create_notification(job.requested_by, message, link=link)
+        except Exception:
+            pass
+
+    def drain(self):
+        """Run due jobs until none is left. Returns how many were handled."""
+        handled = 0
+        while self.process_one():
+            handled += 1
+        return handled
+
+    def start(self, app):
+        """Spawn GAME_GENERATION_WORKERS daemon threads for this process."""
+        if self._threads:
+            return
+        for i in range(app.config.get('GAME_GENERATION_WORKERS', 2)):
+            t = threading.Thread(target=self._run, args=(app,), name=f'game-generation-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        self._stop.clear()
+
+    def _run(self, app):
+        poll = app.config.get('GAME_GENERATION_POLL_SECONDS', 5)
+        while not self._stop.is_set():
+            handled = False
+            with app.app_context():
+                try:
+                    handled = self.process_one()
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Game generation worker error: {e}")
+            if not handled:
+                self._wakeup.wait(poll)
+                self._wakeup.clear()
+
+game_generation = GameGenerationService()
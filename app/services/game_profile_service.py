@@ -0,0 +1,127 @@
+import json
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from app.models import GameProfile, User, db
+
+def _load(raw, default):
+    try:
+        value = json.loads(raw) if raw else default
+    except (TypeError, ValueError):
+        return default
+    return value if isinstance(value, type(default)) else default
+
+class GameProfileService:
+    """Bounded per-patient game profile stored in GameProfile.
+
+    Each recorded play is added to lifetime and per-game running sums and appended to a ring
+    buffer of the last GAME_PROFILE_RECENT_LIMIT plays; older plays survive only in the sums,
+    so the row size no longer grows with the patient's history.
+    """
+
+    BACKFILL_BATCH = 200
+
+    @staticmethod
+    def recent_limit():
+        return current_app.config.get('GAME_PROFILE_RECENT_LIMIT', 50)
+
+    @staticmethod
+    def get(user_id):
+        return db.session.get(GameProfile, user_id)
+
+    @staticmethod
+    def _get_or_create(user_id):
+        profile = db.session.get(GameProfile, user_id)
+        if profile is None:
+            profile = GameProfile(user_id=user_id, plays=0, accuracy_sum=0.0, time_ms_sum=0.0)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(profile)
+            except IntegrityError:
+                # A concurrent request or worker created the row first
+                profile = db.session.get(GameProfile, user_id, populate_existing=True)
+        return profile
+
+    def _fold(self, profile, entries):
+        """Add `entries` to the sums and the ring buffer, dropping the oldest beyond the cap."""
+        per_game = _load(profile.per_game, {})
+        for entry in entries:
+            accuracy, time_ms = float(entry['accuracy']), float(entry['avg_time_ms'])
+            profile.plays = (profile.plays or 0) + 1
+            profile.accuracy_sum = (profile.accuracy_sum or 0.0) + accuracy
+            profile.time_ms_sum = (profile.time_ms_sum or 0.0) + time_ms
+            totals = per_game.setdefault(entry.get('game_name') or 'Juego', [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += accuracy
+            totals[2] += time_ms
+        recent = (_load(profile.recent, []) + list(entries))[-self.recent_limit():]
+        profile.per_game = json.dumps(per_game, ensure_ascii=False)
+        profile.recent = json.dumps(recent, ensure_ascii=False)
+
+    def record_session(self, user_id, entries):
+        """Fold one session's plays into the profile and keep its averages as the latest KPIs.
+        The caller commits."""
+        profile = self._get_or_create(user_id)
+        self._fold(profile, entries)
+        if entries:
+            profile.last_session_kpis = json.dumps({
+                'avg_accuracy': sum(float(e['accuracy']) for e in entries) / len(entries),
+                'avg_time_ms': sum(float(e['avg_time_ms']) for e in entries) / len(entries),
+                'plays': len(entries)
+            })
+        return profile
+
+    def set_config(self, user_id, config):
+        """Store the config of the latest AI-generated game. The caller commits."""
+        profile = self._get_or_create(user_id)
+        profile.config = json.dumps(config, ensure_ascii=False)
+        return profile
+
+    @staticmethod
+    def as_dict(profile):
+        if profile is None:
+            return {'config': None, 'kpis': None, 'lifetime': {'plays': 0, 'avg_accuracy': 0, 'avg_time_ms': 0},
+                    'games': {}, 'recent': []}
+        plays = profile.plays or 0
+        games = {
+            name: {'plays': n, 'avg_accuracy': acc / n if n else 0, 'avg_time_ms': ms / n if n else 0}
+            for name, (n, acc, ms) in _load(profile.per_game, {}).items()
+        }
+        return {
+            'config': _load(profile.config, {}) or None,
+            'kpis': _load(profile.last_session_kpis, {}) or None,
+            'lifetime': {
+                'plays': plays,
+                'avg_accuracy': profile.accuracy_sum / plays if plays else 0,
+                'avg_time_ms': profile.time_ms_sum / plays if plays else 0
+            },
+            'games': games,
+            'recent': _load(profile.recent, [])
+        }
+
+    def backfill(self):
+        """Move legacy User.game_profile JSON into GameProfile rows and clear it. Idempotent.
+        Returns the number of users migrated."""
+        migrated = 0
+        while True:
+            batch = db.session.query(User.id, User.game_profile).filter(
+                User.game_profile.isnot(None)
+            ).order_by(User.id).limit(self.BACKFILL_BATCH).all()
+            if not batch:
+                return migrated
+            for user_id, raw in batch:
+                data = _load(raw, {})
+                profile = self._get_or_create(user_id)
+                history = data.pop('history', None)
+                if isinstance(history, list):
+                    # complete_session blobs: history, last session kpis, optional generated config
+                    entries = [h for h in history if isinstance(h, dict) and 'accuracy' in h and 'avg_time_ms' in h]
+                    self._fold(profile, entries)
+                    kpis = data.pop('kpis', None)
+                    if isinstance(kpis, dict):
+                        profile.last_session_kpis = json.dumps(kpis)
+                if data and profile.config is None:
+                    profile.config = json.dumps(data, ensure_ascii=False)
+            db.session.query(User).filter(User.id.in_([user_id for user_id, _ in batch])).update(
+                {User.game_profile: None}, synchronize_session=False)
+            db.session.commit()
+            migrated += len(batch)
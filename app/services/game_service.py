@@ -1,11 +1,133 @@
 import os
+import re
+from collections import namedtuple
 from flask import current_app
+from app.models import Game, db
+from app.services.cache import TTLCache, invalidate_on_commit
+
+CatalogGame = namedtuple('CatalogGame', 'id filename title is_active')
+
+def title_for(filename):
+    """Display title derived from a game filename."""
+    stem = os.path.splitext(filename)[0]
+    return stem.replace('_', ' ').replace('-', ' ').strip().title()[:100] or filename[:100]
+
+def normalize_key(name):
+    """Lookup key shared by titles and filenames: 'Cuento_Cenicienta.html' == 'cuento cenicienta'."""
+    name = (name or '').strip().lower()
+    if name.endswith('.html'):
+        name = name[:-5]
+    return re.sub(r'[\s_\-]+', ' ', name).strip()
+
+class Catalog:
+    """Immutable snapshot of the games directory joined with the Game table."""
+
+    def __init__(self, games, files, mtime):
+        self.mtime = mtime
+        self.files = files
+        self.by_id = {g.id: g for g in games}
+        self.by_filename = {g.filename: g for g in games}
+        self.by_key = {}
+        # Filename stems win over titles when both normalize to the same key
+        for g in games:
+            self.by_key.setdefault(normalize_key(g.title), g)
+        for g in games:
+            self.by_key[normalize_key(g.filename)] = g
+
+class GameCatalog:
+    """Process-level game catalog.
+
+    The HTML files in static/games are the source of truth for what can be played; every file
+    gets a Game row so sessions and metrics can reference it by id. The snapshot is rebuilt when
+    the directory changes (mtime check, one stat per read), on explicit invalidation after an
+    upload, generation or deletion, after commits touching Game, or when the TTL expires.
+    """
+
+    KEY = 'catalog'
+
+    def __init__(self, ttl=300):
+        self.cache = TTLCache(ttl=ttl, max_size=1)
+
+    @staticmethod
+    def games_dir():
+        return os.path.join(current_app.root_path, 'static', 'games')
+
+    @staticmethod
+    def _scan(games_dir):
+        try:
+            mtime = os.stat(games_dir).st_mtime_ns
+            files = sorted(f for f in os.listdir(games_dir) if f.lower().endswith('.html'))
+        except OSError:
+            return None, []
+        return mtime, files
+
+    @staticmethod
+    def _sync(files):
+        """Create rows for new files and flip is_active to match the directory, in a
+        transaction of its own so the caller's session is left untouched."""
+        table = Game.__table__
+        on_disk = set(files)
+        with db.engine.begin() as conn:
+            rows = conn.execute(db.select(table.c.id, table.c.filename, table.c.title, table.c.is_active)).all()
+            known = {r.filename for r in rows}
+            new = [{'filename': f, 'title': title_for(f), 'is_active': True} for f in files if f not in known]
+            if new:
+                conn.execute(table.insert(), new)
+            for active in (True, False):
+                ids = [r.id for r in rows if (r.filename in on_disk) == active and bool(r.is_active) != active]
+                if ids:
+                    conn.execute(table.update().where(table.c.id.in_(ids)).values(is_active=active))
+            if new or any(bool(r.is_active) != (r.filename in on_disk) for r in rows):
+                rows = conn.execute(db.select(table.c.id, table.c.filename, table.c.title, table.c.is_active)).all()
+        return [CatalogGame(r.id, r.filename, r.title, bool(r.is_active)) for r in rows]
+
+    def snapshot(self):
+        games_dir = self.games_dir()
+        catalog = self.cache.get(self.KEY)
+        if catalog is not None:
+            try:
+                if os.stat(games_dir).st_mtime_ns == catalog.mtime:
+                    return catalog
+            except OSError:
+                pass
+        mtime, files = self._scan(games_dir)
+        try:
+            games = self._sync(files)
+        except Exception as e:
+            # Read-only or locked database: serve the directory listing without ids
+            current_app.logger.warning(f"Game catalog sync failed: {e}")
+            games = [CatalogGame(None, f, title_for(f), True) for f in files]
+        catalog = Catalog(games, files, mtime)
+        self.cache.set(self.KEY, catalog)
+        return catalog
+
+    def invalidate(self):
+        self.cache.clear()
+
+    def filenames(self):
+        """Playable .html files, sorted."""
+        return list(self.snapshot().files)
+
+    def resolve(self, name=None, game_id=None):
+        """CatalogGame by id, exact filename, or normalized title/filename; None if unknown."""
+        catalog = self.snapshot()
+        if game_id is not None:
+            game = catalog.by_id.get(game_id)
+            if game is not None:
+                return game
+        if not name:
+            return None
+        name = name.strip()
+        return catalog.by_filename.get(name) or catalog.by_key.get(normalize_key(name))
+
+game_catalog = GameCatalog()
+invalidate_on_commit(Game, game_catalog.cache, lambda game: GameCatalog.KEY)
+
+def register(app):
+    """Apply the configured TTL."""
+    game_catalog.cache.ttl = app.config.get('GAME_CATALOG_TTL_SECONDS', 300)
 
 class GameService:
     @staticmethod
     def list_games():
-        games_dir = os.path.join(current_app.root_path, 'static', 'games')
-        try:
-            return [f for f in os.listdir(games_dir) if f.lower().endswith('.html')]
-        except Exception:
-            return []
+        return game_catalog.filenames()
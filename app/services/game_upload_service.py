@@ -0,0 +1,115 @@
+import codecs
+import hashlib
+import os
+import re
+import tempfile
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from app.models import Game, db
+from app.services.game_asset_service import game_assets
+from app.services.game_service import game_catalog, title_for
+
+CHUNK_SIZE = 64 * 1024
+# Bytes inspected to decide whether the upload is an HTML document
+SNIFF_BYTES = 4096
+HTML_MARKERS = (b'<!doctype html', b'<html', b'<head', b'<body', b'<script', b'<div', b'<canvas')
+
+class GameTooLarge(ValueError):
+    """Raised when an upload exceeds GAME_UPLOAD_MAX_BYTES."""
+
+class GameUploadService:
+    """Stores game HTML in static/games without ever exposing a partial file.
+
+    The upload is streamed in chunks to a temp file in the games directory while its size is
+    capped, its SHA-256 computed and its UTF-8 validated; only a complete, valid file is renamed
+    over the target with os.replace. The Game row, catalog and hashed assets are then updated
+    in the same call. Scripts are kept: games are self-contained JS apps written by therapists.
+    """
+
+    @staticmethod
+    def max_bytes():
+        return current_app.config.get('GAME_UPLOAD_MAX_BYTES', 2 * 1024 * 1024)
+
+    @staticmethod
+    def sanitize_name(name):
+        """Bare '<stem>.html' filename made of word characters, '-' and '.'."""
+        stem = os.path.basename((name or '').strip().replace('\\', '/'))
+        if stem.lower().endswith('.html'):
+            stem = stem[:-5]
+        stem = re.sub(r'[^\w.-]+', '_', stem).strip('._')[:90]
+        if not stem:
+            raise ValueError("Nombre de juego inválido")
+        return f"{stem}.html"
+
+    @staticmethod
+    def _validate_head(head):
+        """Reject binaries and documents that do not look like HTML."""
+        if b'\x00' in head:
+            raise ValueError("El archivo no es HTML")
+        sniff = head.lstrip(codecs.BOM_UTF8).lstrip().lower()
+        if not any(marker in sniff for marker in HTML_MARKERS):
+            raise ValueError("El archivo no es un documento HTML")
+
+    def save(self, stream, name, title=None):
+        """Stream `stream` into static/games/<name>. Returns (Game, sha256 hex digest)."""
+        filename = self.sanitize_name(name)
+        limit = self.max_bytes()
+        games_dir = game_catalog.games_dir()
+        os.makedirs(games_dir, exist_ok=True)
+
+        digest = hashlib.sha256()
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        size = 0
+        head = b''
+        fd, tmp_path = tempfile.mkstemp(dir=games_dir, prefix='.upload-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > limit:
+                        raise GameTooLarge(f"El juego supera el tamaño máximo de {limit // 1024} KB")
+                    if len(head) < SNIFF_BYTES:
+                        head += chunk[:SNIFF_BYTES - len(head)]
+                    try:
+                        decoder.decode(chunk)
+                    except UnicodeDecodeError:
+                        raise ValueError("El archivo debe estar codificado en UTF-8")
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                try:
+                    decoder.decode(b'', final=True)
+                except UnicodeDecodeError:
+                    raise ValueError("El archivo debe estar codificado en UTF-8")
+                self._validate_head(head)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, os.path.join(games_dir, filename))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        title = (title or '').strip()[:100]
+        game = Game.query.filter_by(filename=filename).first()
+        if game is None:
+            game = Game(filename=filename, title=title or title_for(filename), is_active=True)
+            db.session.add(game)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # A catalog sync registered the new file first
+                db.session.rollback()
+                game = Game.query.filter_by(filename=filename).first()
+        if title:
+            game.title = title
+        game.is_active = True
+        db.session.commit()
+        game_catalog.invalidate()
+        game_assets.publish(filename)
+        return game, digest.hexdigest()
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+from app.services.cache import TTLCache
+from app.services.password_service import LatencyRecorder
+
+class GeminiUnavailable(Exception):
+    """Raised when Gemini cannot answer now; `reason` is no_key, busy, open, timeout or error."""
+
+    def __init__(self, reason, detail=''):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+        self.detail = detail
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and lets one trial call through once
+    `reset_seconds` have passed (half-open); a success closes it again."""
+
+    def __init__(self, threshold=5, reset_seconds=30):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self.opened_at >= self.reset_seconds else 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def cancel(self):
+        """The allowed call never reached the upstream: release the trial without a verdict."""
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+class GeminiGateway:
+    """Single entry point for Gemini generateContent calls.
+
+    One pooled requests.Session per process, (connect, read) timeouts on every call, at most
+    GEMINI_MAX_CONCURRENCY calls in flight (callers wait GEMINI_QUEUE_TIMEOUT_SECONDS for a slot),
+    a circuit breaker so a failing upstream is skipped instead of tying up workers, and a TTL cache
+    of answers keyed by a hash of model, prompt and context. Callers catch GeminiUnavailable and
+    fall back to the local model.
+    """
+
+    def __init__(self):
+        self._session = None
+        self._slots = None
+        self._breaker = None
+        self.cache = TTLCache(ttl=3600, max_size=500)
+        self._lock = threading.Lock()
+        self.latency = LatencyRecorder()
+        self.counters = {'calls': 0, 'cache_hits': 0, 'busy': 0, 'short_circuited': 0, 'timeouts': 0, 'errors': 0}
+
+    def _setup(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    config = current_app.config
+                    limit = config.get('GEMINI_MAX_CONCURRENCY', 4)
+                    session = requests.Session()
+                    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=limit))
+                    session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=limit))
+                    self._slots = threading.BoundedSemaphore(limit)
+                    self._breaker = CircuitBreaker(config.get('GEMINI_BREAKER_FAILURES', 5),
+                                                   config.get('GEMINI_BREAKER_RESET_SECONDS', 30))
+                    self.cache.ttl = config.get('GEMINI_CACHE_TTL_SECONDS', 3600)
+                    self._session = session
+        return self._session
+
+    @staticmethod
+    def cache_key(model, prompt, context=None):
+        raw = json.dumps([model, prompt, context], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _extract_text(payload):
+        candidates = payload.get('candidates') or [{}]
+        parts = (candidates[0].get('content') or {}).get('parts') or [{}]
+        return parts[0].get('text') or ''
+
+    def generate(self, prompt, context=None, read_timeout=None, use_cache=True):
+        """Text answer for `prompt`; `context` is sent as JSON before it and is part of the cache key."""
+        config = current_app.config
+        api_key = config.get('GEMINI_API_KEY')
+        if not api_key:
+            raise GeminiUnavailable('no_key')
+        model = config.get('GEMINI_MODEL', 'gemini-pro')
+        key = self.cache_key(model, prompt, context)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.counters['cache_hits'] += 1
+                return cached
+
+        session = self._setup()
+        if not self._breaker.allow():
+            self.counters['short_circuited'] += 1
+            raise GeminiUnavailable('open')
+        if not self._slots.acquire(timeout=config.get('GEMINI_QUEUE_TIMEOUT_SECONDS', 2)):
+            self.counters['busy'] += 1
+            # Not the upstream's fault: no failure is counted
+            self._breaker.cancel()
+            raise GeminiUnavailable('busy')
+
+        text = f"Context: {json.dumps(context, ensure_ascii=False)}. Prompt: {prompt}" if context is not None else prompt
+        url = f"{config.get('GEMINI_API_URL', 'https://generativelanguage.googleapis.com/v1beta').rstrip('/')}/models/{model}:generateContent"
+        timeout = (config.get('GEMINI_CONNECT_TIMEOUT_SECONDS', 3), read_timeout or config.get('GEMINI_READ_TIMEOUT_SECONDS', 15))
+        started = time.perf_counter()
+        self.counters['calls'] += 1
+        try:
+            # Key in a header rather than the query string so it never shows up in access logs
+            resp = session.post(url, json={'contents': [{'parts': [{'text': text}]}]},
+                                headers={'x-goog-api-key': api_key}, timeout=timeout)
+            if resp.status_code != 200:
+                raise GeminiUnavailable('error', f"HTTP {resp.status_code}: {resp.text[:200]}")
+            answer = self._extract_text(resp.json())
+        except GeminiUnavailable:
+            self.counters['errors'] += 1
+            # Rejected requests (4xx) mean the upstream is up; only overload and outages trip the breaker
+            if resp.status_code >= 500 or resp.status_code == 429:
+                self._breaker.failure()
+            else:
+                self._breaker.success()
+            raise
+        except requests.Timeout as e:
+            self.counters['timeouts'] += 1
+            self._breaker.failure()
+            raise GeminiUnavailable('timeout', str(e))
+        except (requests.RequestException, ValueError, TypeError, AttributeError, IndexError) as e:
+            self.counters['errors'] += 1
+            self._breaker.failure()
+            raise GeminiUnavailable('error', str(e))
+        finally:
+            self._slots.release()
+            self.latency.record((time.perf_counter() - started) * 1000)
+        self._breaker.success()
+        if use_cache:
+            self.cache.set(key, answer)
+        return answer
+
+    def stats(self):
+        return {
+            'breaker': self._breaker.state if self._breaker else 'closed',
+            'latency': self.latency.summary(),
+            **self.counters
+        }
+
+gemini_gateway = GeminiGateway()
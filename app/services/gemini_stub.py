@@ -0,0 +1,85 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class _GeminiHandler(BaseHTTPRequestHandler):
+    """generateContent with a canned answer, optional delay and forced HTTP status."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            payload = json.loads(body or b'{}')
+            prompt = payload['contents'][0]['parts'][0]['text']
+        except (ValueError, KeyError, IndexError, TypeError):
+            payload, prompt = None, ''
+        server = self.server
+        server.store(self.path, self.headers.get('x-goog-api-key'), prompt)
+        if server.delay:
+            time.sleep(server.delay)
+        if not self.path.endswith(':generateContent') or payload is None:
+            return self._send(400, {'error': {'message': 'bad request'}})
+        if server.status != 200:
+            return self._send(server.status, {'error': {'message': 'stub failure'}})
+        text = server.answer if server.answer is not None else f"stub: {prompt[:200]}"
+        self._send(200, {'candidates': [{'content': {'parts': [{'text': text}]}}]})
+
+    def _send(self, status, data):
+        raw = json.dumps(data).encode('utf-8')
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out before the delayed answer was written
+            pass
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    """Local stand-in for the Gemini REST API that records every request.
+
+    Point GEMINI_API_URL at http://127.0.0.1:<port> (any GEMINI_API_KEY) to exercise the gateway's
+    timeouts, circuit breaker and cache offline:
+
+        with FakeGeminiServer(port=0, delay=0.5) as stub:
+            ...  # stub.port, stub.requests; set stub.status = 503 to simulate an outage
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=8765, delay=0.0, status=200, answer=None):
+        super().__init__((host, port), _GeminiHandler)
+        self.delay = delay
+        self.status = status
+        self.answer = answer
+        self.requests = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def store(self, path, api_key, prompt):
+        with self._lock:
+            self.requests.append({'path': path, 'api_key': api_key, 'prompt': prompt})
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='gemini-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
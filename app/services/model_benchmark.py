@@ -0,0 +1,146 @@
+import pickle
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime, timedelta
+import numpy as np
+from app.models import SessionMetrics, User, db
+from app.services.adaptive_service import AdaptiveModel, local_hour
+from app.services.ai_service import BACKENDS, expert_labels, fit_model, get_expert_label
+from app.services.password_service import LatencyRecorder
+from app.utils import get_timezone
+
+# One stored game result, in model units (accuracy 0-100, reaction time in ms)
+Play = namedtuple('Play', 'user_id game_id accuracy time_ms hour played_at')
+
+def replay_history(batch_size=1000, session=None):
+    """Every SessionMetrics row as a Play, oldest first, streamed from the database (or from
+    `session`, e.g. one bound to a copy of it)."""
+    rows = (session or db.session).query(
+        SessionMetrics.user_id, SessionMetrics.game_id, SessionMetrics.accurracy, SessionMetrics.avg_time,
+        SessionMetrics.date, User.timezone
+    ).join(User, User.id == SessionMetrics.user_id).order_by(
+        SessionMetrics.date, SessionMetrics.id
+    ).execution_options(yield_per=batch_size)
+    for user_id, game_id, accuracy, avg_time, date, timezone in rows:
+        hour = local_hour(date, get_timezone(timezone)) if date else None
+        yield Play(user_id, game_id, accuracy, avg_time * 1000, hour, date)
+
+def simulate_history(patients=200, plays=40, games=6, seed=0):
+    """Synthetic Plays for when there is little real history: each patient has a starting skill
+    that improves with practice, games have their own difficulty, mornings go slightly better
+    and every play is noisy. Sorted by time like replay_history()."""
+    rng = np.random.default_rng(seed)
+    difficulty = rng.normal(0, 8, games)
+    start = datetime(2024, 1, 1)
+    history = []
+    for user_id in range(1, patients + 1):
+        skill = rng.uniform(40, 90)
+        learning = rng.uniform(-0.2, 0.8)
+        base_time = rng.uniform(900, 2600)
+        preferred_hour = int(rng.integers(8, 20))
+        for i in range(plays):
+            game_id = int(rng.integers(games))
+            hour = int(np.clip(preferred_hour + rng.integers(-2, 3), 0, 23))
+            level = skill + learning * i - difficulty[game_id] + (3 if hour < 12 else 0)
+            accuracy = float(np.clip(level + rng.normal(0, 10), 0, 100))
+            time_ms = float(max(200.0, base_time - 10 * learning * i + 15 * difficulty[game_id] + rng.normal(0, 250)))
+            history.append(Play(user_id, game_id + 1, accuracy, time_ms, hour,
+                                start + timedelta(days=i, hours=hour, seconds=user_id)))
+    history.sort(key=lambda p: p.played_at)
+    return history
+
+def benchmark_adaptive(plays, predict, **options):
+    """Replay `plays` in time order through the global model alone and through the adaptive model
+    built on it. Each decision is scored against the expert label the patient's next play earned,
+    i.e. whether the recommended level was the right one for what came next.
+
+    `predict(accuracy, time_ms)` is the global model; `options` go to AdaptiveModel.
+    """
+    adaptive = AdaptiveModel(predict, **options)
+    latency = {'global': LatencyRecorder(size=100000), 'adaptive': LatencyRecorder(size=100000)}
+    correct = {'global': 0, 'adaptive': 0}
+    states, pending = {}, {}
+    decisions = scored = agreed = 0
+    for play in plays:
+        if play.user_id in pending:
+            target = get_expert_label(play.accuracy, play.time_ms)
+            global_code, adaptive_code = pending.pop(play.user_id)
+            correct['global'] += global_code == target
+            correct['adaptive'] += adaptive_code == target
+            scored += 1
+        state = states.get(play.user_id)
+        if state is None:
+            state = states[play.user_id] = adaptive.new_state(play.user_id)
+
+        started = time.perf_counter()
+        global_code = int(predict(play.accuracy, play.time_ms))
+        latency['global'].record((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        adaptive_code = adaptive.predict(state, play.accuracy, play.time_ms, play.game_id, play.hour)
+        adaptive.update(state, play.accuracy, play.time_ms, play.game_id, play.hour, play.played_at)
+        latency['adaptive'].record((time.perf_counter() - started) * 1000)
+
+        pending[play.user_id] = (global_code, adaptive_code)
+        decisions += 1
+        agreed += global_code == adaptive_code
+    return {
+        'patients': len(states),
+        'decisions': decisions,
+        'scored': scored,
+        'agreement': round(agreed / decisions, 4) if decisions else 0,
+        'global': {'next_play_accuracy': round(correct['global'] / scored, 4) if scored else 0,
+                   'latency': latency['global'].summary()},
+        'adaptive': {'next_play_accuracy': round(correct['adaptive'] / scored, 4) if scored else 0,
+                     'latency': latency['adaptive'].summary()}
+    }
+
+def benchmark_backends(backends=None, sizes=(0, 1000, 5000), real_data=None, predict_calls=500, eval_points=20000, seed=0):
+    """Fit each model backend the way train_model would and measure what matters for serving it.
+
+    For every training size (real points added to the synthetic base, or `real_data` as is):
+    fit time, peak Python memory while fitting, pickled model size, latency of single-row
+    predict calls as predict_level makes them, batch cost per row, and agreement with
+    get_expert_label on uniform random inputs.
+    """
+    rng = np.random.default_rng(seed)
+    X_eval = np.column_stack([rng.uniform(0, 100, eval_points), rng.uniform(200, 4000, eval_points)])
+    expected = expert_labels(X_eval[:, 0], X_eval[:, 1])
+    datasets = [real_data] if real_data is not None else [
+        np.column_stack([rng.uniform(0, 100, n), rng.uniform(200, 4000, n)]) for n in sizes
+    ]
+    results = []
+    for data in datasets:
+        for name in backends or list(BACKENDS):
+            np.random.seed(seed)
+            started = time.perf_counter()
+            model = fit_model(data, name)
+            fit_s = time.perf_counter() - started
+
+            # Traced separately: tracemalloc slows the fit down too much to time it at the same time
+            np.random.seed(seed)
+            tracemalloc.start()
+            fit_model(data, name)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            latency = LatencyRecorder(size=predict_calls)
+            for accuracy, time_ms in X_eval[:predict_calls]:
+                started = time.perf_counter()
+                model.predict([[accuracy, time_ms]])
+                latency.record((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            predicted = model.predict(X_eval)
+            batch_us = (time.perf_counter() - started) * 1e6 / eval_points
+
+            results.append({
+                'backend': name,
+                'real_points': len(data),
+                'fit_s': round(fit_s, 3),
+                'fit_peak_kb': round(peak / 1024, 1),
+                'model_kb': round(len(pickle.dumps(model)) / 1024, 1),
+                'predict': latency.summary(),
+                'batch_us_per_row': round(batch_us, 3),
+                'expert_agreement': round(float((predicted == expected).mean()), 4)
+            })
+    return results
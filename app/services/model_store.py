@@ -0,0 +1,155 @@
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import datetime
+from joblib import dump, load
+
+class ModelStore:
+    """Versioned difficulty model artifacts under one directory.
+
+        ai_models/
+          CURRENT                      id of the active version
+          PINNED                       rolled back version; while set, new versions stay inactive
+          versions/<id>/model.pkl
+          versions/<id>/grid.npz       optional compiled DecisionGrid
+          versions/<id>/meta.json      training size, backend, time, metrics...
+
+    A version is built in a temporary directory and renamed into versions/ in one step, and
+    CURRENT is replaced atomically, so readers always see a complete model. Version ids sort
+    by creation time. Only the newest `keep` versions are retained in full, and the active one
+    is never removed. Older versions that `referenced()` still names (the ones stored
+    predictions point to) are trimmed to model.pkl and meta.json instead of deleted, so
+    they stay auditable at a few KB each.
+    """
+
+    MODEL_FILE = 'model.pkl'
+    GRID_FILE = 'grid.npz'
+    META_FILE = 'meta.json'
+
+    def __init__(self, root='ai_models', keep=5, referenced=None):
+        self.root = root
+        self.keep = keep
+        self.referenced = referenced or set
+
+    @property
+    def versions_dir(self):
+        return os.path.join(self.root, 'versions')
+
+    @property
+    def pointer_path(self):
+        return os.path.join(self.root, 'CURRENT')
+
+    @property
+    def pin_path(self):
+        return os.path.join(self.root, 'PINNED')
+
+    def path(self, version, name=MODEL_FILE):
+        return os.path.join(self.versions_dir, version, name)
+
+    def _write_atomic(self, path, text):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def current(self):
+        """Active version id, None before the first publish."""
+        try:
+            with open(self.pointer_path, encoding='utf-8') as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return version if version and os.path.isdir(os.path.join(self.versions_dir, version)) else None
+
+    def publish(self, model, meta, grid=None, activate=True):
+        """Store a fitted model (and its grid) as a new version; returns its id. The version is
+        only activated when asked to and no version is pinned."""
+        os.makedirs(self.versions_dir, exist_ok=True)
+        version = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:6]}"
+        staging = tempfile.mkdtemp(dir=self.versions_dir, prefix='.tmp-')
+        try:
+            dump(model, os.path.join(staging, self.MODEL_FILE))
+            if grid is not None:
+                grid.save(os.path.join(staging, self.GRID_FILE))
+            meta = dict(meta, version=version, created_at=datetime.utcnow().isoformat())
+            with open(os.path.join(staging, self.META_FILE), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            os.replace(staging, os.path.join(self.versions_dir, version))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        if activate and self.pinned() is None:
+            self.activate(version)
+        self.prune()
+        return version
+
+    def activate(self, version):
+        """Point CURRENT at `version` (also used to roll back)."""
+        if not os.path.isdir(os.path.join(self.versions_dir, version)):
+            raise ValueError(f"Versión de modelo desconocida: {version}")
+        self._write_atomic(self.pointer_path, version)
+
+    def pinned(self):
+        """Pinned version id, None when new versions may become active."""
+        try:
+            with open(self.pin_path, encoding='utf-8') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def pin(self, version):
+        """Activate `version` and keep it active: publish() then stores new versions inactive."""
+        self.activate(version)
+        self._write_atomic(self.pin_path, version)
+
+    def unpin(self):
+        """Let the next published version become active again. Returns the version that was pinned."""
+        version = self.pinned()
+        try:
+            os.remove(self.pin_path)
+        except FileNotFoundError:
+            pass
+        return version
+
+    def versions(self):
+        """Retained version ids, oldest first."""
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return sorted(v for v in os.listdir(self.versions_dir) if not v.startswith('.'))
+
+    def meta(self, version):
+        try:
+            with open(self.path(version, self.META_FILE), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'version': version}
+
+    def update_meta(self, version, **fields):
+        meta = self.meta(version)
+        meta.update(fields)
+        self._write_atomic(self.path(version, self.META_FILE), json.dumps(meta, ensure_ascii=False, indent=2))
+        return meta
+
+    def load_model(self, version):
+        return load(self.path(version, self.MODEL_FILE))
+
+    def has_grid(self, version):
+        return os.path.exists(self.path(version, self.GRID_FILE))
+
+    def prune(self):
+        current = self.current()
+        pinned = self.pinned()
+        stale = [v for v in self.versions() if v not in (current, pinned)]
+        stale = stale[:max(0, len(stale) - (self.keep - 1 if current else self.keep))]
+        if not stale:
+            return
+        referenced = self.referenced()
+        for version in stale:
+            if version in referenced:
+                # The grid is only needed to serve; the model still answers for its predictions
+                if self.has_grid(version):
+                    os.remove(self.path(version, self.GRID_FILE))
+            else:
+                shutil.rmtree(os.path.join(self.versions_dir, version), ignore_errors=True)
@@ -1,4 +1,5 @@
 from app.repositories.notification_repository import NotificationRepository
+from datetime import datetime, timedelta
 
 class NotificationService:
     def __init__(self):
@@ -7,8 +8,19 @@ class NotificationService:
     def create_notification(self, user_id, message, link=None):
         return self.repo.create(user_id, message, link)
 
-    def get_unread_notifications(self, user_id):
-        return self.repo.get_unread_by_user(user_id)
+    def get_unread_notifications(self, user_id, limit=None, offset=0):
+        return self.repo.get_unread_by_user(user_id, limit, offset)
+
+    def get_unread_grouped(self, user_id, limit=20, offset=0):
+        return self.repo.get_unread_grouped_by_user(user_id, limit, offset)
+
+    def count_unread(self, user_id):
+        return self.repo.count_unread(user_id)
 
     def mark_all_as_read(self, user_id):
         self.repo.mark_all_read(user_id)
+
+    def purge_expired(self, retention_days):
+        """Remove read notifications older than retention_days."""
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        return self.repo.purge_read_older_than(cutoff)
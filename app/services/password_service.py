@@ -0,0 +1,144 @@
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+import bcrypt as bcrypt_lib
+from flask import current_app
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many verifications are already queued or one does not finish in time."""
+
+def _hash_password(args):
+    # Runs in worker processes/threads without an app context, so use bcrypt directly.
+    # Output is the same $2b$ format Flask-Bcrypt produces and verifies.
+    password, rounds = args
+    return bcrypt_lib.hashpw(password.encode('utf-8'), bcrypt_lib.gensalt(rounds)).decode('utf-8')
+
+def _check_password(hashed, password):
+    try:
+        return bcrypt_lib.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except (ValueError, TypeError):
+        # Malformed or legacy hash
+        return False
+
+def hash_rounds(hashed):
+    """Work factor encoded in a bcrypt hash ($2b$12$...), or None if unparseable."""
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+class LatencyRecorder:
+    """Fixed-size window of latency samples (ms) with percentile summaries."""
+
+    def __init__(self, size=1000):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, ms):
+        with self._lock:
+            self._samples.append(ms)
+            self.count += 1
+
+    def summary(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self.count
+        if not samples:
+            return {'count': count, 'p50_ms': 0, 'p95_ms': 0, 'max_ms': 0}
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 2)
+        return {'count': count, 'p50_ms': pct(0.5), 'p95_ms': pct(0.95), 'max_ms': round(samples[-1], 2)}
+
+class PasswordService:
+    """bcrypt hashing with a configurable work factor and a bounded verification pool.
+
+    bcrypt releases the GIL, so verifications run on a small thread pool instead of the
+    request thread. When more than PASSWORD_VERIFY_MAX_QUEUE checks are in flight new ones
+    are rejected with PasswordHasherBusy rather than piling up behind each other. A check that
+    outlives PASSWORD_VERIFY_TIMEOUT also raises PasswordHasherBusy, but keeps its slot until
+    bcrypt actually finishes.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.verify_latency = LatencyRecorder()
+        self.login_latency = LatencyRecorder()
+        self.rejected = 0
+
+    @staticmethod
+    def rounds():
+        return current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
+
+    def hash(self, password):
+        return _hash_password((password, self.rounds()))
+
+    def hash_many(self, passwords, workers=None):
+        """Hash many passwords across a process pool, falling back to the current process."""
+        jobs = [(p, self.rounds()) for p in passwords]
+        if len(jobs) < 4 or workers == 1:
+            return [_hash_password(job) for job in jobs]
+        try:
+            # Spawn, not fork: this process runs outbox, generation and verify threads whose locks a
+            # fork would copy mid-state
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                return list(pool.map(_hash_password, jobs))
+        except Exception as e:
+            current_app.logger.warning(f"Process pool unavailable for password hashing, hashing inline: {e}")
+            return [_hash_password(job) for job in jobs]
+
+    def needs_rehash(self, hashed):
+        rounds = hash_rounds(hashed)
+        return rounds is not None and rounds != self.rounds()
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    config = current_app.config
+                    self._slots = threading.BoundedSemaphore(config.get('PASSWORD_VERIFY_MAX_QUEUE', 32))
+                    self._executor = ThreadPoolExecutor(max_workers=config.get('PASSWORD_VERIFY_WORKERS', 4),
+                                                        thread_name_prefix='password-verify')
+        return self._executor
+
+    def verify(self, hashed, password):
+        """Check `password` against `hashed` on the verification pool."""
+        if not hashed or not password:
+            return False
+        pool = self._pool()
+        if not self._slots.acquire(blocking=False):
+            self._reject()
+            raise PasswordHasherBusy()
+        started = time.perf_counter()
+        try:
+            future = pool.submit(_check_password, hashed, password)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot belongs to the bcrypt task, not to this request: free it when the task ends
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=current_app.config.get('PASSWORD_VERIFY_TIMEOUT', 10))
+        except FutureTimeout:
+            self._reject()
+            raise PasswordHasherBusy()
+        finally:
+            self.verify_latency.record((time.perf_counter() - started) * 1000)
+
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def stats(self):
+        return {
+            'rounds': self.rounds(),
+            'login': self.login_latency.summary(),
+            'verify': self.verify_latency.summary(),
+            'rejected': self.rejected
+        }
+
+password_service = PasswordService()
@@ -0,0 +1,134 @@
+import csv
+import io
+from email_validator import validate_email, EmailNotValidError
+from flask import current_app, url_for
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from app.models import User, db
+from app.services.email_service import EmailService
+from app.services.notification_service import NotificationService
+from app.services.password_service import password_service
+
+class PatientImportService:
+    EXISTS_CHUNK = 500
+    INSERT_BATCH = 100
+
+    def __init__(self):
+        self.notification_service = NotificationService()
+
+    @staticmethod
+    def parse_csv(stream):
+        """Read rows with an `email` column and optional `username`/`nombre` column."""
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        reader = csv.DictReader(text)
+        rows = []
+        for raw in reader:
+            row = {(k or '').strip().lower(): (v or '').strip() for k, v in raw.items()}
+            rows.append({'email': row.get('email') or row.get('correo') or '',
+                         'username': row.get('username') or row.get('nombre') or ''})
+        return rows
+
+    @staticmethod
+    def _insert(users):
+        """Flush `users` inside a savepoint; on failure only they are rolled back. Returns success."""
+        try:
+            with db.session.begin_nested():
+                db.session.add_all(users)
+        except SQLAlchemyError as e:
+            current_app.logger.warning(f"Patient import batch rejected: {e}")
+            for user in users:
+                if user in db.session:
+                    db.session.expunge(user)
+            return False
+        return True
+
+    def import_patients(self, therapist, rows):
+        """Create patients for `rows` ({'email', 'username'}) and return a per-row report."""
+        report = [None] * len(rows)
+        candidates = []  # (index, email, username)
+        seen = set()
+
+        # 1. Validate syntax only; a DNS lookup per row would dominate a 300-row import
+        for i, row in enumerate(rows):
+            raw_email = (row.get('email') or '').strip().lower() if isinstance(row, dict) else ''
+            try:
+                email = validate_email(raw_email, check_deliverability=False).email.lower()
+            except EmailNotValidError:
+                report[i] = {'row': i + 1, 'email': raw_email, 'status': 'invalid', 'message': 'Correo inválido'}
+                continue
+            if email in seen:
+                report[i] = {'row': i + 1, 'email': email, 'status': 'duplicate', 'message': 'Correo repetido en el archivo'}
+                continue
+            seen.add(email)
+            username = (row.get('username') or '').strip() or email.split('@')[0]
+            candidates.append((i, email, username))
+
+        # 2. One IN query per chunk for already registered emails; stored emails may predate
+        # lowercasing, and neither IN nor the SQLite UNIQUE index ignore case
+        emails = [email for _, email, _ in candidates]
+        existing = set()
+        for start in range(0, len(emails), self.EXISTS_CHUNK):
+            chunk = emails[start:start + self.EXISTS_CHUNK]
+            existing.update(e.lower() for (e,) in db.session.query(User.email).filter(func.lower(User.email).in_(chunk)).all())
+
+        to_create = []
+        for i, email, username in candidates:
+            if email in existing:
+                report[i] = {'row': i + 1, 'email': email, 'status': 'exists', 'message': 'El correo ya está registrado'}
+            else:
+                to_create.append((i, email, username))
+
+        # 3. Hash off the request thread's CPU, then insert in batches
+        passwords = [EmailService.generate_password() for _ in to_create]
+        hashes = password_service.hash_many(passwords, current_app.config.get('PASSWORD_HASH_WORKERS'))
+        pending = [(i, email, username, password, User(
+            username=username,
+            email=email,
+            password=hashed,
+            role='jugador',
+            is_active=True,
+            assigned_therapist_id=therapist.id
+        )) for (i, email, username), password, hashed in zip(to_create, passwords, hashes)]
+        created = []  # (index, email, username, password, user)
+        try:
+            for start in range(0, len(pending), self.INSERT_BATCH):
+                batch = pending[start:start + self.INSERT_BATCH]
+                if self._insert([entry[-1] for entry in batch]):
+                    created.extend(batch)
+                    continue
+                # Something in the batch failed (e.g. an email registered meanwhile): retry row by row
+                for entry in batch:
+                    if self._insert([entry[-1]]):
+                        created.append(entry)
+                    else:
+                        i, email = entry[0], entry[1]
+                        report[i] = {'row': i + 1, 'email': email, 'status': 'error', 'message': 'No se pudo crear el paciente'}
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.error(f"Bulk patient import failed: {e}")
+            raise
+
+        # 4. Queue welcome emails in one transaction
+        email_queued = bool(created) and EmailService.send_welcome_emails(
+            [(email, password, username) for _, email, username, password, _ in created]
+        )
+        for i, email, username, password, user in created:
+            report[i] = {'row': i + 1, 'email': email, 'status': 'created', 'id': user.id,
+                         'username': username, 'password': password, 'email_queued': email_queued}
+
+        if created:
+            try:
+                self.notification_service.create_notification(
+                    therapist.id,
+                    f'Importación completada: {len(created)} pacientes agregados',
+                    url_for('therapist.patients')
+                )
+            except Exception:
+                pass
+
+        return {
+            'created': len(created),
+            'failed': len(rows) - len(created),
+            'rows': report
+        }
@@ -0,0 +1,45 @@
+import threading
+import time
+
+class TokenBucketLimiter:
+    """In-memory token bucket per key (IP, email...). Process-local by design.
+
+    Each key gets `capacity` tokens refilled at `rate` tokens per second. Idle buckets
+    are dropped once they would be full again so the table stays small.
+    """
+
+    def __init__(self, rate, capacity, max_keys=10000):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return allowed
+
+    def retry_after(self, key):
+        """Seconds until `key` has one token again."""
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.capacity, time.monotonic()))
+        missing = 1 - (tokens + (time.monotonic() - last) * self.rate)
+        return max(0, int(missing / self.rate) + 1) if missing > 0 else 0
+
+    def _prune(self, now):
+        refill_time = self.capacity / self.rate
+        for key in [k for k, (_, last) in self._buckets.items() if now - last >= refill_time]:
+            del self._buckets[key]
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
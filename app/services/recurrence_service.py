@@ -0,0 +1,297 @@
+import json
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import islice
+import pytz
+from dateutil.rrule import rrulestr, DAILY, WEEKLY, MONTHLY
+from flask import current_app, url_for
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from app.models import Appointment, AppointmentSeries, User, db
+from app.schemas import AppointmentSeriesSchema
+from app.services.game_assignment_service import GameAssignmentService
+from app.services.notification_service import NotificationService
+
+ALLOWED_FREQUENCIES = (DAILY, WEEKLY, MONTHLY)
+
+series_schema = AppointmentSeriesSchema()
+
+class Occurrence:
+    """A generated, not yet materialized occurrence of a series.
+
+    Carries the same attributes the calendar schemas read from Appointment, with id None
+    and `occurrence_start` identifying it within its series.
+    """
+    status = 'scheduled'
+    id = None
+
+    def __init__(self, series, start_time):
+        self.series = series
+        self.series_id = series.id
+        self.occurrence_start = start_time
+        self.start_time = start_time
+        self.end_time = start_time + timedelta(minutes=series.duration_minutes)
+        self.title = series.title
+        self.location = series.location
+        self.notes = series.notes
+        self.games_list = GameAssignmentService.parse_legacy(series.games)
+        self.therapist_id = series.therapist_id
+        self.patient_id = series.patient_id
+
+    @property
+    def patient(self):
+        return self.series.patient
+
+    @property
+    def therapist(self):
+        return self.series.therapist
+
+@lru_cache(maxsize=1024)
+def _compile(rule, local_dtstart):
+    return rrulestr(rule, dtstart=local_dtstart)
+
+def _timezone(name):
+    try:
+        return pytz.timezone(name) if name else pytz.UTC
+    except pytz.UnknownTimeZoneError:
+        return pytz.UTC
+
+class RecurrenceService:
+    """Recurring sessions stored once as an RRULE and expanded only for the requested window.
+
+    Rules are evaluated in the series' local timezone so a weekly 10:00 session stays at
+    10:00 across DST changes; all stored and returned datetimes are naive UTC. An occurrence
+    becomes an Appointment row (series_id + occurrence_start) only when it is edited,
+    completed or cancelled, or when the patient starts playing it.
+    """
+
+    def __init__(self):
+        self.notification_service = NotificationService()
+
+    @staticmethod
+    def normalize_rule(rule):
+        """Validate an RRULE body and return it without the RRULE: prefix.
+
+        UNTIL is interpreted in the series timezone, so a trailing Z is dropped.
+        """
+        if not isinstance(rule, str) or not rule.strip():
+            raise ValueError("Regla de recurrencia requerida")
+        rule = rule.strip()
+        if rule.upper().startswith('RRULE:'):
+            rule = rule[6:]
+        if 'DTSTART' in rule.upper() or '\n' in rule:
+            raise ValueError("La regla de recurrencia no debe incluir DTSTART")
+        rule = re.sub(r'(UNTIL=\d{8}(T\d{6})?)Z', r'\1', rule, flags=re.IGNORECASE)
+        try:
+            parsed = rrulestr(rule, dtstart=datetime(2000, 1, 1))
+        except (ValueError, TypeError):
+            raise ValueError("Regla de recurrencia inválida")
+        if parsed._freq not in ALLOWED_FREQUENCIES:
+            raise ValueError("Solo se admiten recurrencias diarias, semanales o mensuales")
+        return rule.upper()
+
+    @staticmethod
+    def _rule(series):
+        tz = _timezone(series.timezone)
+        local_start = pytz.UTC.localize(series.dtstart).astimezone(tz).replace(tzinfo=None)
+        return tz, _compile(series.rrule, local_start)
+
+    @staticmethod
+    def _to_utc(tz, local):
+        return tz.localize(local).astimezone(pytz.UTC).replace(tzinfo=None)
+
+    @staticmethod
+    def _to_local(tz, utc):
+        return pytz.UTC.localize(utc).astimezone(tz).replace(tzinfo=None)
+
+    def starts(self, series, start_dt, end_dt):
+        """UTC start times of `series` within [start_dt, end_dt]."""
+        tz, rule = self._rule(series)
+        # DST shifts move local times by at most a few hours; widen and filter in UTC
+        local = rule.between(self._to_local(tz, start_dt) - timedelta(days=1),
+                             self._to_local(tz, end_dt) + timedelta(days=1), inc=True)
+        return [t for t in (self._to_utc(tz, l) for l in local) if start_dt <= t <= end_dt]
+
+    def last_start(self, series):
+        """Start of the final occurrence, None when the rule never ends."""
+        tz, rule = self._rule(series)
+        if rule._count is None and rule._until is None:
+            return None
+        max_occurrences = current_app.config.get('RECURRENCE_MAX_OCCURRENCES', 520)
+        local = list(islice(rule, max_occurrences + 1))
+        if not local:
+            raise ValueError("La regla de recurrencia no genera ninguna sesión")
+        if len(local) > max_occurrences:
+            raise ValueError(f"La serie supera el máximo de {max_occurrences} sesiones")
+        return self._to_utc(tz, local[-1])
+
+    @staticmethod
+    def _owner_column(owner):
+        return (AppointmentSeries.therapist_id, Appointment.therapist_id) if owner == 'therapist' \
+            else (AppointmentSeries.patient_id, Appointment.patient_id)
+
+    def occurrences(self, owner, owner_id, start_dt, end_dt):
+        """Generated occurrences for a therapist's or patient's window, minus materialized ones.
+
+        Two queries regardless of the number of series: the series overlapping the window
+        (with both participants) and the (series_id, occurrence_start) keys already stored.
+        """
+        return self.occurrences_many(owner, [owner_id], start_dt, end_dt)
+
+    def occurrences_many(self, owner, owner_ids, start_dt, end_dt):
+        """occurrences() for several owners with the same two queries."""
+        series_col, _ = self._owner_column(owner)
+        series_list = AppointmentSeries.query.options(
+            joinedload(AppointmentSeries.patient).load_only(User.id, User.username, User.email),
+            joinedload(AppointmentSeries.therapist).load_only(User.id, User.username, User.email)
+        ).filter(
+            series_col.in_(owner_ids),
+            AppointmentSeries.dtstart <= end_dt,
+            or_(AppointmentSeries.until.is_(None), AppointmentSeries.until >= start_dt)
+        ).all()
+        if not series_list:
+            return []
+
+        materialized = set(db.session.query(Appointment.series_id, Appointment.occurrence_start).filter(
+            Appointment.series_id.in_([s.id for s in series_list]),
+            Appointment.occurrence_start >= start_dt,
+            Appointment.occurrence_start <= end_dt
+        ).all())
+
+        results = []
+        for series in series_list:
+            for start in self.starts(series, start_dt, end_dt):
+                if (series.id, start) not in materialized:
+                    results.append(Occurrence(series, start))
+        results.sort(key=lambda o: o.start_time)
+        return results
+
+    def fingerprint_parts(self, owner, owner_id):
+        """Aggregates that change whenever the owner's series or their overrides change."""
+        series_col, appt_col = self._owner_column(owner)
+        series_count, series_update, series_id = db.session.query(
+            func.count(AppointmentSeries.id), func.max(AppointmentSeries.updated_at), func.max(AppointmentSeries.id)
+        ).filter(series_col == owner_id).one()
+        if not series_count:
+            return (0,)
+        override_count, override_update = db.session.query(
+            func.count(Appointment.id), func.max(Appointment.updated_at)
+        ).filter(appt_col == owner_id, Appointment.series_id.isnot(None)).one()
+        return (series_count, series_update, series_id, override_count, override_update)
+
+    def create_series(self, therapist_id, data, therapist_username):
+        """Store a recurring series. One notification per participant instead of one per session."""
+        patient = User.query.get(data.get('patient_id'))
+        if not patient or patient.role != 'jugador':
+            raise ValueError("Paciente no válido")
+        start_time = data.get('start_time')
+        if not start_time:
+            raise ValueError("start_time es requerido")
+        end_time = data.get('end_time')
+        duration = data.get('duration_minutes')
+        if duration is None:
+            duration = int((end_time - start_time).total_seconds() // 60) if end_time else 60
+        try:
+            duration = int(duration)
+        except (TypeError, ValueError):
+            raise ValueError("Duración inválida")
+        if duration <= 0 or duration > 24 * 60:
+            raise ValueError("Duración inválida")
+
+        games = GameAssignmentService.normalize(data.get('games'))
+        GameAssignmentService.ensure_playable(games)
+
+        therapist = User.query.get(therapist_id)
+        series = AppointmentSeries(
+            therapist_id=therapist_id,
+            patient_id=patient.id,
+            title=data.get('title') or f"Sesión con {patient.username}",
+            location=data.get('location'),
+            notes=data.get('notes'),
+            games=json.dumps(games) if games else None,
+            rrule=self.normalize_rule(data.get('rrule')),
+            dtstart=start_time.replace(microsecond=0),
+            duration_minutes=duration,
+            timezone=data.get('timezone') or (therapist.timezone if therapist else None)
+        )
+        series.until = self.last_start(series)
+        self._ensure_free(series, bool(data.get('allow_overlap')))
+        db.session.add(series)
+        db.session.commit()
+
+        try:
+            when = start_time.strftime("%d %b %H:%M")
+            self.notification_service.create_notification(
+                therapist_id, f'Serie programada: {series.title} — desde {when}', url_for('therapist.sessions'))
+            self.notification_service.create_notification(
+                patient.id, f'Tienes nuevas sesiones recurrentes con {therapist_username} desde el {when}', url_for('patient.calendar'))
+        except Exception:
+            pass
+        return series
+
+    def _ensure_free(self, series, allow_overlap):
+        """Check the series' occurrences inside the scheduling window against the therapist's agenda."""
+        from app.services.schedule_service import ScheduleService, ScheduleConflict
+        schedule = ScheduleService()
+        index = schedule.load_index(series.therapist_id, *schedule.window())
+        duration = timedelta(minutes=series.duration_minutes)
+        found = []
+        for start in self.starts(series, max(series.dtstart, index.floor), index.horizon - duration):
+            found.extend(index.overlapping(start, start + duration))
+        if found and not allow_overlap:
+            raise ScheduleConflict(found)
+        return found
+
+    def materialize(self, series, occurrence_start):
+        """Appointment row for one occurrence, creating it if needed. Commits on creation."""
+        existing = Appointment.query.filter_by(series_id=series.id, occurrence_start=occurrence_start).first()
+        if existing:
+            return existing
+        if occurrence_start not in self.starts(series, occurrence_start, occurrence_start):
+            return None
+        appt = Appointment(
+            therapist_id=series.therapist_id,
+            patient_id=series.patient_id,
+            title=series.title,
+            start_time=occurrence_start,
+            end_time=occurrence_start + timedelta(minutes=series.duration_minutes),
+            location=series.location,
+            notes=series.notes,
+            status='scheduled',
+            series_id=series.id,
+            occurrence_start=occurrence_start
+        )
+        db.session.add(appt)
+        try:
+            # Games removed from static/games since the series was created are skipped
+            games = GameAssignmentService.playable(GameAssignmentService.parse_legacy(series.games))
+            GameAssignmentService().assign(appt, games)
+            db.session.commit()
+        except IntegrityError:
+            # Materialized concurrently by another request
+            db.session.rollback()
+            return Appointment.query.filter_by(series_id=series.id, occurrence_start=occurrence_start).first()
+        return appt
+
+    def end_series(self, series, from_dt):
+        """Stop generating occurrences at `from_dt`; already materialized sessions are kept.
+
+        Returns False when nothing would remain and the series was deleted instead.
+        """
+        remaining = self.starts(series, series.dtstart, from_dt - timedelta(microseconds=1)) \
+            if from_dt > series.dtstart else []
+        if not remaining:
+            Appointment.query.filter_by(series_id=series.id).update(
+                {Appointment.series_id: None}, synchronize_session=False)
+            db.session.delete(series)
+            db.session.commit()
+            return False
+        series.until = remaining[-1]
+        # Stop the rule itself at the last kept occurrence so expansion agrees with `until`
+        local_until = self._to_local(_timezone(series.timezone), remaining[-1])
+        parts = [p for p in series.rrule.split(';') if not p.startswith(('UNTIL=', 'COUNT='))]
+        series.rrule = ';'.join(parts + [f"UNTIL={local_until.strftime('%Y%m%dT%H%M%S')}"])
+        db.session.commit()
+        return True
@@ -0,0 +1,179 @@
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import accumulate
+import pytz
+from flask import current_app
+from app.models import Appointment, AppointmentSeries, User, db
+from app.services.cache import TTLCache, invalidate_on_commit
+from app.services.recurrence_service import RecurrenceService
+from app.utils import get_user_timezone
+
+Busy = namedtuple('Busy', 'start end appointment_id series_id title')
+
+class ScheduleConflict(ValueError):
+    """Raised when a session would overlap another one of the same therapist."""
+
+    def __init__(self, conflicts):
+        super().__init__("El horario se superpone con otra sesión del terapeuta")
+        self.conflicts = conflicts
+
+class IntervalIndex:
+    """Busy intervals sorted by start, with a running max of end times.
+
+    overlapping() bisects on the starts and walks back only while an earlier interval can
+    still reach the query start, which is O(log n + k) for the usual non-overlapping agenda.
+    """
+
+    def __init__(self, intervals, floor, horizon):
+        # By time only: an appointment and a series occurrence can share start and end, and
+        # their ids (int vs None) do not compare
+        self.items = sorted(intervals, key=lambda b: (b.start, b.end))
+        self.starts = [b.start for b in self.items]
+        self.max_end = list(accumulate((b.end for b in self.items), max))
+        self.floor = floor
+        self.horizon = horizon
+
+    def overlapping(self, start, end, ignore_id=None):
+        found = []
+        j = bisect_left(self.starts, end) - 1
+        while j >= 0 and self.max_end[j] > start:
+            busy = self.items[j]
+            if busy.end > start and (ignore_id is None or busy.appointment_id != ignore_id):
+                found.append(busy)
+            j -= 1
+        found.reverse()
+        return found
+
+    def after(self, moment):
+        """Intervals still busy at or after `moment`, in start order."""
+        j = bisect_left(self.starts, moment)
+        while j > 0 and self.max_end[j - 1] > moment:
+            j -= 1
+        return [b for b in self.items[j:] if b.end > moment]
+
+# Interval index per therapist id for the free slot search, rebuilt after any commit touching
+# their agenda in this process; double-booking checks never read it
+schedule_cache = TTLCache(ttl=300, max_size=2000)
+invalidate_on_commit(Appointment, schedule_cache, lambda appt: appt.therapist_id)
+invalidate_on_commit(AppointmentSeries, schedule_cache, lambda series: series.therapist_id)
+
+class ScheduleService:
+    """Double-booking checks and free-slot search over a therapist's agenda.
+
+    Stored sessions and generated series occurrences both count as busy; cancelled sessions
+    do not. Sessions without an end time take SCHEDULE_DEFAULT_DURATION_MINUTES. Conflict
+    checks read the database, so bookings made by other workers count; only free_slots()
+    uses the process-local cached index, where a stale answer costs a suggestion, not a
+    double booking.
+    """
+
+    # Sessions are shorter than this, so looking back this far finds every overlap
+    MAX_SESSION = timedelta(days=1)
+
+    def __init__(self):
+        self.recurrence_service = RecurrenceService()
+
+    @staticmethod
+    def _default_duration():
+        return timedelta(minutes=current_app.config.get('SCHEDULE_DEFAULT_DURATION_MINUTES', 60))
+
+    def _busy_between(self, therapist_id, start, end):
+        """Busy intervals touching [start, end) from one (therapist_id, start_time) range scan
+        plus the series occurrences in the window."""
+        default = self._default_duration()
+        rows = db.session.query(
+            Appointment.id, Appointment.start_time, Appointment.end_time, Appointment.title
+        ).filter(
+            Appointment.therapist_id == therapist_id,
+            Appointment.start_time >= start - self.MAX_SESSION,
+            Appointment.start_time < end,
+            Appointment.status != 'cancelled'
+        ).all()
+        busy = [Busy(s, e if e and e > s else s + default, appt_id, None, title) for appt_id, s, e, title in rows]
+        busy.extend(Busy(o.start_time, o.end_time, None, o.series_id, o.title)
+                    for o in self.recurrence_service.occurrences('therapist', therapist_id, start - self.MAX_SESSION, end))
+        return [b for b in busy if b.end > start]
+
+    @staticmethod
+    def window():
+        """(floor, horizon): yesterday to RECURRENCE_LOOKAHEAD_DAYS ahead."""
+        now = datetime.utcnow()
+        return now - timedelta(days=1), now + timedelta(days=current_app.config.get('RECURRENCE_LOOKAHEAD_DAYS', 90))
+
+    def load_index(self, therapist_id, start, end):
+        """Index of [start, end) read from the database, not cached."""
+        return IntervalIndex(self._busy_between(therapist_id, start, end), start, end)
+
+    def index(self, therapist_id):
+        """Warm (or cached) index of window(), for the free slot search only."""
+        index = schedule_cache.get(therapist_id)
+        if index is None:
+            index = self.load_index(therapist_id, *self.window())
+            schedule_cache.set(therapist_id, index)
+        return index
+
+    def conflicts(self, therapist_id, start, end=None, ignore_id=None):
+        """Sessions of `therapist_id` overlapping [start, end), from one indexed range scan."""
+        end = end if end and end > start else start + self._default_duration()
+        return self.load_index(therapist_id, start, end).overlapping(start, end, ignore_id)
+
+    def ensure_free(self, therapist_id, start, end=None, ignore_id=None, allow_overlap=False):
+        """Raise ScheduleConflict on overlap unless `allow_overlap`; returns the conflicts."""
+        found = self.conflicts(therapist_id, start, end, ignore_id)
+        if found and not allow_overlap:
+            raise ScheduleConflict(found)
+        return found
+
+    def _working_start(self, moment, duration, tz):
+        """First instant >= `moment` where `duration` fits inside working hours, or None."""
+        config = current_app.config
+        day_start = config.get('SCHEDULE_WORKDAY_START_HOUR', 8)
+        day_end = config.get('SCHEDULE_WORKDAY_END_HOUR', 20)
+        workdays = config.get('SCHEDULE_WORKDAYS', (0, 1, 2, 3, 4))
+        local = pytz.UTC.localize(moment).astimezone(tz).replace(tzinfo=None)
+        for _ in range(15):
+            opening = local.replace(hour=day_start, minute=0, second=0, microsecond=0)
+            closing = local.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(hours=day_end)
+            if local.weekday() in workdays:
+                candidate = max(local, opening)
+                if candidate + duration <= closing:
+                    return tz.localize(candidate).astimezone(pytz.UTC).replace(tzinfo=None)
+            local = (local + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return None
+
+    @staticmethod
+    def _align(moment, step):
+        seconds = step.total_seconds()
+        epoch = datetime(1970, 1, 1)
+        remainder = (moment - epoch).total_seconds() % seconds
+        return moment + timedelta(seconds=seconds - remainder) if remainder else moment
+
+    def free_slots(self, therapist_id, duration_minutes, after=None, count=5):
+        """Next `count` free slots of `duration_minutes` inside the therapist's working hours.
+
+        Walks the gaps of the warm index once, so the cost is the number of busy intervals
+        between `after` and the last slot returned.
+        """
+        duration = timedelta(minutes=duration_minutes)
+        step = timedelta(minutes=current_app.config.get('SCHEDULE_SLOT_STEP_MINUTES', 15))
+        therapist = User.query.get(therapist_id)
+        tz = get_user_timezone(therapist)
+        index = self.index(therapist_id)
+        candidate = max(after or datetime.utcnow(), index.floor)
+
+        slots = []
+        busy = iter(index.after(candidate))
+        upcoming = next(busy, None)
+        while len(slots) < count:
+            candidate = self._working_start(self._align(candidate, step), duration, tz)
+            if candidate is None or candidate + duration > index.horizon:
+                break
+            if upcoming is not None and upcoming.start < candidate + duration:
+                # Gap too small: jump past this interval
+                candidate = max(candidate, upcoming.end)
+                upcoming = next(busy, None)
+                continue
+            slots.append({'start': candidate, 'end': candidate + duration})
+            candidate += duration
+        return slots
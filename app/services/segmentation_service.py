@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+import numpy as np
+from flask import current_app
+from sqlalchemy import case, func, insert
+from app.models import PatientSegment, SessionMetrics, User, db
+
+class SegmentationService:
+    """Groups patients by how they play, for the therapist analytics page.
+
+    One GROUP BY over session_metrics builds a feature vector per patient (average accuracy and
+    reaction time, accuracy spread, recent change, share of support decisions). The vectors are
+    standardized and clustered with MiniBatchKMeans, whose cost grows linearly with the number of
+    patients. Assignments replace the previous run in patient_segment. Meant to run from cron
+    (`flask segment-patients`), not per request.
+    """
+
+    FEATURES = ('avg_accuracy', 'avg_time_ms', 'accuracy_std', 'recent_delta', 'support_rate')
+
+    @staticmethod
+    def segment_names(k):
+        middle = {0: [], 1: ['Intermedio'], 2: ['Intermedio alto', 'Intermedio bajo']}.get(
+            k - 2, [f'Intermedio {i}' for i in range(1, k - 1)])
+        return (['Alto rendimiento'] + middle + ['Necesita apoyo'])[:k]
+
+    def features(self, recent_days=30, min_plays=3):
+        """(user_ids, plays, matrix with one FEATURES row per patient) of patients with `min_plays` plays."""
+        cutoff = datetime.utcnow() - timedelta(days=recent_days)
+        accuracy = SessionMetrics.accurracy
+        rows = db.session.query(
+            SessionMetrics.user_id,
+            func.count(SessionMetrics.id),
+            func.avg(accuracy),
+            func.avg(SessionMetrics.avg_time),
+            func.avg(accuracy * accuracy),
+            func.avg(case((SessionMetrics.date >= cutoff, accuracy))),
+            func.avg(case((SessionMetrics.prediction == 2, 1.0), else_=0.0))
+        ).join(User, User.id == SessionMetrics.user_id).filter(
+            User.role == 'jugador'
+        ).group_by(SessionMetrics.user_id).having(func.count(SessionMetrics.id) >= min_plays).all()
+        if not rows:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty((0, len(self.FEATURES)))
+
+        data = np.array(rows, dtype=float)  # NULL recent averages become nan
+        avg_accuracy = data[:, 2]
+        recent = data[:, 5]
+        X = np.column_stack([
+            avg_accuracy,
+            data[:, 3] * 1000,
+            np.sqrt(np.maximum(data[:, 4] - avg_accuracy ** 2, 0)),
+            np.where(np.isnan(recent), 0.0, recent - avg_accuracy),
+            data[:, 6]
+        ])
+        return data[:, 0].astype(int), data[:, 1].astype(int), X
+
+    def run(self):
+        """Recompute every patient's segment. Returns the number of patients segmented."""
+        config = current_app.config
+        user_ids, plays, X = self.features(config.get('AI_SEGMENT_RECENT_DAYS', 30),
+                                           config.get('AI_SEGMENT_MIN_PLAYS', 3))
+        k = config.get('AI_SEGMENT_CLUSTERS', 4)
+        if len(user_ids) < k:
+            current_app.logger.info(f"Segmentation skipped: {len(user_ids)} patients for {k} segments")
+            return 0
+
+        from sklearn.cluster import MiniBatchKMeans
+        mean, std = X.mean(axis=0), X.std(axis=0)
+        std[std == 0] = 1.0
+        Z = (X - mean) / std
+        kmeans = MiniBatchKMeans(n_clusters=k, batch_size=1024, n_init=3, random_state=0).fit(Z)
+
+        # Rank segments by performance: accurate, fast and rarely sent to support first
+        centers = kmeans.cluster_centers_
+        score = centers[:, 0] - centers[:, 1] - centers[:, 4]
+        rank = np.empty(k, dtype=int)
+        rank[np.argsort(-score)] = np.arange(k)
+        segments = rank[kmeans.labels_]
+        distances = np.linalg.norm(Z - centers[kmeans.labels_], axis=1)
+        names = self.segment_names(k)
+
+        now = datetime.utcnow()
+        rows = [{
+            'user_id': int(user_id), 'segment': int(segment), 'name': names[segment], 'plays': int(n),
+            'avg_accuracy': float(f[0]), 'avg_time_ms': float(f[1]), 'accuracy_std': float(f[2]),
+            'recent_delta': float(f[3]), 'support_rate': float(f[4]), 'distance': float(d), 'computed_at': now
+        } for user_id, segment, n, f, d in zip(user_ids, segments, plays, X, distances)]
+        db.session.query(PatientSegment).delete(synchronize_session=False)
+        db.session.execute(insert(PatientSegment), rows)
+        db.session.commit()
+        return len(rows)
+
+    @staticmethod
+    def summary(therapist_id=None, names_per_segment=8):
+        """Segments of the last run with their averages and, for `therapist_id`, their own patients."""
+        segments = db.session.query(
+            PatientSegment.segment, PatientSegment.name, func.count(PatientSegment.user_id),
+            func.avg(PatientSegment.avg_accuracy), func.avg(PatientSegment.avg_time_ms),
+            func.avg(PatientSegment.support_rate), func.max(PatientSegment.computed_at)
+        ).group_by(PatientSegment.segment, PatientSegment.name).order_by(PatientSegment.segment).all()
+        own = {}
+        if therapist_id is not None:
+            for segment, username, email in db.session.query(
+                PatientSegment.segment, User.username, User.email
+            ).join(User, User.id == PatientSegment.user_id).filter(
+                User.assigned_therapist_id == therapist_id
+            ).order_by(PatientSegment.segment, PatientSegment.distance):
+                own.setdefault(segment, []).append(username or email)
+        return {
+            'computed_at': max((s[6] for s in segments), default=None),
+            'segments': [{
+                'segment': segment,
+                'name': name,
+                'patients': count,
+                'avg_accuracy': round(avg_accuracy or 0, 1),
+                'avg_time_s': round((avg_time_ms or 0) / 1000, 2),
+                'support_rate': round((support_rate or 0) * 100),
+                'my_patients': own.get(segment, [])[:names_per_segment],
+                'my_patients_total': len(own.get(segment, []))
+            } for segment, name, count, avg_accuracy, avg_time_ms, support_rate, _ in segments]
+        }
@@ -0,0 +1,106 @@
+import base64
+import socketserver
+import threading
+from email import message_from_bytes
+from email.policy import default as default_policy
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP (EHLO, AUTH, MAIL, RCPT, DATA) for smtplib/Flask-Mail."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply('220 moscowle-sink ESMTP')
+        sender, recipients = None, []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            verb = line.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-moscowle-sink')
+                self.reply('250 AUTH PLAIN LOGIN')
+            elif verb == 'HELO':
+                self.reply('250 moscowle-sink')
+            elif verb == 'AUTH':
+                parts = line.split()
+                if len(parts) == 2 and parts[1].upper() == 'LOGIN':
+                    # Username and password prompts; any credentials are accepted
+                    self.reply('334 ' + base64.b64encode(b'Username:').decode())
+                    self.rfile.readline()
+                    self.reply('334 ' + base64.b64encode(b'Password:').decode())
+                    self.rfile.readline()
+                self.reply('235 Authentication successful')
+            elif verb == 'MAIL':
+                sender, recipients = line.split(':', 1)[1].strip().strip('<>'), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(line.split(':', 1)[1].strip().strip('<>'))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                chunks = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b'.\r\n', b'.\n'):
+                        break
+                    if data_line.startswith(b'..'):
+                        data_line = data_line[1:]
+                    chunks.append(data_line)
+                self.server.store(sender, recipients, b''.join(chunks))
+                self.reply('250 OK: queued')
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    """Local SMTP sink that keeps every received message in memory.
+
+    Point MAIL_SERVER/MAIL_PORT at it (MAIL_USE_TLS=False) to exercise the email outbox offline:
+
+        with FakeSMTPServer(port=0) as sink:
+            ...  # sink.port, sink.messages
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=1025):
+        super().__init__((host, port), _SMTPHandler)
+        self.messages = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def store(self, sender, recipients, data):
+        msg = message_from_bytes(data, policy=default_policy)
+        with self._lock:
+            self.messages.append({
+                'sender': sender,
+                'recipients': list(recipients),
+                'subject': msg['subject'],
+                'body': msg.get_body(('plain',)).get_content() if msg.get_body(('plain',)) else '',
+            })
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='smtp-sink', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
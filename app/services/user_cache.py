@@ -0,0 +1,86 @@
+from flask_login import UserMixin
+from app.extensions import db
+from app.models import User
+from app.services.cache import TTLCache, invalidate_on_commit
+
+SLIM_FIELDS = ('id', 'role', 'is_active', 'username', 'email', 'timezone', 'assigned_therapist_id')
+
+class UserIdentityCache(TTLCache):
+    """Slim user rows keyed by user id.
+
+    Entries are dropped after every commit that touches the user, the TTL only bounds
+    staleness across worker processes.
+    """
+
+    def load(self, user_id):
+        """Slim row for `user_id` from cache or a single narrow SELECT. None if missing."""
+        data = self.get(user_id)
+        if data is None:
+            row = db.session.query(*[getattr(User, f) for f in SLIM_FIELDS]).filter(User.id == user_id).first()
+            if row is None:
+                return None
+            data = dict(zip(SLIM_FIELDS, row))
+            self.set(user_id, data)
+        return data
+
+user_cache = UserIdentityCache()
+
+def _slim_property(name):
+    def getter(self):
+        user = object.__getattribute__(self, '_user')
+        if user is not None:
+            return getattr(user, name)
+        return object.__getattribute__(self, '_data')[name]
+    return property(getter)
+
+class CachedUser(UserMixin):
+    """current_user backed by the slim cache.
+
+    The slim fields are served without touching the database. Any other attribute read
+    or any write loads the full `User` row once for the rest of the request and delegates
+    to it, so profile updates through current_user keep working.
+    """
+
+    def __init__(self, data):
+        object.__setattr__(self, '_data', data)
+        object.__setattr__(self, '_user', None)
+
+    @property
+    def instance(self):
+        user = object.__getattribute__(self, '_user')
+        if user is None:
+            user = db.session.get(User, object.__getattribute__(self, '_data')['id'])
+            object.__setattr__(self, '_user', user)
+        return user
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        user = self.instance
+        if user is None:
+            raise AttributeError(name)
+        return getattr(user, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.instance, name, value)
+
+    def __eq__(self, other):
+        if isinstance(other, (CachedUser, User)):
+            return self.id == other.id
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
+for _field in SLIM_FIELDS:
+    setattr(CachedUser, _field, _slim_property(_field))
+
+def load_cached_user(user_id):
+    data = user_cache.load(int(user_id))
+    return CachedUser(data) if data else None
+
+invalidate_on_commit(User, user_cache, lambda user: user.id)
+
+def register(app):
+    """Apply the configured TTL."""
+    user_cache.ttl = app.config.get('USER_CACHE_TTL_SECONDS', 30)
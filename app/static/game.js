@@ -73,8 +73,9 @@ function endGame(){
             'Content-Type': 'application/json'
         },
         body: JSON.stringify({
-            average_time: avgTime,
-            accuracy: accuracy
+            avg_time: avgTime / 1000,
+            accuracy: accuracy,
+            reaction_times: reactionTimes
         })
     }).then(response => response.json())
       .then(data => {
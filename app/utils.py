@@ -1,15 +1,19 @@
 from datetime import datetime, timedelta
 import pytz
 
-def get_user_timezone(user):
-    """Helper to get a pytz timezone object from user."""
-    if not user or not user.timezone:
+def get_timezone(name):
+    """pytz timezone for an IANA name, UTC when it is empty or unknown."""
+    if not name:
         return pytz.UTC
     try:
-        return pytz.timezone(user.timezone)
+        return pytz.timezone(name)
     except pytz.UnknownTimeZoneError:
         return pytz.UTC
 
+def get_user_timezone(user):
+    """Helper to get a pytz timezone object from user."""
+    return get_timezone(user.timezone if user else None)
+
 def get_user_now(user):
     """
     Returns the current datetime for the user based on their timezone.
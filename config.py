@@ -8,6 +8,66 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI', 'sqlite:///moscowle.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+    GEMINI_API_URL = os.getenv('GEMINI_API_URL', 'https://generativelanguage.googleapis.com/v1beta')
+    GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-pro')
+    # Gateway limits: timeouts (s), calls in flight, circuit breaker and answer cache
+    GEMINI_CONNECT_TIMEOUT_SECONDS = float(os.getenv('GEMINI_CONNECT_TIMEOUT_SECONDS', 3))
+    GEMINI_READ_TIMEOUT_SECONDS = float(os.getenv('GEMINI_READ_TIMEOUT_SECONDS', 15))
+    GEMINI_GENERATE_TIMEOUT_SECONDS = float(os.getenv('GEMINI_GENERATE_TIMEOUT_SECONDS', 45))
+    GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', 4))
+    GEMINI_QUEUE_TIMEOUT_SECONDS = 2
+    GEMINI_BREAKER_FAILURES = int(os.getenv('GEMINI_BREAKER_FAILURES', 5))
+    GEMINI_BREAKER_RESET_SECONDS = int(os.getenv('GEMINI_BREAKER_RESET_SECONDS', 30))
+    GEMINI_CACHE_TTL_SECONDS = int(os.getenv('GEMINI_CACHE_TTL_SECONDS', 3600))
+
+    # Start the email outbox and game generation threads in serving processes; with False only
+    # the cron commands (`flask send-emails`, `flask run-generation-jobs`) process the queues
+    START_BACKGROUND_WORKERS = os.getenv('START_BACKGROUND_WORKERS', 'True') == 'True'
+
+    # Background AI game generation: worker threads per process (= max concurrent generations)
+    GAME_GENERATION_WORKERS = int(os.getenv('GAME_GENERATION_WORKERS', 2))
+    GAME_GENERATION_MAX_ACTIVE_PER_USER = int(os.getenv('GAME_GENERATION_MAX_ACTIVE_PER_USER', 3))
+    GAME_GENERATION_POLL_SECONDS = 5
+    GAME_GENERATION_LEASE_SECONDS = 300
+    GAME_GENERATION_MAX_ATTEMPTS = 2
+
+    # Plays kept verbatim per patient in GameProfile.recent; older ones only live in the running sums
+    GAME_PROFILE_RECENT_LIMIT = int(os.getenv('GAME_PROFILE_RECENT_LIMIT', 50))
+
+    # Difficulty model estimator (ai_service.BACKENDS: svc, logreg, gbt, tree); compare them with
+    # `flask benchmark-models`
+    AI_MODEL_BACKEND = os.getenv('AI_MODEL_BACKEND', 'tree')
+    # Model versions kept in full under ai_models/versions (`flask model-versions`, `flask model-rollback`);
+    # older ones still named by session_metrics.model_version keep only model.pkl and meta.json
+    AI_MODEL_KEEP_VERSIONS = int(os.getenv('AI_MODEL_KEEP_VERSIONS', 5))
+    # Answer predict_level from a lookup table compiled at each retrain (ai_models/versions/<id>/grid.npz)
+    AI_DECISION_GRID = os.getenv('AI_DECISION_GRID', 'True') == 'True'
+    AI_GRID_ACCURACY_STEP = float(os.getenv('AI_GRID_ACCURACY_STEP', 0.5))
+    AI_GRID_TIME_STEP_MS = float(os.getenv('AI_GRID_TIME_STEP_MS', 10))
+    AI_GRID_MAX_TIME_MS = float(os.getenv('AI_GRID_MAX_TIME_MS', 5000))
+    # Walk-forward windows of `flask evaluate-model` (train on the past, score the next window)
+    AI_EVAL_FOLDS = int(os.getenv('AI_EVAL_FOLDS', 5))
+
+    # Patient segmentation (`flask segment-patients`): number of segments, plays a patient needs
+    # to be segmented and the window of the "recent accuracy" feature
+    AI_SEGMENT_CLUSTERS = int(os.getenv('AI_SEGMENT_CLUSTERS', 4))
+    AI_SEGMENT_MIN_PLAYS = int(os.getenv('AI_SEGMENT_MIN_PLAYS', 3))
+    AI_SEGMENT_RECENT_DAYS = int(os.getenv('AI_SEGMENT_RECENT_DAYS', 30))
+
+    # Fatigue detection from per-trial reaction times sent with save_game: trials needed, trials
+    # kept, slowdown and variance drift that count as full fatigue, and the score that alerts the
+    # therapist and stops the adaptive model from raising the level
+    FATIGUE_MIN_TRIALS = int(os.getenv('FATIGUE_MIN_TRIALS', 6))
+    FATIGUE_MAX_TRIALS = int(os.getenv('FATIGUE_MAX_TRIALS', 2000))
+    FATIGUE_SLOWDOWN = float(os.getenv('FATIGUE_SLOWDOWN', 0.3))
+    FATIGUE_VARIANCE_DRIFT = float(os.getenv('FATIGUE_VARIANCE_DRIFT', 0.2))
+    FATIGUE_ALERT_SCORE = float(os.getenv('FATIGUE_ALERT_SCORE', 0.6))
+
+    # Adaptive difficulty: EWMA smoothing per play, plays before personalization kicks in and
+    # weight of the current play against the patient's running level
+    ADAPTIVE_EWMA_ALPHA = float(os.getenv('ADAPTIVE_EWMA_ALPHA', 0.3))
+    ADAPTIVE_MIN_PLAYS = int(os.getenv('ADAPTIVE_MIN_PLAYS', 5))
+    ADAPTIVE_CURRENT_WEIGHT = float(os.getenv('ADAPTIVE_CURRENT_WEIGHT', 0.3))
 
     # Email configuration
     MAIL_SERVER = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
@@ -17,6 +77,61 @@ class Config:
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.getenv('MAIL_DEFAULT_SENDER')
 
+    # Email outbox (background delivery)
+    EMAIL_OUTBOX_WORKERS = int(os.getenv('EMAIL_OUTBOX_WORKERS', 1))
+    EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', 20))
+    EMAIL_OUTBOX_POLL_SECONDS = int(os.getenv('EMAIL_OUTBOX_POLL_SECONDS', 5))
+    EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+    EMAIL_OUTBOX_BACKOFF_SECONDS = 30
+    EMAIL_OUTBOX_MAX_BACKOFF_SECONDS = 3600
+    EMAIL_OUTBOX_LEASE_SECONDS = 300
+    # Days sent and failed messages stay in the outbox (`flask purge-emails`)
+    EMAIL_OUTBOX_RETENTION_DAYS = int(os.getenv('EMAIL_OUTBOX_RETENTION_DAYS', 30))
+
+    # Password hashing
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+    PASSWORD_VERIFY_WORKERS = int(os.getenv('PASSWORD_VERIFY_WORKERS', 4))
+    PASSWORD_VERIFY_MAX_QUEUE = int(os.getenv('PASSWORD_VERIFY_MAX_QUEUE', 32))
+    PASSWORD_VERIFY_TIMEOUT = 10
+    AUTH_VALIDATE_IP_PER_MINUTE = int(os.getenv('AUTH_VALIDATE_IP_PER_MINUTE', 20))
+    AUTH_VALIDATE_IP_BURST = 10
+    AUTH_VALIDATE_EMAIL_PER_MINUTE = int(os.getenv('AUTH_VALIDATE_EMAIL_PER_MINUTE', 5))
+    AUTH_VALIDATE_EMAIL_BURST = 5
+
+    # Identity cache used by the Flask-Login user loader
+    USER_CACHE_TTL_SECONDS = int(os.getenv('USER_CACHE_TTL_SECONDS', 30))
+    # Per-therapist cache of /api/sessions/upcoming
+    UPCOMING_SESSIONS_CACHE_TTL_SECONDS = int(os.getenv('UPCOMING_SESSIONS_CACHE_TTL_SECONDS', 60))
+    # Game catalog (static/games joined with the Game table); directory changes are detected on read
+    GAME_CATALOG_TTL_SECONDS = int(os.getenv('GAME_CATALOG_TTL_SECONDS', 300))
+    # Content-hashed, precompressed game copies (default: <instance>/game_assets)
+    GAME_ASSETS_DIR = os.getenv('GAME_ASSETS_DIR')
+    GAME_ASSETS_MAX_AGE_SECONDS = int(os.getenv('GAME_ASSETS_MAX_AGE_SECONDS', 365 * 24 * 3600))
+    # Largest game HTML accepted by /api/games/upload
+    GAME_UPLOAD_MAX_BYTES = int(os.getenv('GAME_UPLOAD_MAX_BYTES', 2 * 1024 * 1024))
+
+    # Recurring series: cap for bounded rules and how far open lists look ahead
+    RECURRENCE_MAX_OCCURRENCES = int(os.getenv('RECURRENCE_MAX_OCCURRENCES', 520))
+    RECURRENCE_LOOKAHEAD_DAYS = int(os.getenv('RECURRENCE_LOOKAHEAD_DAYS', 90))
+
+    # Double-booking checks and free slot search (working hours in the therapist's timezone)
+    SCHEDULE_DEFAULT_DURATION_MINUTES = int(os.getenv('SCHEDULE_DEFAULT_DURATION_MINUTES', 60))
+    SCHEDULE_SLOT_STEP_MINUTES = int(os.getenv('SCHEDULE_SLOT_STEP_MINUTES', 15))
+    SCHEDULE_WORKDAY_START_HOUR = int(os.getenv('SCHEDULE_WORKDAY_START_HOUR', 8))
+    SCHEDULE_WORKDAY_END_HOUR = int(os.getenv('SCHEDULE_WORKDAY_END_HOUR', 20))
+    SCHEDULE_WORKDAYS = tuple(int(d) for d in os.getenv('SCHEDULE_WORKDAYS', '0,1,2,3,4').split(','))  # Monday = 0
+    # Largest window the admin availability search accepts
+    AVAILABILITY_MAX_DAYS = int(os.getenv('AVAILABILITY_MAX_DAYS', 31))
+
+    # Bulk patient import
+    PATIENT_IMPORT_MAX_ROWS = int(os.getenv('PATIENT_IMPORT_MAX_ROWS', 1000))
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 0)) or None  # None = one per CPU
+
+    # Notification retention
+    NOTIFICATION_RETENTION_DAYS = int(os.getenv('NOTIFICATION_RETENTION_DAYS', 30))
+    NOTIFICATIONS_PER_PAGE = int(os.getenv('NOTIFICATIONS_PER_PAGE', 20))
+    NOTIFICATIONS_MAX_PER_PAGE = 100
+
 class DevelopmentConfig(Config):
     DEBUG = True
 
@@ -26,3 +141,6 @@ class ProductionConfig(Config):
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    START_BACKGROUND_WORKERS = False
+    EMAIL_OUTBOX_WORKERS = 0
+    GAME_GENERATION_WORKERS = 0
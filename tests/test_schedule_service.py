@@ -0,0 +1,13 @@
+from datetime import datetime, timedelta
+from app.services.schedule_service import Busy, IntervalIndex
+
+def test_appointment_and_occurrence_with_same_times():
+    start = datetime(2025, 1, 6, 10, 0)
+    end = start + timedelta(hours=1)
+    appointment = Busy(start, end, 7, None, 'Sesión')
+    occurrence = Busy(start, end, None, 3, 'Serie')
+    index = IntervalIndex([occurrence, appointment], start - timedelta(days=1), end + timedelta(days=1))
+
+    assert set(index.overlapping(start, end)) == {appointment, occurrence}
+    assert index.overlapping(start, end, ignore_id=7) == [occurrence]
+    assert index.overlapping(end, end + timedelta(hours=1)) == []